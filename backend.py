@@ -3,16 +3,41 @@
 Backend server for handling MinIO-based file-system requests.
 """
 
-import glob
+import errno
 import io
 import multiprocessing as mp
 import os
-import tempfile
-import time
 import queue
-
-from implementations import handle_io_request
-
+import threading
+
+import minio
+
+from bridge import send_metadata
+from decompress import should_decompress
+from implementations import get_minio_client, send_output_int8
+from invalidation import (
+    Invalidator,
+    diff_events,
+    list_metadata,
+    listing_diff_events,
+    notification_events,
+    reconnecting_events,
+)
+from metadata_index import (
+    MetadataIndex,
+    metadata_from_minio,
+    revalidate_index,
+    snapshot_loop,
+)
+from metadata_store import MetadataStore
+from partial_rewrite import remove_stale_parts
+from shared_cache import SharedCacheClient
+import ringlog
+from tracing import time_ns
+from worker_pool import WorkerPool
+
+MSG_WAIT_OPERATION = ringlog.register("Wait for operation #{} to perform.")
+MSG_OPERATION = ringlog.register("Operation #{} is {} on object {}.")
 
 # Operations that maintain file state.
 KEEP_STATE_OPS = [
@@ -25,148 +50,17 @@ KEEP_STATE_OPS = [
 ]
 
 # Operations that get metadata.
-GET_METADATA_OPS = ["access", "list_dir"]
+GET_METADATA_OPS = ["getattr", "access", "list_dir"]
 
 # Operations that modify paths.
 MODIFY_PATH_OPS = ["mkdir", "rmdir", "unlink"]
 
+# Operations rejected in read-only mode.
+READ_ONLY_REJECT_OPS = ["write", "create", "truncate", "mkdir", "rmdir", "unlink"]
 
-class FileObject:
-    """
-    Object in the MinIO remote file-system.
-    Operations on this object are done in a new process.
-    """
-
-    def __init__(self, minio_path: str, config: dict, metadata: dict | None = None):
-        self.minio_path = minio_path
-        self.config = config
-        self.queue_in = None
-        self.queue_out = None
-        self.process = None
-        self.last_modified = time.time()
-        self.metadata_cache = metadata
-        self.num_requests_sent = 0
-        self.num_requests_done = 0
-
-    def get_cached_metadata(self):
-        """
-        Returns metadata dictionary about the current object, if available.
-        If not available, instead need to query process.
-        Updates the last modified time as well.
-        """
-        self.last_modified = time.time()
-        return self.metadata_cache
-
-    def init_queues(self):
-        """
-        Initializes the input and output queues, if necessary.
-        Updates the last modified time.
-        """
-        if self.queue_in is None:
-            self.queue_in = mp.Queue()
-            self.queue_out = mp.Queue()
-
-    def cleanup_process(self):
-        """
-        If process is no longer alive, clean-up the process.
-        Does not update last modified time.
-        """
-        if self.process is not None and not self.process.is_alive():
-            print(
-                (
-                    f"Process with PID {self.process.pid} exited with return "
-                    f"code {self.process.exitcode}, for path {self.minio_path}."
-                )
-            )
-            self.process = None
-
-    def start_process(self):
-        """
-        Starts (or re-starts) the process associated with this file.
-        Updates the last modified time.
-        """
-        if self.process is None:
-            self.init_queues()
-            self.metadata_cache = None
-            self.process = mp.Process(
-                target=object_process,
-                args=(
-                    self.minio_path,
-                    self.queue_in,
-                    self.queue_out,
-                    self.config,
-                ),
-            )
-            print(
-                f"Start process with PID {self.process.pid}, for path {self.minio_path}."
-            )
-        self.last_modified = time.time()
-
-    def send_request(self, operation: str, pipe_in: str, pipe_out: str):
-        """
-        Send request with specified operation and pipes to use by adding to queue.
-        Updates the last modified time.
-        """
-
-        self.init_queues()
-        self.queue_in.put(
-            {
-                "operation": operation,
-                "pipe_in": pipe_in,
-                "pipe_out": pipe_out,
-            }
-        )
-
-        # Update last modified time and certain metadata.
-        self.last_modified = time.time()
-        self.num_requests_sent += 1
-
-    def update_with_output(self, full_db: dict):
-        """
-        Get any outputs from the process and update necessary information.
-        Reach response updates last modified time.
-        """
-
-        # If no queue for file, nothing to do.
-        if self.queue_out is None:
-            return
-
-        # Get any new outputs from process available.
-        while not self.queue_out.empty():
-            r = self.queue_out.get()
-
-            # Indicate existing process done.
-            if "is_done" in r and r["is_done"]:
-                self.num_requests_done += 1
-
-            # Update metadata in current object (can be None to delete existing).
-            if "metadata_cur" in r:
-                self.metadata_cache = r["metadata_cur"]
-
-            # Create new metadata object, if doesn't already exist.
-            if "metadata_new" in r:
-                meta_new = r["metadata_new"]
-                path_new = meta_new["minio_path"]
-                if path_new not in full_db:
-                    full_db[path_new] = FileObject(path_new, self.config, meta_new)
-
-            # Update last modified if any such operation performed.
-            self.last_modified = time.time()
-
-    def delete_inactive(self, full_db: dict, age_delete_inactive: float):
-        """
-        If process exited and too old last modified, remove from database.
-        """
-        max_age = self.last_modified + age_delete_inactive
-        if self.process is None and (time.time() > max_age):
-            # Destroy queues.
-            if self.queue_in is not None:
-                self.queue_in.close()
-            if self.queue_out is not None:
-                self.queue_out.close()
-
-            # Remove from database.
-            full_db.pop(self.minio_path, None)
+# Operations rejected on objects presented decompressed, which would otherwise
+# be stored uncompressed under the compressed name.
+DECOMPRESSED_REJECT_OPS = ["write", "create", "truncate"]
 
 
 def get_config_var(var_name: str) -> str:
@@ -180,87 +74,188 @@ def get_config_var(var_name: str) -> str:
     return v
 
 
+def get_optional_config_var(var_name: str, default: str | None) -> str | None:
+    """
+    Gets specified configuration variable (from environment variables).
+    Uses default if not set.
+    """
+    v = os.getenv(var_name, default)
+    print(f"Configuration variable {var_name} has value: {v}")
+    return v
+
+
 def get_request_info(control_pipe: io.BufferedReader):
     """
     Get information about request from pipe.
+    Line has operation, trace ID (hexadecimal), pipes and path separated by "|".
     """
     line = control_pipe.readline()
-    return line.split("|", maxsplit=3)
+    operation, trace_id, pipe_in, pipe_out, minio_path = line.split("|", maxsplit=4)
+    return operation, int(trace_id, 16), pipe_in, pipe_out, minio_path
 
 
-def object_process_get(queue_in: mp.Queue, config: dict):
+def reject_read_only(operation: str, pipe_in: str, pipe_out: str):
     """
-    Get object for multiprocessing queue, with possibility of exit for timeout.
+    Reply to operation that would change files with read-only error.
     """
+    print(f"Reject {operation} on read-only file.")
+    with open(pipe_in, "rb"), open(pipe_out, "wb") as pipe_response:
+        send_output_int8(pipe_response, -errno.EROFS)
+    for p in (pipe_in, pipe_out):
+        try:
+            os.unlink(p)
+        except OSError as e:
+            print("Error occurred removing pipe:", e)
 
-    # If may need to write out, wait indefinitely for input.
-    if config["write_out"]:
-        return queue_in.get()
-
-    # Get required amount of time.
-    max_time = (
-        config["timeout_open_read"]
-        if config["handle"] is not None
-        else config["timeout_closed"]
-    )
-    start_time = time.time()
 
-    # Wait in loop for required amount of time, if no input by then timeout.
-    while True:
+def reply_metadata(operation: str, pipe_in: str, pipe_out: str, metadata: dict):
+    """
+    Answer metadata operation from cached metadata, without a worker: send
+    metadata, or for access just success, as object exists.
+    """
+    with open(pipe_in, "rb"), open(pipe_out, "wb") as pipe_response:
+        if operation == "access":
+            send_output_int8(pipe_response, 0)
+        else:
+            send_metadata(pipe_response, metadata)
+    for p in (pipe_in, pipe_out):
         try:
-            return queue_in.get(timeout=1)
-        except queue.Empty:
-            cur_time = time.time()
-            elapsed_time = cur_time - start_time
-
-            if elapsed_time > max_time:
-                pid = os.getpid()
-                elapsed_time = round(elapsed_time, 2)
-                msg = (
-                    f"Timeout of process {pid} after {elapsed_time} seconds, "
-                    f"maximum time is {max_time} seconds."
-                )
-                print(msg)
-                # pylint: disable=raise-missing-from
-                raise TimeoutError(msg)
-
-
-def object_process(
-    minio_path: str,
-    queue_in: mp.Queue,
-    queue_out: mp.Queue,
-    config: dict,
-) -> int:
+            os.unlink(p)
+        except OSError as e:
+            print("Error occurred removing pipe:", e)
+
+
+def lookup_metadata(
+    minio_path: str, metadata_store: MetadataStore, metadata_index: MetadataIndex
+) -> dict | None:
     """
-    Function for process associated with MinIO object.
+    Get cached metadata of path, else from index of previous run unless removed
+    since, or None if neither available.
     """
+    metadata = metadata_store.get(minio_path)
+    if metadata is None and not metadata_store.is_removed(minio_path):
+        metadata = metadata_index.lookup(minio_path)
+    return metadata
 
-    # Initialization
-    pid = os.getpid()
-    print(f"Running process {pid} for operation on object {minio_path}.")
 
-    with tempfile.TemporaryDirectory() as td:
-        config["minio_path"] = minio_path
-        config["write_out"] = False
-        config["temp_path"] = f"{td}/file.bin"
-        config["handle"] = None
+def start_revalidate_thread(
+    config: dict, metadata_store: MetadataStore, metadata_index: MetadataIndex
+):
+    """
+    Start thread checking objects of index against MinIO.
+    Results are stored in metadata store, where they take precedence over index,
+    unless path was seen since.
+    """
+    client = get_minio_client({**config})
 
+    def stat_object(path: str) -> dict | None:
         try:
-            # Main loop for process: get and handle requests.
-            while True:
-                # Get request.
-                req = object_process_get(queue_in, config)
-
-                # Handle request.
-                handle_io_request(
-                    req["operation"],
-                    req["pipe_in"],
-                    req["pipe_out"],
-                    config,
-                    queue_out,
-                )
-        except TimeoutError:
-            print("Timeout occurred, exit.")
+            return metadata_from_minio(
+                client.stat_object(config["minio_bucket"], path.lstrip("/"))
+            )
+        except minio.error.S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise OSError(str(e)) from e
+
+    def on_result(path: str, metadata: dict | None):
+        if path in metadata_store or metadata_store.is_removed(path):
+            return
+        if metadata is None:
+            metadata_store.remove(path)
+        else:
+            metadata_store.set(path, metadata)
+
+    threading.Thread(
+        target=revalidate_index,
+        args=(
+            metadata_index,
+            stat_object,
+            on_result,
+            config["revalidate_threads"],
+            config["revalidate_rate"],
+        ),
+        daemon=True,
+    ).start()
+
+
+def invalidate_store(metadata_store: MetadataStore, event: dict):
+    """
+    Apply change event to metadata store. Removed objects are kept as
+    tombstones, so index of previous run is not used for them.
+    """
+    if event["metadata"] is None:
+        metadata_store.remove(event["path"])
+    else:
+        metadata_store.set(event["path"], event["metadata"])
+
+
+def resync_events(
+    client, config: dict, metadata_store: MetadataStore, metadata_index: MetadataIndex
+):
+    """
+    Generate events for changes missed while notifications were disconnected,
+    from full listing compared with cached metadata.
+    """
+    prefix = "/" + config["invalidation_prefix"]
+    print("Resynchronize cached metadata after reconnect.")
+    current = list_metadata(
+        client, config["minio_bucket"], config["invalidation_prefix"]
+    )
+    known = {m["minio_path"]: m for m in metadata_index.list_prefix(prefix)}
+    for path, m in metadata_store.items():
+        if not path.startswith(prefix):
+            continue
+        if m is None:
+            known.pop(path, None)
+        else:
+            known[path] = m
+    yield from diff_events(known, current)
+
+
+def start_invalidation_thread(
+    config: dict,
+    metadata_store: MetadataStore,
+    metadata_index: MetadataIndex,
+    invalidated: queue.Queue,
+):
+    """
+    Start thread applying change events to metadata and shared cache.
+    Changed paths are put on queue invalidated, for main loop to tell workers.
+    Uses bucket notifications, or periodic listing diff if so configured.
+    """
+    invalidator = Invalidator()
+    invalidator.add_handler(lambda event: invalidate_store(metadata_store, event))
+    if config["shared_cache_socket"] is not None:
+        shared_cache = SharedCacheClient(
+            config["shared_cache_socket"], config["minio_bucket"]
+        )
+
+        def invalidate_shared_cache(event: dict):
+            try:
+                shared_cache.invalidate(event["path"].lstrip("/"))
+            except OSError as e:
+                print(f"Invalidation of {event['path']} in shared cache failed:", e)
+
+        invalidator.add_handler(invalidate_shared_cache)
+    invalidator.add_handler(lambda event: invalidated.put(event["path"]))
+
+    client = get_minio_client({**config})
+    bucket = config["minio_bucket"]
+    prefix = config["invalidation_prefix"]
+    if config["invalidation"] == "notify":
+        events = reconnecting_events(
+            lambda: notification_events(client, bucket, prefix),
+            lambda: resync_events(client, config, metadata_store, metadata_index),
+        )
+    elif config["invalidation"] == "diff":
+        events = listing_diff_events(
+            client, bucket, prefix, config["invalidation_interval"]
+        )
+    else:
+        raise ValueError(f"Unknown invalidation mode {config['invalidation']}!")
+
+    threading.Thread(target=invalidator.run, args=(events,), daemon=True).start()
 
 
 def start_operation(
@@ -269,76 +264,62 @@ def start_operation(
     pipe_out: io.BufferedWriter,
     minio_path: str,
     config: dict,
-    objects_db: dict,
+    metadata_store: MetadataStore,
+    metadata_index: MetadataIndex,
+    worker_pool: WorkerPool,
+    trace_id: int,
 ):
     """
     Start operation, do one of:
-    * Create new process.
-    * Send request to existing process.
+    * Send request to worker of pool, which keeps state of file.
     * Return cached metadata.
     """
 
+    if config["read_only"] and operation in READ_ONLY_REJECT_OPS:
+        reject_read_only(operation, pipe_in, pipe_out)
+        return
+    decompress = should_decompress(config, minio_path)
+    if decompress and operation in DECOMPRESSED_REJECT_OPS:
+        reject_read_only(operation, pipe_in, pipe_out)
+        return
+
+    request = {
+        "operation": operation,
+        "pipe_in": pipe_in,
+        "pipe_out": pipe_out,
+        "trace_id": trace_id,
+        "queued_ns": time_ns(),
+    }
+
     if operation in KEEP_STATE_OPS:
-        # Send request to process that keeps state.
-        if minio_path not in processes_stateful:
-            processes_stateful[minio_path] = start_process_stateful(
-                minio_path,
-                config,
-                operation,
-                pipe_in,
-                pipe_out,
-            )
-        else:
-            send_process(processes_stateful[minio_path], operation, pipe_in, pipe_out)
+        # Send request to worker assigned to path, which keeps state.
+        if config["read_only"]:
+            # Reads must get version whose metadata the mount has seen.
+            metadata = lookup_metadata(minio_path, metadata_store, metadata_index)
+            request["etag"] = metadata["etag"] if metadata is not None else None
+        worker_pool.submit(minio_path, request)
     elif operation in GET_METADATA_OPS:
         # Send stateless get metadata request.
-        if minio_path in processes_stateful:
-            # If stateful process running, use metadata from that.
-            send_process(TODO)
-        elif minio_path in metadata:
-            # If cached metadata available, use that.
-            send_metadata(TODO)
+        if minio_path in worker_pool.assigned or decompress:
+            # If worker holds state of file, use metadata from that.
+            # Cached size of decompressed object is the compressed size, so
+            # worker also gets decompressed size.
+            worker_pool.submit(minio_path, request)
+        elif (
+            metadata := lookup_metadata(minio_path, metadata_store, metadata_index)
+        ) is not None:
+            # If cached metadata available, or from index of previous run, use that.
+            reply_metadata(operation, pipe_in, pipe_out, metadata)
         else:
-            # If neither above available, start process to get metadata.
-            processes_stateless[minio_path] = start_process_stateless(TODO)
+            # If neither above available, worker gets metadata from MinIO.
+            worker_pool.submit(minio_path, request)
     elif operation in MODIFY_PATH_OPS:
-        if minio_path in processes_stateful:
-            # If stateful process running, use that to handle request.
-            send_process(TODO)
-        else:
-            # If already has stateless process, terminate it.
-            if minio_path in process_stateless:
-                end_process(processes_stateless[minio_path])
-                processes_stateless.pop(minio_path, None)
-            # Start process for stateless request that modifies path.
-            processes_stateless[minio_path] = start_process(TODO)
+        # Worker of path, if any, drops state of file it holds.
+        worker_pool.submit(minio_path, request)
     else:
         raise NotImplementedError(f"operation: {operation}")
 
 
-def clean_operations(config: dict, processes: dict):
-    """
-    Cleanup files from old operations that have already completed.
-    """
-
-    for p in processes:
-        if p["process"].poll():
-            n = p["op_num"]
-            print(f"Found process {n} has already finished.")
-
-            base_path = p["base_path"]
-            for x in glob.glob(f"{base_path}*"):
-                print("Delete old temporary file:", x)
-                try:
-                    os.unlink(x)
-                except OSError as e:
-                    print("Error occurred removing file:", e)
-
-            p["input_queue"].destroy()
-            p["output_queue"].destroy()
-            print(f"Done cleanup for finished process {n}.")
-
-
 def main():
     """
     Main function invoked when running program.
@@ -346,6 +327,7 @@ def main():
     """
 
     print("Initialize back-end for MinIO-MC based file system...")
+    ringlog.install_dump_signal()
     config = {
         "minio_server": get_config_var("minio_server"),
         "minio_access_key": get_config_var("minio_access_key"),
@@ -354,6 +336,60 @@ def main():
         "control_pipe": get_config_var("control_pipe"),
         "timeout_closed": float(get_config_var("timeout_closed")),
         "timeout_open_read": float(get_config_var("timeout_open_read")),
+        "metadata_index": get_optional_config_var("metadata_index", None),
+        "metadata_snapshot_interval": float(
+            get_optional_config_var("metadata_snapshot_interval", "300")
+        ),
+        "revalidate_threads": int(get_optional_config_var("revalidate_threads", "8")),
+        "revalidate_rate": float(get_optional_config_var("revalidate_rate", "200")),
+        "streaming_upload": get_optional_config_var("streaming_upload", "0") == "1",
+        "upload_part_size": int(
+            get_optional_config_var("upload_part_size", str(16 * 1024 * 1024))
+        ),
+        "hedge_enabled": get_optional_config_var("hedge_enabled", "0") == "1",
+        "hedge_percentile": float(get_optional_config_var("hedge_percentile", "95")),
+        "hedge_budget": float(get_optional_config_var("hedge_budget", "0.05")),
+        "hedge_max_size": int(
+            get_optional_config_var("hedge_max_size", str(8 * 1024 * 1024))
+        ),
+        "decompress_prefixes": [
+            p
+            for p in get_optional_config_var("decompress_prefixes", "").split(",")
+            if p
+        ],
+        "shared_cache_socket": get_optional_config_var("shared_cache_socket", None),
+        "read_only": get_optional_config_var("read_only", "0") == "1",
+        "block_cache_dir": get_optional_config_var("block_cache_dir", None),
+        "memory_only": get_optional_config_var("memory_only", "0") == "1",
+        "memory_cache_budget": int(
+            get_optional_config_var("memory_cache_budget", str(1024**3))
+        ),
+        "memory_chunk_size": int(
+            get_optional_config_var("memory_chunk_size", str(1024 * 1024))
+        ),
+        "block_size": int(get_optional_config_var("block_size", str(4 * 1024 * 1024))),
+        "block_cache_budget": int(
+            get_optional_config_var("block_cache_budget", str(10 * 1024**3))
+        ),
+        "partial_rewrite": get_optional_config_var("partial_rewrite", "0") == "1",
+        "partial_rewrite_min_size": int(
+            get_optional_config_var("partial_rewrite_min_size", str(64 * 1024 * 1024))
+        ),
+        "partial_rewrite_staging_bucket": get_optional_config_var(
+            "partial_rewrite_staging_bucket", None
+        ),
+        "partial_rewrite_stale_age": float(
+            get_optional_config_var("partial_rewrite_stale_age", "3600")
+        ),
+        "invalidation": get_optional_config_var("invalidation", None),
+        "invalidation_prefix": get_optional_config_var("invalidation_prefix", ""),
+        "invalidation_interval": float(
+            get_optional_config_var("invalidation_interval", "60")
+        ),
+        "pool_size": int(get_optional_config_var("pool_size", "0")),
+        "pool_max_outstanding": int(
+            get_optional_config_var("pool_max_outstanding", "8")
+        ),
     }
     config["minio_host"] = (
         config["minio_server"]
@@ -362,28 +398,76 @@ def main():
         .strip(" /")
     )
     control_pipe_file = config["control_pipe"]
-    objects_db = {}
+    metadata_store = MetadataStore()
+
+    # Serve metadata from index of previous run until objects are seen again.
+    metadata_index = MetadataIndex(config["metadata_index"])
+    if config["metadata_index"] is not None:
+        threading.Thread(
+            target=snapshot_loop,
+            args=(
+                metadata_index,
+                metadata_store.items,
+                config["metadata_snapshot_interval"],
+            ),
+            daemon=True,
+        ).start()
+        if len(metadata_index) > 0:
+            start_revalidate_thread(config, metadata_store, metadata_index)
+
+    # Start workers before first request, so it does not wait for startup.
+    worker_pool = WorkerPool(config, config["pool_size"] or None)
+
+    # Drop cached data of objects changed by other clients. Read-only mounts
+    # keep the versions they have seen.
+    invalidated = queue.Queue()
+    if config["invalidation"] is not None and not config["read_only"]:
+        start_invalidation_thread(config, metadata_store, metadata_index, invalidated)
+
+    # Remove parts left by partial rewrites that failed in earlier runs.
+    if config["partial_rewrite"]:
+        threading.Thread(
+            target=remove_stale_parts,
+            args=(
+                get_minio_client({**config}),
+                config["partial_rewrite_staging_bucket"] or config["minio_bucket"],
+                config["partial_rewrite_stale_age"],
+            ),
+            daemon=True,
+        ).start()
 
     print("Handle requests with infinite loop...")
     op_num = 1
 
     with open(control_pipe_file, "r", encoding="utf-8") as control_pipe:
-        # Get the operation.
-        print("Wait for operation #{op_num} to perform.")
-        operation, pipe_in, pipe_out, minio_path = get_request_info(control_pipe)
-        print(
-            (
-                f"Operation # {op_num} is {operation} on object {minio_path}, "
-                f"using input pipe {pipe_in} and output pipe {pipe_out}."
+        while True:
+            # Get the operation.
+            ringlog.log_hot(MSG_WAIT_OPERATION, op_num)
+            operation, trace_id, pipe_in, pipe_out, minio_path = get_request_info(
+                control_pipe
             )
-        )
+            ringlog.log_hot(MSG_OPERATION, op_num, operation, minio_path)
+
+            # Workers drop state of changed objects before later requests.
+            while not invalidated.empty():
+                worker_pool.invalidate(invalidated.get())
 
-        # Do the actual operation.
-        start_operation(operation, pipe_in, pipe_out, minio_path, config, objects_db)
+            # Do the actual operation.
+            start_operation(
+                operation,
+                pipe_in,
+                pipe_out,
+                minio_path,
+                config,
+                metadata_store,
+                metadata_index,
+                worker_pool,
+                trace_id,
+            )
 
-        # Do cleanup as necessary.
-        clean_operations(config, objects_db)
-        op_num += 1
+            # Get results from workers, and restart any that died.
+            worker_pool.poll(metadata_store)
+            op_num += 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,316 @@
+"""
+Local data cache storing blocks by content hash.
+Each object is a manifest listing hashes of its fixed-size blocks, so blocks
+with identical contents are stored once across objects. Manifests are keyed
+by ETag and size, so an object identical to one already cached is not
+downloaded at all.
+Store is on disk and shared by all processes using the same directory.
+Modification time of block files is their last use, set when stored and when
+read, so eviction removes least recently used blocks.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+# Default size of blocks objects are split into.
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Number of block files kept open per reader.
+NUM_OPEN_BLOCKS = 8
+
+# Fraction of budget eviction reduces usage to, so it is not run every block.
+EVICT_TARGET = 0.9
+
+# Seconds between updates of use time of block by the same reader.
+TOUCH_INTERVAL = 60.0
+
+# Age in seconds after which temporary block file, named with hash and random
+# suffix, is taken to be left by process that failed while writing it.
+STALE_TEMP_AGE = 3600.0
+
+
+def remove_file(path: str):
+    """
+    Remove file, if not already removed by another process.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class BlockStore:
+    """
+    Blocks and manifests in cache directory, with total size of blocks kept
+    under budget by removing least recently used blocks.
+    Removed blocks still listed in manifests are fetched again when read.
+    """
+
+    def __init__(self, cache_dir: str, block_size: int, budget: int):
+        self.cache_dir = cache_dir
+        self.block_size = block_size
+        self.budget = budget
+        self.blocks_dir = f"{cache_dir}/blocks"
+        self.manifests_dir = f"{cache_dir}/manifests"
+        os.makedirs(self.blocks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self.added_since_evict = 0
+
+    def block_path(self, digest: str) -> str:
+        """
+        Get path of block with hash.
+        """
+        return f"{self.blocks_dir}/{digest}"
+
+    def manifest_path(self, etag: str, size: int) -> str:
+        """
+        Get path of manifest for object with ETag and size.
+        """
+        name = hashlib.sha256(f"{etag}:{size}".encode("UTF-8")).hexdigest()
+        return f"{self.manifests_dir}/{name}"
+
+    def get_manifest(self, etag: str | None, size: int) -> list | None:
+        """
+        Get block hashes of object with ETag and size, or None if not stored.
+        """
+        if etag is None:
+            return None
+        try:
+            with open(self.manifest_path(etag, size), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_manifest(self, etag: str, size: int, digests: list):
+        """
+        Store block hashes of object.
+        """
+        path = self.manifest_path(etag, size)
+        temp_path = f"{path}.{uuid.uuid4().hex}"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(digests, f)
+        os.replace(temp_path, path)
+
+    def put_block(self, data: bytes) -> str:
+        """
+        Store block, unless block with same contents already stored.
+        Returns hash of block.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.block_path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return digest
+
+        temp_path = f"{path}.{uuid.uuid4().hex}"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        self.added_since_evict += len(data)
+        if self.added_since_evict > self.budget * (1 - EVICT_TARGET):
+            self.evict()
+        return digest
+
+    def evict(self):
+        """
+        Remove least recently used blocks if total size over budget.
+        Locked so only one process scans directory at a time.
+        Temporary files of blocks being written are left alone, unless stale.
+        """
+        self.added_since_evict = 0
+        with open(f"{self.cache_dir}/lock", "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            blocks = []
+            total = 0
+            now = time.time()
+            with os.scandir(self.blocks_dir) as it:
+                for e in it:
+                    st = e.stat()
+                    if "." not in e.name:
+                        blocks.append((st.st_mtime, st.st_size, e.path))
+                        total += st.st_size
+                    elif now - st.st_mtime > STALE_TEMP_AGE:
+                        remove_file(e.path)
+            if total <= self.budget:
+                return
+            blocks.sort()
+            for _, size, path in blocks:
+                if total <= self.budget * EVICT_TARGET:
+                    break
+                remove_file(path)
+                total -= size
+            print(f"Evicted blocks from cache, now {total} bytes.")
+
+    def store_object(self, client, bucket: str, key: str, etag: str, size: int):
+        """
+        Download object and store it as blocks, returning list of hashes.
+        Download requires object to still have ETag.
+        """
+        response = client.get_object(
+            bucket, key, request_headers={"If-Match": etag} if etag else None
+        )
+        digests = []
+        try:
+            buffer = bytearray()
+            for chunk in response.stream(1024 * 1024):
+                buffer += chunk
+                while len(buffer) >= self.block_size:
+                    digests.append(self.put_block(bytes(buffer[: self.block_size])))
+                    del buffer[: self.block_size]
+            if buffer:
+                digests.append(self.put_block(bytes(buffer)))
+        finally:
+            response.close()
+            response.release_conn()
+        if etag is not None:
+            self.put_manifest(etag, size, digests)
+        return digests
+
+    def open_object(self, client, bucket: str, key: str) -> "BlockFile":
+        """
+        Open object for reading from blocks, downloading it only if no
+        object with the same ETag and size is stored.
+        """
+        obj = client.stat_object(bucket, key)
+        etag = obj.etag.strip('"') if obj.etag else None
+        digests = self.get_manifest(etag, obj.size)
+        if digests is None:
+            digests = self.store_object(client, bucket, key, etag, obj.size)
+        else:
+            print(f"Object {key} found in block cache, no download needed.")
+        return BlockFile(self, digests, obj.size, client, bucket, key, etag)
+
+
+class BlockFile:
+    """
+    Read-only file-like object reading object contents from its blocks.
+    Block removed from store since manifest was made is fetched again.
+    """
+
+    def __init__(
+        self,
+        store: BlockStore,
+        digests: list,
+        size: int,
+        client,
+        bucket: str,
+        key: str,
+        etag: str | None,
+    ):
+        self.store = store
+        self.digests = digests
+        self.size = size
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.etag = etag
+        self.position = 0
+        self.open_blocks = OrderedDict()
+        self.touched = {}
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """
+        Set position in object.
+        """
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def tell(self) -> int:
+        """
+        Get position in object.
+        """
+        return self.position
+
+    def get_block_fd(self, i: int) -> int:
+        """
+        Get open file descriptor of block number i, fetching it if removed.
+        """
+        if i in self.open_blocks:
+            self.open_blocks.move_to_end(i)
+            return self.open_blocks[i]
+
+        path = self.store.block_path(self.digests[i])
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            self.refetch_block(i)
+            fd = os.open(path, os.O_RDONLY)
+
+        self.open_blocks[i] = fd
+        if len(self.open_blocks) > NUM_OPEN_BLOCKS:
+            _, old_fd = self.open_blocks.popitem(last=False)
+            os.close(old_fd)
+        return fd
+
+    def touch_block(self, i: int):
+        """
+        Mark block number i as used now, so it is not evicted soon.
+        Done at most once per interval per block, to limit metadata writes.
+        """
+        now = time.monotonic()
+        if now - self.touched.get(i, -TOUCH_INTERVAL) < TOUCH_INTERVAL:
+            return
+        self.touched[i] = now
+        try:
+            os.utime(self.store.block_path(self.digests[i]))
+        except FileNotFoundError:
+            # Evicted after open; data stays readable through open file.
+            pass
+
+    def refetch_block(self, i: int):
+        """
+        Fetch block number i of object again, after it was evicted.
+        """
+        block_size = self.store.block_size
+        response = self.client.get_object(
+            self.bucket,
+            self.key,
+            offset=i * block_size,
+            length=min(block_size, self.size - i * block_size),
+            request_headers={"If-Match": self.etag} if self.etag else None,
+        )
+        try:
+            data = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+        if self.store.put_block(data) != self.digests[i]:
+            raise OSError(f"Block {i} of {self.key} changed since cached.")
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read up to size bytes from current position, to end if size negative.
+        """
+        block_size = self.store.block_size
+        end = self.size if size < 0 else min(self.position + size, self.size)
+        parts = []
+        while self.position < end:
+            i = self.position // block_size
+            offset = self.position - i * block_size
+            length = min(end - self.position, block_size - offset)
+            data = os.pread(self.get_block_fd(i), length, offset)
+            self.touch_block(i)
+            if not data:
+                raise OSError(f"Block {i} of {self.key} shorter than expected.")
+            parts.append(data)
+            self.position += len(data)
+        return b"".join(parts)
+
+    def close(self):
+        """
+        Close open block files.
+        """
+        for fd in self.open_blocks.values():
+            os.close(fd)
+        self.open_blocks.clear()
@@ -3,8 +3,95 @@ Bridge between server process and FSSpec objects.
 Converts between socket representation and Python format.
 """
 
+import io
+import os
+import socket
+import stat
+import sys
 
-def send_metadata(rfile):
+
+def get_input_uint64(rfile: io.BufferedIOBase) -> int:
+    """
+    Read unsigned 64-bit integer from input.
+    """
+    r = rfile.read(8)
+    return int.from_bytes(r, sys.byteorder, signed=False)
+
+
+def get_input_uint32(rfile: io.BufferedIOBase) -> int:
+    """
+    Read unsigned 32-bit integer from input, such as mode_t or uid_t.
+    """
+    r = rfile.read(4)
+    return int.from_bytes(r, sys.byteorder, signed=False)
+
+
+def peek_input_uint64(sock: socket.socket, count: int) -> list:
+    """
+    Get count unsigned 64-bit integers at start of input, leaving them to be
+    read again.
+    """
+    r = sock.recv(8 * count, socket.MSG_PEEK | socket.MSG_WAITALL)
+    return [
+        int.from_bytes(r[i : i + 8], sys.byteorder, signed=False)
+        for i in range(0, len(r) - 7, 8)
+    ]
+
+
+def send_int(wfile: io.BufferedIOBase, value: int):
+    """
+    Send signed C int (return value of operation).
+    """
+    wfile.write(value.to_bytes(4, sys.byteorder, signed=True))
+
+
+def send_metadata(wfile: io.BufferedIOBase, metadata: dict):
     """
     Send metadata object in format server expects.
+    Fields follow return value in order read by do_getattr in file_sys.c.
+    """
+    mtime = int(metadata["mtime"])
+    nlink = metadata.get("nlink", 2 if stat.S_ISDIR(metadata["mode"]) else 1)
+    send_int(wfile, 0)
+    wfile.write(metadata.get("uid", os.getuid()).to_bytes(4, sys.byteorder))
+    wfile.write(metadata.get("gid", os.getgid()).to_bytes(4, sys.byteorder))
+    wfile.write(mtime.to_bytes(8, sys.byteorder, signed=True))  # access time
+    wfile.write(mtime.to_bytes(8, sys.byteorder, signed=True))
+    wfile.write(metadata["mode"].to_bytes(4, sys.byteorder))
+    wfile.write(nlink.to_bytes(8, sys.byteorder))
+    wfile.write(metadata["size"].to_bytes(8, sys.byteorder, signed=True))
+
+
+def send_dir_listing(wfile: io.BufferedIOBase, names: list):
+    """
+    Send directory listing in format server expects.
+    Number of entries, then each name preceded by its length as C short.
+    """
+    send_int(wfile, len(names))
+    for n in names:
+        b = n.encode("UTF-8")
+        wfile.write(len(b).to_bytes(2, sys.byteorder, signed=True))
+        wfile.write(b)
+
+
+def send_read_data(wfile: io.BufferedIOBase, data: bytes):
+    """
+    Send data of read, preceded by its length as ssize_t, as do_read expects.
+    """
+    wfile.write(len(data).to_bytes(8, sys.byteorder, signed=True))
+    wfile.write(data)
+
+
+def send_read_error(wfile: io.BufferedIOBase, code: int):
+    """
+    Send negative error number of failed read, as ssize_t in place of length.
+    """
+    wfile.write(code.to_bytes(8, sys.byteorder, signed=True))
+
+
+def send_xattr_value(wfile: io.BufferedIOBase, value: bytes):
+    """
+    Send value of extended attribute, preceded by its length as return value.
     """
+    send_int(wfile, len(value))
+    wfile.write(value)
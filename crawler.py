@@ -0,0 +1,170 @@
+"""
+Parallel listing of all objects under a prefix.
+Each directory is listed as separate task, so subdirectories are listed
+concurrently instead of one level at a time. Directories with many objects
+are also split into key ranges, listed concurrently using start-after, and
+ranges that still have many objects are split again.
+"""
+
+import concurrent.futures
+import string
+import threading
+import time
+
+from metadata_index import is_hidden_key, metadata_from_minio
+
+# Characters at which large directories are split into key ranges.
+SPLIT_CHARACTERS = string.digits + string.ascii_uppercase + string.ascii_lowercase
+SPLIT_GROUPS = (string.digits, string.ascii_uppercase, string.ascii_lowercase)
+
+# Default number of objects listed in directory before it is split.
+DEFAULT_SPLIT_THRESHOLD = 1000
+
+
+def split_bounds(dir_prefix: str, name: str, end: str | None) -> list:
+    """
+    Get keys splitting range (name, end] of directory listing, for ranges
+    listed separately.
+    Bounds are the shortest prefix of name, extended by each split character,
+    that gives any bounds within the range, so ranges follow the distribution
+    of keys instead of only their first character.
+    Only characters of the same kind as the one in name are used (digits, or
+    letters of the same case), as keys often share one kind at each position,
+    and other ranges would be listed empty. Ranges cover (name, end] in any
+    case, so no key is missed.
+    """
+    for k in range(len(dir_prefix), len(name) + 1):
+        chars = next(
+            (g for g in SPLIT_GROUPS if k < len(name) and name[k] in g),
+            SPLIT_CHARACTERS,
+        )
+        bounds = [
+            b
+            for b in (name[:k] + c for c in chars)
+            if b > name and (end is None or b < end)
+        ]
+        if bounds:
+            return bounds
+    return []
+
+
+class PrefixCrawl:
+    """
+    Single crawl of prefix, with tasks run in thread pool.
+    Results are (key relative to prefix, size, metadata) for each object, with
+    metadata None for directory markers (keys ending in "/").
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        prefix: str,
+        executor: concurrent.futures.ThreadPoolExecutor,
+        split_threshold: int = DEFAULT_SPLIT_THRESHOLD,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.executor = executor
+        self.split_threshold = split_threshold
+        self.results = []
+        self.errors = []
+        self.pending = 0
+        self.num_listings = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def submit(self, dir_prefix: str, start_after: str | None, end: str | None):
+        """
+        Add task listing directory, optionally only keys in (start_after, end].
+        """
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self.run_task, dir_prefix, start_after, end)
+
+    def run_task(self, dir_prefix: str, start_after: str | None, end: str | None):
+        """
+        Run listing task, recording error if any, and mark crawl done after
+        last task.
+        """
+        try:
+            self.list_range(dir_prefix, start_after, end)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Error listing {dir_prefix} after {start_after}:", e)
+            with self.lock:
+                self.errors.append(e)
+        finally:
+            with self.lock:
+                self.pending -= 1
+                if self.pending == 0:
+                    self.done.set()
+
+    def list_range(self, dir_prefix: str, start_after: str | None, end: str | None):
+        """
+        List directory, adding task for each subdirectory.
+        Range is split each time many objects are listed in it: keys after the
+        last one seen go to range tasks between split bounds.
+        """
+        results = []
+        count = 0
+        for obj in self.client.list_objects(
+            self.bucket, prefix=dir_prefix, recursive=False, start_after=start_after
+        ):
+            name = obj.object_name
+            if end is not None and name > end:
+                break
+            count += 1
+            if is_hidden_key(name):
+                continue
+            if obj.is_dir:
+                self.submit(name, None, None)
+            elif name == dir_prefix:
+                results.append((name[len(self.prefix) :], 0, None))
+            else:
+                results.append(
+                    (name[len(self.prefix) :], obj.size or 0, metadata_from_minio(obj))
+                )
+
+            if count == self.split_threshold:
+                bounds = split_bounds(dir_prefix, name, end)
+                for lo, hi in zip(bounds, bounds[1:] + [end]):
+                    self.submit(dir_prefix, lo, hi)
+                if bounds:
+                    end = bounds[0]
+                count = 0
+
+        with self.lock:
+            self.results.extend(results)
+            self.num_listings += 1
+
+    def run(self) -> list:
+        """
+        Crawl prefix, waiting for all tasks.
+        Raises error if any listing failed, as results would be incomplete.
+        """
+        start_time = time.time()
+        self.submit(self.prefix, None, None)
+        self.done.wait()
+        if self.errors:
+            raise OSError(f"Crawl of {self.prefix} incomplete.") from self.errors[0]
+        print(
+            f"Crawled {len(self.results)} objects under {self.prefix} with "
+            f"{self.num_listings} listings in {round(time.time() - start_time, 2)} "
+            "seconds."
+        )
+        return self.results
+
+
+def crawl_prefix(
+    client,
+    bucket: str,
+    prefix: str,
+    num_threads: int,
+    split_threshold: int = DEFAULT_SPLIT_THRESHOLD,
+) -> list:
+    """
+    List all objects under prefix in parallel, see PrefixCrawl for results.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return PrefixCrawl(client, bucket, prefix, executor, split_threshold).run()
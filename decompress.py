@@ -0,0 +1,271 @@
+"""
+Transparent decompression of compressed objects, for configured prefixes.
+Seekable zstd objects (multiple frames with seek table at end) are read by
+fetching and decompressing only the frames needed for each read.
+Other .zst and .gz objects are decompressed in full to local file.
+"""
+
+import bisect
+import errno
+import gzip
+import os
+import shutil
+import struct
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Extensions of objects that are decompressed.
+COMPRESSED_EXTENSIONS = (".zst", ".gz")
+
+# Metadata key with decompressed size, if set on upload.
+UNCOMPRESSED_SIZE_KEY = "x-amz-meta-uncompressed-size"
+
+# Seek table footer: number of frames, descriptor, magic.
+SEEK_TABLE_FOOTER = struct.Struct("<IBI")
+SEEKABLE_MAGIC = 0x8F92EAB1
+
+# Number of decompressed frames kept per reader.
+NUM_CACHED_FRAMES = 4
+
+# Frame indexes built in this process, by path and ETag.
+frame_index_cache = OrderedDict()
+FRAME_INDEX_CACHE_SIZE = 256
+
+
+def should_decompress(config: dict, minio_path: str) -> bool:
+    """
+    Whether object is presented decompressed, from its prefix and extension.
+    """
+    prefixes = config.get("decompress_prefixes") or []
+    return minio_path.endswith(COMPRESSED_EXTENSIONS) and any(
+        minio_path.startswith(p) for p in prefixes
+    )
+
+
+def require_zstandard():
+    """
+    Raise error if optional zstandard package is not installed.
+    """
+    if zstandard is None:
+        raise OSError("Package zstandard required to decompress .zst objects.")
+
+
+class FrameIndex:
+    """
+    Offsets of frames in seekable zstd object, compressed and decompressed.
+    Has one more entry than frames, with the total sizes.
+    """
+
+    def __init__(self, compressed_sizes: list, decompressed_sizes: list):
+        self.compressed_offsets = [0]
+        self.decompressed_offsets = [0]
+        for c, d in zip(compressed_sizes, decompressed_sizes):
+            self.compressed_offsets.append(self.compressed_offsets[-1] + c)
+            self.decompressed_offsets.append(self.decompressed_offsets[-1] + d)
+
+    def __len__(self) -> int:
+        return len(self.compressed_offsets) - 1
+
+    def decompressed_size(self) -> int:
+        """
+        Total size of object when decompressed.
+        """
+        return self.decompressed_offsets[-1]
+
+    def frame_at(self, offset: int) -> int:
+        """
+        Number of frame containing decompressed offset.
+        """
+        return bisect.bisect_right(self.decompressed_offsets, offset) - 1
+
+
+def read_frame_index(client, bucket: str, key: str, object_size: int):
+    """
+    Read seek table from end of object, returning FrameIndex.
+    Returns None if object has no seek table.
+    """
+    if object_size < SEEK_TABLE_FOOTER.size:
+        return None
+    footer = get_range(client, bucket, key, object_size - SEEK_TABLE_FOOTER.size, None)
+    num_frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(footer)
+    if magic != SEEKABLE_MAGIC:
+        return None
+
+    entry_size = 12 if descriptor & 0x80 else 8
+    table_size = num_frames * entry_size
+    table_offset = object_size - SEEK_TABLE_FOOTER.size - table_size
+    table = get_range(client, bucket, key, table_offset, table_size)
+
+    compressed_sizes = []
+    decompressed_sizes = []
+    for i in range(num_frames):
+        c, d = struct.unpack_from("<II", table, i * entry_size)
+        compressed_sizes.append(c)
+        decompressed_sizes.append(d)
+    return FrameIndex(compressed_sizes, decompressed_sizes)
+
+
+def get_frame_index(client, bucket: str, key: str, metadata: dict):
+    """
+    Get frame index of object, from cache if already built for this ETag.
+    """
+    cache_key = (key, metadata.get("etag"))
+    if cache_key in frame_index_cache:
+        frame_index_cache.move_to_end(cache_key)
+        return frame_index_cache[cache_key]
+
+    index = read_frame_index(client, bucket, key, metadata["size"])
+    frame_index_cache[cache_key] = index
+    if len(frame_index_cache) > FRAME_INDEX_CACHE_SIZE:
+        frame_index_cache.popitem(last=False)
+    return index
+
+
+def get_range(client, bucket: str, key: str, offset: int, length: int | None) -> bytes:
+    """
+    Get bytes of object in range, to end of object if length None.
+    """
+    response = client.get_object(bucket, key, offset=offset, length=length or 0)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+class SeekableZstdReader:
+    """
+    File-like reader of decompressed contents of seekable zstd object.
+    Only frames overlapping each read are fetched, and recent ones are cached.
+    """
+
+    def __init__(self, client, bucket: str, key: str, index: FrameIndex):
+        require_zstandard()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.index = index
+        self.position = 0
+        self.frames = OrderedDict()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """
+        Set position in decompressed contents.
+        """
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.index.decompressed_size() + offset
+        return self.position
+
+    def get_frame(self, i: int) -> bytes:
+        """
+        Get decompressed contents of frame number i.
+        """
+        if i in self.frames:
+            self.frames.move_to_end(i)
+            return self.frames[i]
+
+        start = self.index.compressed_offsets[i]
+        length = self.index.compressed_offsets[i + 1] - start
+        size = (
+            self.index.decompressed_offsets[i + 1] - self.index.decompressed_offsets[i]
+        )
+        compressed = get_range(self.client, self.bucket, self.key, start, length)
+        data = zstandard.ZstdDecompressor().decompress(compressed, max_output_size=size)
+
+        self.frames[i] = data
+        if len(self.frames) > NUM_CACHED_FRAMES:
+            self.frames.popitem(last=False)
+        return data
+
+    def read(self, size: int) -> bytes:
+        """
+        Read up to size bytes from current position.
+        """
+        end = min(self.position + size, self.index.decompressed_size())
+        parts = []
+        while self.position < end:
+            i = self.index.frame_at(self.position)
+            frame_start = self.index.decompressed_offsets[i]
+            frame = self.get_frame(i)
+            part = frame[self.position - frame_start : end - frame_start]
+            parts.append(part)
+            self.position += len(part)
+        return b"".join(parts)
+
+
+def decompress_to_file(source_path: str, dest_path: str, minio_path: str):
+    """
+    Decompress whole local file, for objects without seek table.
+    """
+    with open(source_path, "rb") as f_in, open(dest_path, "wb") as f_out:
+        if minio_path.endswith(".gz"):
+            with gzip.open(f_in) as g:
+                shutil.copyfileobj(g, f_out)
+        else:
+            require_zstandard()
+            zstandard.ZstdDecompressor().copy_stream(f_in, f_out)
+
+
+def open_decompressed(client, bucket: str, minio_path: str, temp_path: str):
+    """
+    Open file-like reader of decompressed contents of object.
+    Seekable zstd is read by frame; anything else is downloaded and
+    decompressed to temporary file first, so needs temp_path, which is None
+    without local disk.
+    """
+    key = minio_path.lstrip("/")
+    metadata = stat_metadata(client, bucket, key)
+    if minio_path.endswith(".zst"):
+        index = get_frame_index(client, bucket, key, metadata)
+        if index is not None:
+            return SeekableZstdReader(client, bucket, key, index)
+
+    if temp_path is None:
+        raise OSError(
+            errno.EOPNOTSUPP,
+            f"Object {minio_path} can only be decompressed with local disk.",
+        )
+    compressed_path = f"{temp_path}.compressed"
+    client.fget_object(bucket, key, compressed_path)
+    decompress_to_file(compressed_path, temp_path, minio_path)
+    os.unlink(compressed_path)
+    return open(temp_path, "rb")
+
+
+def stat_metadata(client, bucket: str, key: str) -> dict:
+    """
+    Get size, ETag and user metadata of object.
+    """
+    obj = client.stat_object(bucket, key)
+    return {
+        "size": obj.size,
+        "etag": obj.etag,
+        "user_metadata": obj.metadata or {},
+    }
+
+
+def decompressed_size(client, bucket: str, minio_path: str) -> int | None:
+    """
+    Get size of decompressed contents of object, from size in object metadata
+    if set, else seek table of seekable zstd.
+    Returns None if neither available: the size field at end of gzip is only
+    the size modulo 4 GiB, so the object must be decompressed to know it.
+    """
+    key = minio_path.lstrip("/")
+    metadata = stat_metadata(client, bucket, key)
+    if UNCOMPRESSED_SIZE_KEY in metadata["user_metadata"]:
+        return int(metadata["user_metadata"][UNCOMPRESSED_SIZE_KEY])
+
+    if minio_path.endswith(".zst"):
+        index = get_frame_index(client, bucket, key, metadata)
+        if index is not None:
+            return index.decompressed_size()
+    return None
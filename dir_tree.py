@@ -0,0 +1,486 @@
+"""
+In-memory tree of directories, built from flat object keys.
+Directories either exist explicitly (created by mkdir, or marker objects with
+keys ending in "/"), or implicitly as parents of other objects.
+Each directory keeps usage of its subtree (total bytes, number of objects and
+histogram of sizes), updated along with the tree.
+"""
+
+import stat
+import threading
+import time
+
+# Mode reported for all directories.
+DIR_MODE = stat.S_IFDIR | 0o755
+
+# Number of buckets in size histogram: bucket k has sizes in [2^(k-1), 2^k).
+NUM_SIZE_BUCKETS = 65
+
+
+class Usage:
+    """
+    Usage of subtree: total bytes, number of objects and log2 size histogram.
+    """
+
+    __slots__ = ("bytes", "count", "hist")
+
+    def __init__(self):
+        self.bytes = 0
+        self.count = 0
+        self.hist = [0] * NUM_SIZE_BUCKETS
+
+    def add_file(self, size: int, sign: int = 1):
+        """
+        Add (or with sign -1, remove) single object of size.
+        """
+        self.bytes += sign * size
+        self.count += sign
+        self.hist[size.bit_length()] += sign
+
+    def add(self, other, sign: int = 1):
+        """
+        Add (or with sign -1, remove) usage of another subtree.
+        """
+        self.bytes += sign * other.bytes
+        self.count += sign * other.count
+        for i, n in enumerate(other.hist):
+            if n:
+                self.hist[i] += sign * n
+
+    def format(self) -> str:
+        """
+        Text form, with nonzero histogram buckets as "bucket:count".
+        """
+        hist = " ".join(f"{i}:{n}" for i, n in enumerate(self.hist) if n)
+        return f"bytes {self.bytes}\nobjects {self.count}\nsize_log2 {hist}\n"
+
+
+class DirNode:
+    """
+    Node in directory tree, either a file or a directory.
+    Files have no children dictionary.
+    """
+
+    __slots__ = (
+        "name",
+        "parent",
+        "children",
+        "explicit",
+        "listed",
+        "complete",
+        "mtime",
+        "size",
+        "usage",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        parent,
+        is_dir: bool,
+        explicit: bool = False,
+        size: int = 0,
+    ):
+        self.name = name
+        self.parent = parent
+        self.children = {} if is_dir else None
+        self.explicit = explicit
+        self.listed = False
+        # Directory is complete if all objects in its subtree are known.
+        self.complete = parent is not None and parent.complete
+        self.mtime = time.time()
+        self.size = size
+        self.usage = Usage() if is_dir else None
+
+    def is_dir(self) -> bool:
+        """
+        Whether node is a directory.
+        """
+        return self.children is not None
+
+    def num_subdirs(self) -> int:
+        """
+        Number of directories directly in this directory.
+        """
+        return sum(1 for c in self.children.values() if c.is_dir())
+
+
+def split_components(path: str) -> list:
+    """
+    Split path into list of components, ignoring empty ones.
+    """
+    return [c for c in path.split("/") if c]
+
+
+def is_inside(components: list, dir_components: list) -> bool:
+    """
+    Whether path with components is strictly inside directory with components.
+    """
+    return (
+        len(components) > len(dir_components)
+        and components[: len(dir_components)] == dir_components
+    )
+
+
+def propagate(node: DirNode, child: DirNode, sign: int):
+    """
+    Add (or with sign -1, remove) usage of child to node and its ancestors.
+    """
+    while node is not None:
+        if child.is_dir():
+            node.usage.add(child.usage, sign)
+        else:
+            node.usage.add_file(child.size, sign)
+        node = node.parent
+
+
+class DirTree:
+    """
+    Tree of directories and files, updated in O(depth) per change.
+    Directory is marked as listed once its full contents are known, after
+    which missing names can be answered without backend calls.
+    """
+
+    def __init__(self):
+        self.root = DirNode("", None, True, True)
+        self.lock = threading.Lock()
+
+    def clear(self):
+        """
+        Forget all contents, so directories are listed again when needed.
+        """
+        with self.lock:
+            self.root = DirNode("", None, True, True)
+
+    def find(self, path: str) -> DirNode | None:
+        """
+        Get node for path, or None if not in tree.
+        Caller must hold lock.
+        """
+        node = self.root
+        for c in split_components(path):
+            if not node.is_dir():
+                return None
+            node = node.children.get(c)
+            if node is None:
+                return None
+        return node
+
+    def make_dirs(self, components: list) -> DirNode | None:
+        """
+        Get directory with specified components, creating implicit directories.
+        Returns None if a file is in the way.
+        Caller must hold lock.
+        """
+        return self.make_dirs_under(self.root, components)
+
+    def prune(self, node: DirNode):
+        """
+        Remove implicit directories left empty, going up from node.
+        Caller must hold lock.
+        """
+        while (
+            node.parent is not None
+            and not node.explicit
+            and node.is_dir()
+            and not node.children
+        ):
+            node.parent.children.pop(node.name, None)
+            node = node.parent
+
+    def add_file(self, path: str, size: int = 0) -> bool:
+        """
+        Add file at path, along with any missing parent directories, or set
+        size of existing file.
+        Returns False if a parent is a file.
+        """
+        components = split_components(path)
+        with self.lock:
+            parent = self.make_dirs(components[:-1])
+            if parent is None or not components:
+                return False
+            node = parent.children.get(components[-1])
+            if node is None:
+                node = DirNode(components[-1], parent, False, size=size)
+                parent.children[components[-1]] = node
+                propagate(parent, node, 1)
+            elif not node.is_dir():
+                propagate(parent, node, -1)
+                node.size = size
+                propagate(parent, node, 1)
+            parent.mtime = time.time()
+            return True
+
+    def add_dir(self, path: str) -> bool:
+        """
+        Add explicit directory at path, along with any missing parents.
+        Existing implicit directory is made explicit.
+        Returns False if a parent or the path itself is a file.
+        """
+        components = split_components(path)
+        with self.lock:
+            parent = self.make_dirs(components[:-1])
+            if parent is None or not components:
+                return False
+            node = parent.children.get(components[-1])
+            if node is None:
+                node = DirNode(components[-1], parent, True)
+                parent.children[components[-1]] = node
+                parent.mtime = time.time()
+            elif not node.is_dir():
+                return False
+            node.explicit = True
+            return True
+
+    def remove(self, path: str) -> bool:
+        """
+        Remove file or empty directory at path.
+        Returns False if not present or a non-empty directory.
+        """
+        with self.lock:
+            node = self.find(path)
+            if node is None or node.parent is None:
+                return False
+            if node.is_dir() and node.children:
+                return False
+            parent = node.parent
+            propagate(parent, node, -1)
+            parent.children.pop(node.name, None)
+            parent.mtime = time.time()
+            self.prune(parent)
+            return True
+
+    def resize_file(self, path: str, size: int, grow_only: bool = False):
+        """
+        Set size of known file, after truncate, or with grow_only set to at
+        least size, after write ending there.
+        """
+        with self.lock:
+            node = self.find(path)
+            if node is None or node.is_dir() or (grow_only and node.size >= size):
+                return
+            propagate(node.parent, node, -1)
+            node.size = size
+            propagate(node.parent, node, 1)
+
+    def rename(self, source_path: str, dest_path: str) -> bool:
+        """
+        Move file or directory, replacing any file at destination.
+        Moving path to itself does nothing.
+        Returns False if source is missing, destination parent is a file, or
+        destination is inside source.
+        """
+        source = split_components(source_path)
+        components = split_components(dest_path)
+        if components == source:
+            return True
+        if is_inside(components, source):
+            return False
+        with self.lock:
+            node = self.find(source_path)
+            if node is None or node.parent is None or not components:
+                return False
+            parent = self.make_dirs(components[:-1])
+            if parent is None:
+                return False
+            existing = parent.children.get(components[-1])
+            if existing is not None and existing.is_dir() and existing.children:
+                return False
+            if existing is not None:
+                propagate(parent, existing, -1)
+
+            old_parent = node.parent
+            propagate(old_parent, node, -1)
+            old_parent.children.pop(node.name, None)
+            node.name = components[-1]
+            node.parent = parent
+            parent.children[node.name] = node
+            propagate(parent, node, 1)
+            old_parent.mtime = parent.mtime = time.time()
+            self.prune(old_parent)
+            return True
+
+    def load_listing(
+        self,
+        path: str,
+        names: list,
+        dir_names: list,
+        sizes: dict | None = None,
+    ):
+        """
+        Set contents of directory from listing of its files and subdirectories,
+        with sizes of files by name if known.
+        Directory is then marked as listed.
+        Known subdirectories keep their own contents.
+        """
+        sizes = sizes or {}
+        with self.lock:
+            parent = self.make_dirs(split_components(path))
+            if parent is None:
+                return
+            for child in parent.children.values():
+                propagate(parent, child, -1)
+
+            children = {}
+            new_dirs = False
+            for n in dir_names:
+                child = parent.children.get(n)
+                if child is None or not child.is_dir():
+                    child = DirNode(n, parent, True)
+                    child.complete = False
+                    new_dirs = True
+                children[n] = child
+            for n in names:
+                child = parent.children.get(n)
+                if child is None or child.is_dir():
+                    child = DirNode(n, parent, False)
+                child.size = sizes.get(n, child.size)
+                children[n] = child
+            parent.children = children
+            parent.listed = True
+            parent.mtime = time.time()
+
+            for child in children.values():
+                propagate(parent, child, 1)
+            if new_dirs:
+                # Subdirectories not seen before have unknown contents.
+                node = parent
+                while node is not None:
+                    node.complete = False
+                    node = node.parent
+
+    def load_subtree(self, path: str, entries):
+        """
+        Set all contents of directory from recursive listing, given as
+        (key relative to directory, size) pairs, with directory markers
+        having keys ending in "/".
+        Directory and all its subdirectories are then listed and complete.
+        """
+        with self.lock:
+            top = self.make_dirs(split_components(path))
+            if top is None:
+                return
+            for child in top.children.values():
+                propagate(top, child, -1)
+            top.children = {}
+            top.complete = True
+
+            for key, size in entries:
+                components = split_components(key)
+                if not components:
+                    continue
+                if key.endswith("/"):
+                    node = self.make_dirs_under(top, components)
+                    if node is not None:
+                        node.explicit = True
+                    continue
+                parent = self.make_dirs_under(top, components[:-1])
+                if parent is None or components[-1] in parent.children:
+                    continue
+                node = DirNode(components[-1], parent, False, size=size)
+                parent.children[components[-1]] = node
+                propagate(parent, node, 1)
+
+            stack = [top]
+            while stack:
+                node = stack.pop()
+                node.listed = True
+                node.complete = True
+                stack.extend(c for c in node.children.values() if c.is_dir())
+            top.mtime = time.time()
+
+    def make_dirs_under(self, top: DirNode, components: list) -> DirNode | None:
+        """
+        Get directory with components relative to top, creating missing ones.
+        Returns None if a file is in the way.
+        Caller must hold lock.
+        """
+        node = top
+        for c in components:
+            child = node.children.get(c)
+            if child is None:
+                child = DirNode(c, node, True)
+                node.children[c] = child
+            elif not child.is_dir():
+                return None
+            node = child
+        return node
+
+    def is_dir(self, path: str) -> bool:
+        """
+        Whether path is known to be a directory.
+        """
+        with self.lock:
+            node = self.find(path)
+            return node is not None and node.is_dir()
+
+    def is_listed(self, path: str) -> bool:
+        """
+        Whether full contents of directory at path are known.
+        """
+        with self.lock:
+            node = self.find(path)
+            return node is not None and node.is_dir() and node.listed
+
+    def known_missing(self, path: str) -> bool:
+        """
+        Whether path is known not to exist, as its parent is listed without it.
+        """
+        components = split_components(path)
+        with self.lock:
+            node = self.root
+            for c in components:
+                if not node.is_dir():
+                    return True
+                child = node.children.get(c)
+                if child is None:
+                    return node.listed
+                node = child
+            return False
+
+    def list_dir(self, path: str) -> list | None:
+        """
+        Get sorted names in directory, or None if not a known directory.
+        """
+        with self.lock:
+            node = self.find(path)
+            if node is None or not node.is_dir():
+                return None
+            return sorted(node.children)
+
+    def dir_metadata(self, path: str) -> dict | None:
+        """
+        Get metadata of directory, in format of object metadata, or None if not
+        a known directory.
+        """
+        with self.lock:
+            node = self.find(path)
+            if node is None or not node.is_dir():
+                return None
+            return {
+                "minio_path": path,
+                "size": 0,
+                "mtime": node.mtime,
+                "mode": DIR_MODE,
+                "nlink": 2 + node.num_subdirs(),
+            }
+
+    def is_complete(self, path: str) -> bool:
+        """
+        Whether all objects in subtree of directory at path are known.
+        """
+        with self.lock:
+            node = self.find(path)
+            return node is not None and node.is_dir() and node.complete
+
+    def usage(self, path: str) -> Usage | None:
+        """
+        Get copy of usage of subtree at path, or None if not a known directory.
+        """
+        with self.lock:
+            node = self.find(path)
+            if node is None or not node.is_dir():
+                return None
+            r = Usage()
+            r.add(node.usage)
+            return r
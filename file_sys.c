@@ -15,6 +15,7 @@
 #include <fuse.h>
 #include <inttypes.h>
 #include <pthread.h>
+#include <signal.h>
 #include <stdbool.h>
 #include <stdio.h>
 #include <stdlib.h>
@@ -32,18 +33,128 @@
 // Name of domain socket file.
 char domain_socket_file[BUF_SIZE_DOMAIN_SOCKET];
 
-// Log operation that is performed.
-void log_operation(const char *op_name)
+// Whether mounted as read-only snapshot, set by environment variable read_only.
+bool read_only = false;
+
+// Mount options for read-only snapshot: contents never change, so kernel can
+// cache pages, entries and attributes for as long as it keeps them.
+#define READ_ONLY_MOUNT_OPTIONS "-oro,kernel_cache,entry_timeout=31536000,attr_timeout=31536000,negative_timeout=31536000"
+
+// Reject operation that would change file system, if read-only.
+#define READ_ONLY_CHECK()      \
+	{                          \
+		if (read_only)         \
+		{                      \
+			return -EROFS;     \
+		}                      \
+	}
+
+// Counter used to make trace IDs unique within this process.
+static uint64_t trace_counter = 0;
+
+// Get new trace ID for request: process ID in upper bits, counter in lower bits.
+uint64_t new_trace_id()
 {
-	printf("Perform operation: %s\n", op_name);
+	uint64_t n = __atomic_add_fetch(&trace_counter, 1, __ATOMIC_RELAXED);
+	return ((uint64_t)getpid() << 40) | (n & 0xFFFFFFFFFFull);
 }
 
-// Log path.
-void log_path(const char *name, const char *path)
+// Get current wall-clock time in nanoseconds, for start time of request trace.
+uint64_t time_ns()
 {
-	printf("Path %s: %s\n", name, path);
+	struct timespec ts;
+	clock_gettime(CLOCK_REALTIME, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000ull + (uint64_t)ts.tv_nsec;
 }
 
+// Number of records kept in log ring buffer (power of 2).
+#define LOG_RING_SIZE 4096
+
+// Record in log ring buffer: format with two %s, static first argument, copied second.
+struct log_record
+{
+	uint64_t time_ns;
+	const char *fmt;
+	const char *static_arg;
+	char arg[40];
+};
+
+// Log ring buffer, with count of records ever written.
+static struct log_record log_ring[LOG_RING_SIZE];
+static uint64_t log_ring_next = 0;
+
+// Add record to log ring buffer, overwriting oldest if full.
+void log_record(const char *fmt, const char *static_arg, const char *arg)
+{
+	uint64_t n = __atomic_fetch_add(&log_ring_next, 1, __ATOMIC_RELAXED);
+	struct log_record *r = &log_ring[n % LOG_RING_SIZE];
+	r->time_ns = time_ns();
+	r->fmt = fmt;
+	r->static_arg = static_arg;
+	strncpy(r->arg, arg, sizeof(r->arg) - 1);
+	r->arg[sizeof(r->arg) - 1] = '\0';
+}
+
+// Write formatted records in log ring buffer to standard error, oldest first.
+void log_dump()
+{
+	uint64_t end = __atomic_load_n(&log_ring_next, __ATOMIC_RELAXED);
+	uint64_t start = end > LOG_RING_SIZE ? end - LOG_RING_SIZE : 0;
+
+	fprintf(stderr, "--- Log ring dump of FUSE process %d ---\n", getpid());
+	for (uint64_t n = start; n < end; n++)
+	{
+		struct log_record *r = &log_ring[n % LOG_RING_SIZE];
+		fprintf(stderr, "%" PRIu64 ".%09" PRIu64 " ", r->time_ns / 1000000000, r->time_ns % 1000000000);
+		fprintf(stderr, r->fmt, r->static_arg, r->arg);
+		fprintf(stderr, "\n");
+	}
+	fprintf(stderr, "--- End of log ring dump ---\n");
+}
+
+// Thread that dumps log ring buffer each time SIGUSR1 is received.
+void *log_dump_thread(void *arg)
+{
+	sigset_t *set = arg;
+	int sig;
+	while (sigwait(set, &sig) == 0)
+	{
+		log_dump();
+	}
+	return NULL;
+}
+
+// Block SIGUSR1 in all threads and start thread that waits for it.
+// Called from init callback, after fuse_main has daemonized, as threads
+// started before the fork would not exist in the daemon.
+void init_log_dump_signal()
+{
+	static sigset_t set;
+	sigemptyset(&set);
+	sigaddset(&set, SIGUSR1);
+	pthread_sigmask(SIG_BLOCK, &set, NULL);
+
+	pthread_t thread;
+	pthread_create(&thread, NULL, log_dump_thread, &set);
+	pthread_detach(thread);
+}
+
+// Hot-path logging, compiles to nothing unless built with -DLOG_HOT_ENABLED.
+#ifdef LOG_HOT_ENABLED
+#define LOG_HOT(fmt, static_arg, arg) log_record(fmt, static_arg, arg)
+#else
+#define LOG_HOT(fmt, static_arg, arg) \
+	do                                \
+	{                                 \
+	} while (0)
+#endif
+
+// Log operation that is performed.
+#define log_operation(op_name) LOG_HOT("Perform operation: %s%s", op_name, "")
+
+// Log path.
+#define log_path(name, path) LOG_HOT("Path %s: %s", name, path)
+
 // Get and validate single configuration variable.
 const char *get_config_var(const char *var_name, int max_len)
 {
@@ -71,6 +182,11 @@ void init_config()
 {
 	const char *ds = get_config_var("domain_socket_file", BUF_SIZE_DOMAIN_SOCKET);
 	strcpy(domain_socket_file, ds);
+
+	// Optional, so not using get_config_var.
+	const char *ro = getenv("read_only");
+	read_only = ro != NULL && strcmp(ro, "1") == 0;
+	printf("Using read_only: %d\n", read_only);
 }
 
 // Connect to domain socket.
@@ -143,6 +259,13 @@ int open_domain_socket()
 		}                                                          \
 	}
 
+// Send trace ID and start time of request, following command.
+#define SEND_TRACE_HEADER()                                        \
+	{                                                              \
+		uint64_t trace_header[2] = {new_trace_id(), time_ns()};    \
+		SEND_WITH_CHECK_ERROR(trace_header, sizeof(trace_header)); \
+	}
+
 // FUSE operation: access (check if file exists)
 static int do_access(const char *path, int perms)
 {
@@ -154,6 +277,7 @@ static int do_access(const char *path, int perms)
 
 	char cmd = 'A';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -167,12 +291,14 @@ static int do_chmod(const char *path, mode_t mode)
 {
 	log_operation("chmod");
 	log_path("to chmod", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'M';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&mode, sizeof(mode_t));
 
@@ -187,12 +313,14 @@ static int do_chown(const char *path, uid_t uid, gid_t gid)
 {
 	log_operation("chown");
 	log_path("to chmod", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'I';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&uid, sizeof(uid_t));
 	SEND_WITH_CHECK_ERROR(&gid, sizeof(gid_t));
@@ -208,12 +336,14 @@ static int do_create(const char *path, mode_t mode, dev_t rdev)
 {
 	log_operation("create");
 	log_path("to create", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'C';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&mode, sizeof(mode_t));
 
@@ -234,6 +364,7 @@ static int do_flush(const char *path, struct fuse_file_info *info)
 
 	char cmd = 'F';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -253,6 +384,7 @@ static int do_getattr(const char *path, struct stat *st)
 
 	char cmd = 'G';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -278,17 +410,68 @@ static int do_getattr(const char *path, struct stat *st)
 	return 0;
 }
 
+// Extended attribute on directories with usage of subtree.
+#define USAGE_XATTR_NAME "user.mc.usage"
+#define USAGE_XATTR_MAX_SIZE 4096
+
+// FUSE operation: getxattr
+// Only usage attribute is supported, computed by server from its directory tree.
+static int do_getxattr(const char *path, const char *name, char *value, size_t size)
+{
+	log_operation("getxattr");
+	log_path("to get extended attribute", path);
+
+	if (strcmp(name, USAGE_XATTR_NAME) != 0)
+	{
+		return -ENODATA;
+	}
+
+	int fd = open_domain_socket();
+	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
+
+	char cmd = 'Z';
+	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
+	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
+
+	int retval;
+	RECV_ALL_WITH_CHECK_ERROR(&retval, sizeof(retval));
+	if (retval < 0 || retval > USAGE_XATTR_MAX_SIZE)
+	{
+		close(fd);
+		return retval < 0 ? retval : -E2BIG;
+	}
+
+	char usage[USAGE_XATTR_MAX_SIZE];
+	RECV_ALL_WITH_CHECK_ERROR(usage, retval);
+	close(fd);
+
+	// Size 0 asks only for length of value.
+	if (size == 0)
+	{
+		return retval;
+	}
+	if (size < (size_t)retval)
+	{
+		return -ERANGE;
+	}
+	memcpy(value, usage, retval);
+	return retval;
+}
+
 // FUSE operation: mkdir
 static int do_mkdir(const char *path, mode_t mode)
 {
 	log_operation("mkdir");
 	log_path("to mkdir", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
-	char cmd = 'M';
+	char cmd = 'K';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -308,6 +491,7 @@ static int do_open(const char *path, struct fuse_file_info *info)
 
 	char cmd = 'O';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -327,6 +511,7 @@ static int do_read(const char *path, char *buffer, size_t size, off_t offset, st
 
 	char cmd = 'R';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&size, sizeof(size));
 	SEND_WITH_CHECK_ERROR(&offset, sizeof(offset));
@@ -359,6 +544,7 @@ static int do_readdir(const char *path, void *buffer, fuse_fill_dir_t filler, of
 
 	char cmd = 'L';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&offset, sizeof(offset));
 
@@ -417,6 +603,7 @@ static int do_release(const char *path, struct fuse_file_info *info)
 
 	char cmd = 'X';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -431,12 +618,14 @@ static int do_rename(const char *source_path, const char *dest_path)
 	log_operation("rename");
 	log_path("source file", source_path);
 	log_path("destination file", dest_path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'N';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(source_path, strlen(source_path) + 1);
 	SEND_WITH_CHECK_ERROR(dest_path, strlen(dest_path) + 1);
 
@@ -451,12 +640,14 @@ static int do_rmdir(const char *path)
 {
 	log_operation("rmdir");
 	log_path("directory to remove", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'D';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -470,12 +661,14 @@ static int do_truncate(const char *path, off_t new_size)
 {
 	log_operation("truncate");
 	log_path("to truncate", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'T';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&new_size, sizeof(new_size));
 
@@ -490,12 +683,14 @@ static int do_unlink(const char *path)
 {
 	log_operation("unlink");
 	log_path("file to remove", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'U';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 
 	int retval;
@@ -509,12 +704,14 @@ static int do_write(const char *path, const char *buffer, size_t size, off_t off
 {
 	log_operation("write");
 	log_path("to write", path);
+	READ_ONLY_CHECK();
 
 	int fd = open_domain_socket();
 	OPEN_DOMAIN_SOCKET_CHECK_ERROR();
 
 	char cmd = 'W';
 	SEND_WITH_CHECK_ERROR(&cmd, 1);
+	SEND_TRACE_HEADER();
 	SEND_WITH_CHECK_ERROR(path, strlen(path) + 1);
 	SEND_WITH_CHECK_ERROR(&size, sizeof(size));
 	SEND_WITH_CHECK_ERROR(&offset, sizeof(offset));
@@ -526,6 +723,13 @@ static int do_write(const char *path, const char *buffer, size_t size, off_t off
 	return retval;
 }
 
+// FUSE operation: init, run once file system is mounted.
+static void *do_init(struct fuse_conn_info *conn)
+{
+	init_log_dump_signal();
+	return NULL;
+}
+
 // Structure with functions for necessary operations.
 static struct fuse_operations operations = {
 	.access = do_access,
@@ -534,6 +738,8 @@ static struct fuse_operations operations = {
 	.create = do_create,
 	.flush = do_flush,
 	.getattr = do_getattr,
+	.getxattr = do_getxattr,
+	.init = do_init,
 	.mkdir = do_mkdir,
 	.open = do_open,
 	.read = do_read,
@@ -550,5 +756,14 @@ static struct fuse_operations operations = {
 int main(int argc, char *argv[])
 {
 	init_config();
-	return fuse_main(argc, argv, &operations, NULL);
+
+	struct fuse_args args = FUSE_ARGS_INIT(argc, argv);
+	if (read_only && fuse_opt_add_arg(&args, READ_ONLY_MOUNT_OPTIONS) != 0)
+	{
+		printf("Could not add read-only mount options!\n");
+		return 1;
+	}
+	int retval = fuse_main(args.argc, args.argv, &operations, NULL);
+	fuse_opt_free_args(&args);
+	return retval;
 }
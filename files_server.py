@@ -3,17 +3,71 @@ Main backend server that handles requests from FUSE process.
 Uses separate process for each open file.
 """
 
+import errno
 import io
+import itertools
 import multiprocessing as mp
 import os
 import socket
 import socketserver
 import sys
 import tempfile
+import threading
 
 import fsspec
+import minio
 
-from process import handler_process
+from bridge import (
+    get_input_uint64,
+    peek_input_uint64,
+    send_dir_listing,
+    send_int,
+    send_metadata,
+    send_read_data,
+    send_xattr_value,
+)
+from crawler import crawl_prefix
+from dir_tree import DirTree, is_inside, split_components
+from invalidation import (
+    Invalidator,
+    diff_events,
+    list_metadata,
+    listing_diff_events,
+    notification_events,
+    reconnecting_events,
+)
+from metadata_index import (
+    MetadataIndex,
+    is_hidden_key,
+    metadata_from_minio,
+    revalidate_index,
+    snapshot_loop,
+)
+from process import get_path, get_request_header, handler_process
+from registry import ObjectRegistry
+import ringlog
+from small_files import SmallFileCache, SmallFilePrefetcher
+from snapshot import MUTATING_ACTIONS, Snapshot
+from tracing import record_span, time_ns
+
+
+class FileServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Server whose connections may be handed off to the process for a path.
+    Handed off connections are only closed here, not shut down, as shutdown
+    would also end the connection for the process.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handed_off = set()
+
+    def shutdown_request(self, request):
+        if request in self.handed_off:
+            self.handed_off.discard(request)
+            self.close_request(request)
+        else:
+            super().shutdown_request(request)
 
 
 class FileSocketServer(socketserver.StreamRequestHandler):
@@ -21,26 +75,631 @@ class FileSocketServer(socketserver.StreamRequestHandler):
     Class that responds to requests from FUSE connector and sends to Python processes.
     """
 
-    num_request = 0
-    manager = None
-    objects_db = None
-    requests_db = None
+    # Do not buffer input, as rest of request may be read by another process.
+    rbufsize = 0
 
     def handle(self):
         """
         Handle requests to server.
-        Transfers control to subprocess.
+        Looks up path in the in-process registry, then transfers control to the
+        process for that path, starting one if necessary.
+        """
+        server = self.server
+        num_request = next(server.request_counter)
+        action, path, trace_id, start_ns = get_request_header(self.rfile)
+        header_ns = time_ns()
+        record_span("fuse_to_server", trace_id, start_ns, header_ns, {"path": path})
+
+        # Fields of request already read here, passed on to process.
+        extra = {"trace_id": trace_id}
+        if server.snapshot is not None and self.handle_snapshot_op(action, path):
+            record_span("server_local", trace_id, header_ns, time_ns())
+            return
+        if self.handle_directory_op(action, path, extra) or self.handle_small_file_op(
+            action, path, extra
+        ):
+            record_span("server_local", trace_id, header_ns, time_ns())
+            return
+
+        def dispatch(entry: dict | None) -> dict:
+            # Connection is answered by process, so must not be shut down here.
+            server.handed_off.add(self.request)
+            if entry is not None and action in MUTATING_ACTIONS:
+                # Metadata seen is out of date once process changes object.
+                entry["metadata"] = None
+            if (
+                entry is not None
+                and entry["process"] is not None
+                and entry["process"].is_alive()
+            ):
+                # Send request to existing process for path.
+                # Duplicate connection, as this one is closed when handler returns.
+                send_to_process(
+                    entry,
+                    {
+                        "num_request": num_request,
+                        "action": action,
+                        "extra": extra,
+                        "conn": self.request.dup(),
+                    },
+                )
+                return entry
+
+            # Need to start new process to handle request.
+            # Metadata from index of previous run used if not seen yet.
+            if entry is not None or action in MUTATING_ACTIONS:
+                metadata = entry["metadata"] if entry is not None else None
+            elif server.snapshot is not None:
+                metadata = server.snapshot.lookup(path)
+            else:
+                metadata = server.metadata_index.lookup(path)
+            queue_in = mp.Queue()
+            p = mp.Process(
+                target=handler_process,
+                args=(
+                    num_request,
+                    path,
+                    action,
+                    extra,
+                    self.request,
+                    queue_in,
+                    server.queue_idle,
+                    metadata,
+                    server.worker_timeout,
+                    server.config,
+                ),
+            )
+            p.start()
+            return {
+                "process": p,
+                "queue_in": queue_in,
+                "num_sent": 0,
+                "metadata": metadata,
+            }
+
+        # Done under lock of shard for path, so only one process started per path.
+        extra["dispatch_ns"] = time_ns()
+        if action == "N":
+            # Process of destination, if any, must drop data of replaced object.
+            invalidate_registry(server, {"path": extra["dest_path"], "metadata": None})
+        server.objects_db.update_entry(path, dispatch)
+        record_span("server_dispatch", trace_id, header_ns, time_ns())
+
+    def handle_snapshot_op(self, action: str, path: str) -> bool:
+        """
+        Handle operations of read-only snapshot mount: changes are rejected,
+        and metadata and listings answered from snapshot, never from MinIO.
+        Returns whether request was fully handled here.
+        """
+        snapshot = self.server.snapshot
+        tree = self.server.dir_tree
+
+        if action in MUTATING_ACTIONS:
+            send_int(self.wfile, -errno.EROFS)
+            return True
+
+        if action == "F":
+            # Nothing to write out.
+            send_int(self.wfile, 0)
+            return True
+
+        if action in ("G", "A"):
+            metadata = snapshot.lookup(path) or tree.dir_metadata(path)
+            if metadata is None:
+                send_int(self.wfile, -errno.ENOENT)
+            elif action == "G":
+                send_metadata(self.wfile, metadata)
+            else:
+                send_int(self.wfile, 0)
+            return True
+
+        if action == "L":
+            get_input_uint64(self.rfile)
+            names = tree.list_dir(path)
+            if names is None:
+                send_int(self.wfile, -errno.ENOENT)
+            else:
+                send_dir_listing(self.wfile, names)
+            return True
+
+        if action == "O" and snapshot.lookup(path) is None:
+            send_int(self.wfile, -errno.ENOENT)
+            return True
+        return False
+
+    def handle_directory_op(self, action: str, path: str, extra: dict) -> bool:
         """
-        mp.Process(
-            target=handler_process,
-            args=(
-                self.num_request,
-                self.objects_db,
-                self.rfile,
-                self.timeout,
-            ),
+        Handle operations answered by directory tree, and update tree for
+        operations that change it.
+        Returns whether request was fully handled here.
+        """
+        server = self.server
+        tree = server.dir_tree
+
+        if action == "L":
+            # Listing is always sent in full, so offset not needed.
+            get_input_uint64(self.rfile)
+            if not tree.is_listed(path) and not list_directory_from_index(server, path):
+                if server.minio_client is None:
+                    return False
+                list_directory(server, path)
+            names = tree.list_dir(path)
+            if names is None:
+                send_int(self.wfile, -errno.ENOENT)
+            else:
+                send_dir_listing(self.wfile, names)
+            return True
+
+        if action == "G":
+            metadata = tree.dir_metadata(path)
+            if metadata is not None:
+                send_metadata(self.wfile, metadata)
+                return True
+            if tree.known_missing(path):
+                send_int(self.wfile, -errno.ENOENT)
+                return True
+            return False
+
+        if action == "Z":
+            # Usage of subtree, for extended attribute on directory.
+            try:
+                if not tree.is_complete(path) and not load_subtree(server, path):
+                    send_int(self.wfile, -errno.ENOTSUP)
+                    return True
+            except OSError:
+                send_int(self.wfile, -errno.EIO)
+                return True
+            usage = tree.usage(path)
+            if usage is None:
+                send_int(self.wfile, -errno.ENOENT)
+            else:
+                send_xattr_value(self.wfile, usage.format().encode("UTF-8"))
+            return True
+
+        if action == "K":
+            if server.minio_client is None:
+                return False
+            parent = os.path.dirname(path.rstrip("/")) or "/"
+            if not tree.is_listed(parent):
+                list_directory(server, parent)
+            if not tree.known_missing(path):
+                send_int(self.wfile, -errno.EEXIST)
+                return True
+            put_dir_marker(server, path)
+            tree.add_dir(path)
+            send_int(self.wfile, 0)
+            return True
+
+        if action == "D":
+            if server.minio_client is None:
+                return False
+            if not tree.is_listed(path):
+                list_directory(server, path)
+            names = tree.list_dir(path)
+            if names is None:
+                send_int(self.wfile, -errno.ENOENT)
+            elif names:
+                send_int(self.wfile, -errno.ENOTEMPTY)
+            else:
+                remove_dir_marker(server, path)
+                tree.remove(path)
+                send_int(self.wfile, 0)
+            return True
+
+        if action == "C":
+            tree.add_file(path)
+        elif action == "W":
+            # Size and offset left for process to read.
+            size, offset = peek_input_uint64(self.request, 2)
+            tree.resize_file(path, offset + size, grow_only=True)
+        elif action == "T":
+            (size,) = peek_input_uint64(self.request, 1)
+            tree.resize_file(path, size)
+        elif action == "U":
+            tree.remove(path)
+        elif action == "N":
+            extra["dest_path"] = get_path(self.rfile)
+            source = split_components(path)
+            dest = split_components(extra["dest_path"])
+            if dest == source:
+                send_int(self.wfile, 0)
+                return True
+            if is_inside(dest, source):
+                send_int(self.wfile, -errno.EINVAL)
+                return True
+            tree.rename(path, extra["dest_path"])
+        return False
+
+    def handle_small_file_op(self, action: str, path: str, extra: dict) -> bool:
+        """
+        Handle open, read and release of files served from small file cache,
+        and drop cached contents for operations that change file.
+        Returns whether request was fully handled here.
+        """
+        server = self.server
+        if server.small_files is None:
+            return False
+        cache = server.small_files.cache
+
+        if action == "O":
+            server.small_files.on_open(path)
+            if cache.open(path):
+                send_int(self.wfile, 0)
+                return True
+            return False
+
+        if action == "R":
+            data = cache.read_open(path)
+            if data is None:
+                return False
+            size = get_input_uint64(self.rfile)
+            offset = get_input_uint64(self.rfile)
+            send_read_data(self.wfile, data[offset : offset + size])
+            return True
+
+        if action == "X":
+            if cache.release(path):
+                send_int(self.wfile, 0)
+                return True
+            return False
+
+        if action in ("C", "W", "T", "U", "N"):
+            # Cached copy is read-only, so drop it and let process of path
+            # handle change and all later requests, including of handles
+            # already open from cache.
+            for p in (path, extra.get("dest_path")):
+                if p is not None:
+                    server.small_files.invalidate(p)
+                    cache.close_all(p)
+        return False
+
+
+def send_to_process(entry: dict, msg: dict):
+    """
+    Send message to process of registry entry, counting it so process is only
+    allowed to exit once it has received all messages sent.
+    Must be called under lock of shard for path.
+    """
+    entry["queue_in"].put(msg)
+    entry["num_sent"] += 1
+
+
+def start_idle_thread(server):
+    """
+    Start thread handling notices from processes idle for too long.
+    Process is told to exit only if it received all messages sent to it, with
+    decision made under lock of shard for path, so no request is sent to a
+    process that exits; later requests start a new process.
+    """
+
+    def run():
+        while True:
+            path, pid, num_received = server.queue_idle.get()
+
+            def update(entry: dict | None) -> dict | None:
+                if (
+                    entry is None
+                    or entry["process"] is None
+                    or entry["process"].pid != pid
+                    or entry["num_sent"] != num_received
+                ):
+                    # Notice from old process, or requests sent since.
+                    return entry
+                entry["queue_in"].put(
+                    {"num_request": -1, "action": "exit", "extra": {}, "conn": None}
+                )
+                entry["process"] = None
+                entry["queue_in"] = None
+                return entry
+
+            server.objects_db.update_entry(path, update)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_config_var(var_name: str, default: str | None = None) -> str | None:
+    """
+    Gets specified configuration variable (from environment variables).
+    Uses default if not set.
+    """
+    v = os.getenv(var_name, default)
+    print(f"Configuration variable {var_name} has value: {v}")
+    return v
+
+
+def dir_key(path: str) -> str:
+    """
+    Get key prefix of objects in directory at path.
+    """
+    key = path.strip("/")
+    return f"{key}/" if key else ""
+
+
+def list_directory(server, path: str):
+    """
+    List directory at path in MinIO and store contents in directory tree.
+    """
+    prefix = dir_key(path)
+    names = []
+    dir_names = []
+    sizes = {}
+    for obj in server.minio_client.list_objects(
+        server.config["minio_bucket"], prefix=prefix, recursive=False
+    ):
+        name = obj.object_name[len(prefix) :]
+        if is_hidden_key(obj.object_name):
+            continue
+        if obj.is_dir:
+            dir_names.append(name.rstrip("/"))
+        elif name:
+            names.append(name)
+            sizes[name] = obj.size or 0
+    server.dir_tree.load_listing(path, names, dir_names, sizes)
+
+
+def list_directory_from_index(server, path: str) -> bool:
+    """
+    Store contents of directory at path in directory tree from index of
+    previous run, then list it in MinIO in background to correct them.
+    Returns False if index has nothing in directory, which may be new.
+    """
+    names, dir_names, sizes = server.metadata_index.list_dir(path)
+    if not names and not dir_names:
+        return False
+    server.dir_tree.load_listing(path, names, dir_names, sizes)
+    if server.minio_client is not None:
+
+        def run():
+            try:
+                list_directory(server, path)
+            except (OSError, minio.error.S3Error) as e:
+                print(f"Revalidation of listing of {path} failed:", e)
+
+        threading.Thread(target=run, daemon=True).start()
+    return True
+
+
+def load_subtree(server, path: str) -> bool:
+    """
+    Load all objects under directory at path into directory tree, from
+    parallel crawl in MinIO, or from index of previous run if no MinIO.
+    Metadata of crawled objects is also stored in registry.
+    Returns False if neither available.
+    """
+    prefix = dir_key(path)
+    if server.minio_client is not None:
+        results = crawl_prefix(
+            server.minio_client,
+            server.config["minio_bucket"],
+            prefix,
+            server.config["crawl_threads"],
+        )
+        entries = [(key, size) for key, size, _ in results]
+        for _, _, metadata in results:
+            if metadata is not None:
+                store_crawled_metadata(server, metadata)
+    elif server.metadata_index.map is not None:
+        entries = (
+            (m["minio_path"][len(prefix) + 1 :], m["size"])
+            for m in server.metadata_index.list_prefix("/" + prefix)
         )
-        self.num_request += 1
+    else:
+        return False
+    server.dir_tree.load_subtree(path, entries)
+    return True
+
+
+def store_crawled_metadata(server, metadata: dict):
+    """
+    Store metadata from crawl in registry, unless path already has metadata.
+    """
+
+    def update(entry: dict | None) -> dict:
+        if entry is None:
+            return {"process": None, "queue_in": None, "metadata": metadata}
+        if entry["metadata"] is None:
+            entry["metadata"] = metadata
+        return entry
+
+    server.objects_db.update_entry(metadata["minio_path"], update)
+
+
+def start_crawl_thread(server, paths: list):
+    """
+    Start thread loading subtrees at paths into directory tree, one at a time.
+    """
+
+    def run():
+        for path in paths:
+            try:
+                load_subtree(server, path)
+            except OSError as e:
+                print(f"Crawl of {path} failed:", e)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def list_sorted(server, path: str) -> list | None:
+    """
+    Get sorted names in directory, listing it in MinIO if not known yet.
+    """
+    if not server.dir_tree.is_listed(path):
+        list_directory(server, path)
+    return server.dir_tree.list_dir(path)
+
+
+def put_dir_marker(server, path: str):
+    """
+    Create marker object for empty directory, with key ending in "/".
+    """
+    server.minio_client.put_object(
+        server.config["minio_bucket"], dir_key(path), io.BytesIO(b""), 0
+    )
+
+
+def remove_dir_marker(server, path: str):
+    """
+    Remove marker object of directory, if any.
+    """
+    server.minio_client.remove_object(server.config["minio_bucket"], dir_key(path))
+
+
+def registry_metadata(registry: ObjectRegistry) -> list:
+    """
+    Get (path, metadata) pairs in registry, for snapshot to index.
+    """
+    return [(path, e["metadata"]) for path, e in registry.items()]
+
+
+def start_index_threads(server, config: dict):
+    """
+    Start threads to snapshot registry metadata to index and to revalidate index.
+    Revalidated metadata is stored in registry, where it takes precedence over index.
+    """
+    index = server.metadata_index
+    threading.Thread(
+        target=snapshot_loop,
+        args=(
+            index,
+            lambda: registry_metadata(server.objects_db),
+            config["metadata_snapshot_interval"],
+        ),
+        daemon=True,
+    ).start()
+
+    client = server.minio_client
+    if client is None or len(index) == 0:
+        return
+
+    def stat_object(path: str) -> dict | None:
+        try:
+            return metadata_from_minio(
+                client.stat_object(config["minio_bucket"], path.lstrip("/"))
+            )
+        except minio.error.S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise OSError(str(e)) from e
+
+    def on_result(path: str, metadata: dict | None):
+        def update(entry: dict | None) -> dict:
+            if entry is None:
+                return {"process": None, "queue_in": None, "metadata": metadata}
+            entry["metadata"] = metadata
+            return entry
+
+        server.objects_db.update_entry(path, update)
+
+    threading.Thread(
+        target=revalidate_index,
+        args=(
+            index,
+            stat_object,
+            on_result,
+            config["revalidate_threads"],
+            config["revalidate_rate"],
+        ),
+        daemon=True,
+    ).start()
+
+
+def invalidate_registry(server, event: dict):
+    """
+    Apply change event to registry: store new metadata (None if removed), and
+    notify process of path, if any, to drop cached data.
+    Events matching metadata already known, such as from own writes, are ignored.
+    """
+    path = event["path"]
+    metadata = event["metadata"]
+
+    def update(entry: dict | None) -> dict:
+        if entry is None:
+            return {"process": None, "queue_in": None, "metadata": metadata}
+        old = entry["metadata"]
+        if old is not None and metadata is not None and old["etag"] == metadata["etag"]:
+            return entry
+        entry["metadata"] = metadata
+        if entry["process"] is not None and entry["process"].is_alive():
+            send_to_process(
+                entry,
+                {
+                    "num_request": -1,
+                    "action": "invalidate",
+                    "extra": {"metadata": metadata},
+                    "conn": None,
+                },
+            )
+        return entry
+
+    server.objects_db.update_entry(path, update)
+
+
+def invalidate_dir_tree(server, event: dict):
+    """
+    Apply change event to directory tree.
+    """
+    if event["kind"] == "removed":
+        server.dir_tree.remove(event["path"])
+    else:
+        server.dir_tree.add_file(event["path"], event["metadata"]["size"])
+    if server.small_files is not None:
+        server.small_files.invalidate(event["path"])
+
+
+def known_metadata(server, prefix: str) -> dict:
+    """
+    Get metadata of objects under prefix cached by server, by path, from
+    registry and index of previous run.
+    """
+    known = {m["minio_path"]: m for m in server.metadata_index.list_prefix(prefix)}
+    for path, entry in server.objects_db.items():
+        if path.startswith(prefix) and entry["metadata"] is not None:
+            known[path] = entry["metadata"]
+    return known
+
+
+def resync_events(server, config: dict):
+    """
+    Generate events for changes missed while notifications were disconnected,
+    from full listing compared with cached metadata.
+    Directory listings and small files are not compared, just dropped.
+    """
+    prefix = config["invalidation_prefix"]
+    print("Resynchronize cached metadata after reconnect.")
+    current = list_metadata(server.minio_client, config["minio_bucket"], prefix)
+    server.dir_tree.clear()
+    if server.small_files is not None:
+        server.small_files.invalidate_all()
+    yield from diff_events(known_metadata(server, "/" + prefix), current)
+
+
+def start_invalidation_thread(server, config: dict):
+    """
+    Start thread applying change events to caches of server.
+    Uses bucket notifications, or periodic listing diff if so configured.
+    Notifications are reconnected if they fail, with caches then resynchronized.
+    """
+    invalidator = Invalidator()
+    invalidator.add_handler(lambda event: invalidate_registry(server, event))
+    invalidator.add_handler(lambda event: invalidate_dir_tree(server, event))
+
+    client = server.minio_client
+    bucket = config["minio_bucket"]
+    prefix = config["invalidation_prefix"]
+    if config["invalidation"] == "notify":
+        events = reconnecting_events(
+            lambda: notification_events(client, bucket, prefix),
+            lambda: resync_events(server, config),
+        )
+    elif config["invalidation"] == "diff":
+        events = listing_diff_events(
+            client, bucket, prefix, config["invalidation_interval"]
+        )
+    else:
+        raise ValueError(f"Unknown invalidation mode {config['invalidation']}!")
+
+    threading.Thread(target=invalidator.run, args=(events,), daemon=True).start()
+    server.invalidator = invalidator
 
 
 def main():
@@ -48,16 +707,92 @@ def main():
     Function invoked when this program is run from command line.
     """
     mp.set_start_method("fork", force=True)
-    with (
-        socketserver.UnixStreamServer(
-            "/tmp/fs_server.socket",  # TODO: make configurable
-            FileSocketServer,
-        ) as server,
-        mp.Manager() as manager,
-    ):
-        server.manager = manager
-        server.objects_db = manager.dict()
-        server.requests_db = manager.dict()
+    ringlog.install_dump_signal()
+    config = {
+        "metadata_index": get_config_var("metadata_index"),
+        "metadata_snapshot_interval": float(
+            get_config_var("metadata_snapshot_interval", "300")
+        ),
+        "revalidate_threads": int(get_config_var("revalidate_threads", "8")),
+        "revalidate_rate": float(get_config_var("revalidate_rate", "200")),
+        "minio_host": get_config_var("minio_host"),
+        "minio_access_key": get_config_var("minio_access_key"),
+        "minio_secret_key": get_config_var("minio_secret_key"),
+        "minio_bucket": get_config_var("minio_bucket"),
+        "invalidation": get_config_var("invalidation"),
+        "invalidation_prefix": get_config_var("invalidation_prefix", ""),
+        "invalidation_interval": float(get_config_var("invalidation_interval", "60")),
+        "small_file_prefixes": [
+            p for p in get_config_var("small_file_prefixes", "").split(",") if p
+        ],
+        "small_file_max_size": int(get_config_var("small_file_max_size", "262144")),
+        "small_file_cache_size": int(
+            get_config_var("small_file_cache_size", str(256 * 1024 * 1024))
+        ),
+        "small_file_prefetch": int(get_config_var("small_file_prefetch", "32")),
+        "small_file_threads": int(get_config_var("small_file_threads", "16")),
+        "read_only": get_config_var("read_only", "0") == "1",
+        "snapshot_prefix": get_config_var("snapshot_prefix", ""),
+        "crawl_prefixes": [
+            p for p in get_config_var("crawl_prefixes", "").split(",") if p
+        ],
+        "crawl_threads": int(get_config_var("crawl_threads", "16")),
+    }
+
+    with FileServer(
+        "/tmp/fs_server.socket",  # TODO: make configurable
+        FileSocketServer,
+    ) as server:
+        server.config = config
+        server.minio_client = None
+        if config["minio_host"] is not None:
+            server.minio_client = minio.Minio(
+                config["minio_host"],
+                access_key=config["minio_access_key"],
+                secret_key=config["minio_secret_key"],
+            )
+        server.request_counter = itertools.count()
+        server.objects_db = ObjectRegistry()
+        server.worker_timeout = 60.0
+        server.queue_idle = mp.Queue()
+        start_idle_thread(server)
+        server.dir_tree = DirTree()
+        server.metadata_index = MetadataIndex(config["metadata_index"])
+        server.snapshot = None
+        if config["read_only"]:
+            # Contents fixed at mount, so no index or invalidation needed.
+            server.snapshot = Snapshot(config["snapshot_prefix"])
+            if server.minio_client is not None:
+                server.snapshot.capture(
+                    server.minio_client,
+                    config["minio_bucket"],
+                    server.dir_tree,
+                    config["crawl_threads"],
+                )
+            elif not server.snapshot.load_index(server.metadata_index, server.dir_tree):
+                raise ValueError(
+                    "Read-only mode needs minio_host or metadata_index for snapshot!"
+                )
+        elif config["metadata_index"] is not None:
+            start_index_threads(server, config)
+        if config["crawl_prefixes"] and server.minio_client is not None:
+            start_crawl_thread(
+                server, ["/" + p.strip("/") for p in config["crawl_prefixes"]]
+            )
+        server.small_files = None
+        if config["small_file_prefixes"] and server.minio_client is not None:
+            server.small_files = SmallFilePrefetcher(
+                server.minio_client,
+                config,
+                SmallFileCache(config["small_file_cache_size"]),
+                lambda p: list_sorted(server, p),
+            )
+        if (
+            config["invalidation"] is not None
+            and server.minio_client is not None
+            and server.snapshot is None
+        ):
+            start_invalidation_thread(server, config)
         server.serve_forever()
 
 
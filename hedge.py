@@ -0,0 +1,173 @@
+"""
+Hedged requests to backend, to cut tail latency from slow nodes.
+If a request has not completed within a percentile of recent latencies of
+the same kind, a duplicate is sent and whichever completes first is used.
+Duplicates are limited by a budget, as a fraction of all requests, and
+transfers larger than a configured size are not duplicated, so a slow large
+download does not cost its size again in bandwidth.
+"""
+
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
+# Minimum number of latency samples before requests are hedged.
+MIN_SAMPLES = 20
+
+# Default largest transfer hedged, in bytes.
+DEFAULT_MAX_SIZE = 8 * 1024 * 1024
+
+
+class LatencyTracker:
+    """
+    Recent latencies of requests to one backend, by kind of request.
+    """
+
+    def __init__(self, window: int = 512):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, seconds: float):
+        """
+        Add latency of completed request.
+        """
+        with self.lock:
+            if kind not in self.samples:
+                self.samples[kind] = collections.deque(maxlen=self.window)
+            self.samples[kind].append(seconds)
+
+    def percentile(self, kind: str, p: float) -> float | None:
+        """
+        Get p-th percentile of recent latencies, or None if too few samples.
+        """
+        with self.lock:
+            samples = sorted(self.samples.get(kind, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class HedgeBudget:
+    """
+    Token bucket limiting hedged requests to a fraction of all requests.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def on_request(self):
+        """
+        Add credit for a request sent.
+        """
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """
+        Use credit for a hedged request, if available.
+        """
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+# Latency statistics and budgets of this process, by backend host.
+trackers = {}
+budgets = {}
+executor = None
+executor_pid = None
+state_lock = threading.Lock()
+
+
+def get_backend_state(config: dict) -> tuple:
+    """
+    Get latency tracker and hedge budget for backend of config.
+    """
+    host = config["minio_host"]
+    with state_lock:
+        if host not in trackers:
+            trackers[host] = LatencyTracker()
+            budgets[host] = HedgeBudget(config.get("hedge_budget", 0.05))
+        return trackers[host], budgets[host]
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Get thread pool for requests of this process, creating it on first use.
+    """
+    global executor, executor_pid  # pylint: disable=global-statement
+    with state_lock:
+        if executor is None or executor_pid != os.getpid():
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+            executor_pid = os.getpid()
+        return executor
+
+
+def should_hedge(config: dict, size: int | None = None) -> bool:
+    """
+    Whether request transferring size bytes (None if small or unknown) may be
+    hedged.
+    """
+    if not config.get("hedge_enabled"):
+        return False
+    return size is None or size <= config.get("hedge_max_size", DEFAULT_MAX_SIZE)
+
+
+def hedged_call(config: dict, kind: str, attempt, cleanup=None, size=None):
+    """
+    Call attempt(i) with i = 0, and if it is slow also with i = 1, returning
+    (i, result) of whichever completes first.
+    Attempt number lets callers use separate destinations for each attempt.
+    Function cleanup(i, result) is called for the result not used.
+    Hedging is disabled unless config has hedge_enabled set, and for
+    transfers of more than hedge_max_size bytes.
+    Latency of transfers is kept by kind, so callers should use separate kinds
+    for very different sizes.
+    """
+    tracker, budget = get_backend_state(config)
+
+    def timed(i: int):
+        start_time = time.monotonic()
+        r = attempt(i)
+        tracker.record(kind, time.monotonic() - start_time)
+        return i, r
+
+    threshold = tracker.percentile(kind, config.get("hedge_percentile", 95.0))
+    if not should_hedge(config, size) or threshold is None:
+        return timed(0)
+
+    budget.on_request()
+    pool = get_executor()
+    first = pool.submit(timed, 0)
+    done, _ = concurrent.futures.wait([first], timeout=threshold)
+    if done or not budget.try_spend():
+        return first.result()
+
+    print(f"Request {kind} slower than {round(threshold, 3)} seconds, send duplicate.")
+    second = pool.submit(timed, 1)
+    done, pending = concurrent.futures.wait(
+        [first, second], return_when=concurrent.futures.FIRST_COMPLETED
+    )
+    winner = done.pop()
+    remaining = pending | done
+    loser = remaining.pop() if remaining else None
+    if winner.exception() is not None and loser is not None:
+        # Failed first, so wait for other attempt instead.
+        winner, loser = loser, None
+
+    if loser is not None and cleanup is not None:
+
+        def cleanup_loser(f: concurrent.futures.Future):
+            if f.exception() is None:
+                cleanup(*f.result())
+
+        loser.add_done_callback(cleanup_loser)
+    return winner.result()
@@ -2,14 +2,46 @@
 Implementations of operations for backend server.
 """
 
+import errno
 import io
+import mmap
 import multiprocessing as mp
 import os
+import shutil
 import sys
 import tempfile
+import time
 
 import minio
 
+from block_store import BlockStore
+from bridge import send_metadata
+from decompress import (
+    UNCOMPRESSED_SIZE_KEY,
+    decompressed_size,
+    open_decompressed,
+    should_decompress,
+)
+from hedge import hedged_call, should_hedge
+from memory_store import ChunkStore, MemoryFile, get_chunk_store
+from metadata_index import DEFAULT_FILE_MODE, metadata_from_minio
+from partial_rewrite import RangeSet, compose_rewrite
+from shared_cache import SharedCacheClient
+from streaming_upload import StreamingUpload, upload_memory
+import ringlog
+from tracing import record_span, span, time_ns
+
+MSG_READ = ringlog.register("Perform read operation on file {}.")
+MSG_READ_ARGS = ringlog.register("Using size {} and offset {}.")
+MSG_READ_ERROR = ringlog.register("Encountered error during read: {}")
+MSG_READ_DONE = ringlog.register("Done the read operation, {} bytes.")
+MSG_WRITE = ringlog.register("Perform write operation on file {}.")
+MSG_WRITE_ARGS = ringlog.register("Using size {} and offset {}.")
+MSG_WRITE_DONE = ringlog.register("Done the write operation, {} bytes.")
+MSG_REQUEST = ringlog.register("Do operation {} on path {}.")
+MSG_PIPE_CLEANUP_ERROR = ringlog.register("Error during cleanup pipes: {}")
+MSG_REQUEST_DONE = ringlog.register("Done the {} operation.")
+
 
 def get_input_uint64(pipe_request: io.BufferedReader) -> int:
     """
@@ -35,6 +67,55 @@ def send_output_uint64(pipe_response: io.BufferedWriter, value: int):
     pipe_response.write(b)
 
 
+def send_file_range(
+    pipe_response: io.BufferedWriter,
+    f: io.IOBase,
+    offset: int,
+    size: int,
+) -> int:
+    """
+    Send success status, length and up to size bytes of file at offset, without
+    copying the data through Python bytes objects.
+    Uses sendfile from the file to the response, or slices of mmap of the file
+    where sendfile is not supported.
+    Raises error only if status not sent yet. Error after that is logged and
+    ends the data early, so only this response fails, which reader detects
+    from it being shorter than the length sent.
+    Returns number of bytes sent.
+    """
+    f.flush()
+    in_fd = f.fileno()
+    length = max(0, min(size, os.fstat(in_fd).st_size - offset))
+    send_output_int8(pipe_response, 0)  # success status code
+    send_output_uint64(pipe_response, length)
+    pipe_response.flush()
+
+    out_fd = pipe_response.fileno()
+    sent = 0
+    try:
+        while sent < length:
+            n = os.sendfile(out_fd, in_fd, offset + sent, length - sent)
+            if n == 0:
+                raise OSError(errno.EIO, "File shorter than expected during send.")
+            sent += n
+    except OSError as e:
+        if sent > 0 or e.errno not in (errno.EINVAL, errno.ENOSYS):
+            ringlog.log(ringlog.ERROR, MSG_READ_ERROR, str(e))
+            return sent
+        try:
+            with (
+                mmap.mmap(in_fd, 0, access=mmap.ACCESS_READ) as m,
+                memoryview(m) as view,
+                view[offset : offset + length] as part,
+            ):
+                pipe_response.write(part)
+                pipe_response.flush()
+            sent = length
+        except (OSError, ValueError) as mmap_error:
+            ringlog.log(ringlog.ERROR, MSG_READ_ERROR, str(mmap_error))
+    return sent
+
+
 class CacheObject:
     """
     Object representing cached entry in MinIO file system.
@@ -43,18 +124,42 @@ class CacheObject:
     def __init__(self, minio_path: str, temp_dir: str, config: dict):
         self.minio_path = minio_path
         self.basic_minio_path = minio_path.lstrip("/")
+        # No temporary directory in memory-only mode.
         self.temp_dir = temp_dir
-        self.temp_path = f"{temp_dir}/file.bin"
+        self.temp_path = f"{temp_dir}/file.bin" if temp_dir is not None else None
         self.config = config
 
         self.write_out = False
         self.handle = None
-        self.minio_client = minio.Minio(
-            config["minio_host"],
-            access_key=config["minio_access_key"],
-            secret_key=config["minio_secret_key"],
-        )
+        self.upload = None
+        # Bytes of memory budget reserved for upload in progress.
+        self.upload_reserved = 0
+        self.decompress = should_decompress(config, minio_path)
+        self.minio_client = get_minio_client(config)
         self.minio_bucket = self.config["minio_bucket"]
+        self.shared_cache = None
+        if config.get("shared_cache_socket"):
+            self.shared_cache = SharedCacheClient(
+                config["shared_cache_socket"], config["minio_bucket"]
+            )
+        self.shared_handle = False
+        self.memory_only = config.get("memory_only", False)
+        # ETag of version seen by read-only mount, required for all reads.
+        self.pinned_etag = config.get("pinned_etag")
+        self.block_store = None
+        if config.get("block_cache_dir") and not self.memory_only:
+            self.block_store = BlockStore(
+                config["block_cache_dir"],
+                config["block_size"],
+                config["block_cache_budget"],
+            )
+
+        # Set if existing object is rewritten in place: ETag and size of
+        # object on server, ranges of local file with data and modified ranges.
+        self.remote = None
+        self.present = RangeSet()
+        self.dirty = RangeSet()
+        self.size = 0
 
     def init_handle(self, retrieve: bool):
         """
@@ -65,16 +170,48 @@ class CacheObject:
         temp_path = self.temp_path
         minio_path = self.minio_path
 
-        if retrieve:
-            # Copy object from MinIO to temporary file.
-            print(f"Copy to local file {temp_path} MinIO object {minio_path}.")
-            self.minio_client.fget_object(
+        if self.handle is not None:
+            return
+
+        if retrieve and self.memory_only:
+            # Read through chunks in memory, nothing staged on disk.
+            self.handle = MemoryFile(
+                self.chunk_store(),
+                self.minio_client,
                 self.minio_bucket,
                 self.basic_minio_path,
-                self.temp_path,
             )
+            self.shared_handle = True
+            self.check_pinned(self.handle.etag)
+        elif temp_path is None:
+            raise OSError(
+                errno.EOPNOTSUPP, f"Local file for {minio_path} without local disk."
+            )
+        elif retrieve and self.shared_cache is not None:
+            # Read copy from cache shared with other mounts, until written.
+            print(f"Open shared cache copy of MinIO object {minio_path}.")
+            with span("shared_cache_open", self.config.get("trace_id", 0)):
+                self.handle, metadata = self.shared_cache.open_object(
+                    self.basic_minio_path
+                )
+            self.shared_handle = True
+            self.check_pinned(metadata["etag"])
+        elif retrieve and self.block_store is not None:
+            # Read from deduplicated blocks, downloaded only if not stored yet.
+            print(f"Open MinIO object {minio_path} from block cache.")
+            with span("block_cache_open", self.config.get("trace_id", 0)):
+                self.handle = self.block_store.open_object(
+                    self.minio_client, self.minio_bucket, self.basic_minio_path
+                )
+            self.shared_handle = True
+            self.check_pinned(self.handle.etag)
+        elif retrieve:
+            # Copy object from MinIO to temporary file.
+            print(f"Copy to local file {temp_path} MinIO object {minio_path}.")
+            with span("minio_fget_object", self.config.get("trace_id", 0)):
+                self.fget_object_hedged()
 
-            self.handle = open(temp_path, "+ab")
+            self.handle = open(temp_path, "r+b")
             print("Done obtaining the object from MinIO.")
         else:
             # Create empty.
@@ -83,29 +220,344 @@ class CacheObject:
             print("Done creating the new empty file.")
             self.write_out = True
 
+    def chunk_store(self) -> ChunkStore:
+        """
+        Get chunk store of process, for memory-only mode.
+        """
+        return get_chunk_store(
+            self.config["memory_cache_budget"], self.config["memory_chunk_size"]
+        )
+
+    def check_pinned(self, etag: str | None):
+        """
+        Close handle and raise error if object opened is not the version
+        pinned by read-only mount.
+        """
+        if self.pinned_etag is None or etag == self.pinned_etag:
+            return
+        self.handle.close()
+        self.handle = None
+        raise OSError(
+            errno.ESTALE,
+            f"Object {self.minio_path} changed since mount, ETag {etag} "
+            f"instead of {self.pinned_etag}.",
+        )
+
+    def detach_shared(self):
+        """
+        Copy file opened from shared cache or block cache to private temporary
+        file, before it is modified.
+        """
+        if not self.shared_handle:
+            return
+        with open(self.temp_path, "wb") as f:
+            self.handle.seek(0, os.SEEK_SET)
+            shutil.copyfileobj(self.handle, f)
+        self.handle.close()
+        self.handle = open(self.temp_path, "r+b")
+        self.shared_handle = False
+
+    def init_partial(self) -> bool:
+        """
+        Open sparse local file for rewriting parts of large existing object,
+        if enabled and object large enough. Data is fetched only for ranges
+        read or needed for modified parts.
+        Returns whether object is now rewritten in place.
+        """
+        if self.handle is not None or not self.config.get("partial_rewrite"):
+            return self.remote is not None
+        try:
+            obj = self.minio_client.stat_object(
+                self.minio_bucket, self.basic_minio_path
+            )
+        except minio.error.S3Error:
+            return False
+        if obj.size < self.config["partial_rewrite_min_size"]:
+            return False
+
+        print(f"Rewrite parts of MinIO object {self.minio_path} in place.")
+        self.remote = {"etag": obj.etag, "size": obj.size}
+        self.size = obj.size
+        self.present.clear()
+        self.dirty.clear()
+        with open(self.temp_path, "wb") as f:
+            f.truncate(obj.size)
+        self.handle = open(self.temp_path, "r+b")
+        return True
+
+    def fill_range(self, start: int, end: int):
+        """
+        Fetch data of object in range not yet present in local file.
+        """
+        end = min(end, self.remote["size"])
+        for gap_start, gap_end in self.present.missing(start, end):
+            length = gap_end - gap_start
+            if should_hedge(self.config, length):
+                # Small range kept in memory, so duplicate can be sent if slow.
+                _, data = hedged_call(
+                    self.config,
+                    "get_range",
+                    lambda i: self.get_range(gap_start, length),
+                    size=length,
+                )
+                self.handle.seek(gap_start, os.SEEK_SET)
+                self.handle.write(data)
+                self.present.add(gap_start, gap_end)
+                continue
+
+            response = self.minio_client.get_object(
+                self.minio_bucket,
+                self.basic_minio_path,
+                offset=gap_start,
+                length=length,
+                request_headers={"If-Match": self.remote["etag"]},
+            )
+            try:
+                self.handle.seek(gap_start, os.SEEK_SET)
+                for chunk in response.stream(1024 * 1024):
+                    self.handle.write(chunk)
+            finally:
+                response.close()
+                response.release_conn()
+            self.present.add(gap_start, gap_end)
+
+    def get_range(self, offset: int, length: int) -> bytes:
+        """
+        Get bytes of object in range, failing if object changed.
+        """
+        response = self.minio_client.get_object(
+            self.minio_bucket,
+            self.basic_minio_path,
+            offset=offset,
+            length=length,
+            request_headers={"If-Match": self.remote["etag"]},
+        )
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def read_local(self, start: int, end: int) -> bytes:
+        """
+        Get data of range from local file, fetching parts not present.
+        """
+        self.fill_range(start, end)
+        self.handle.seek(start, os.SEEK_SET)
+        return self.handle.read(end - start)
+
+    def commit_partial(self):
+        """
+        Write modified object to MinIO, uploading only modified parts.
+        """
+        if not self.dirty and self.size == self.remote["size"]:
+            return
+        if self.size == 0:
+            self.minio_client.put_object(
+                self.minio_bucket, self.basic_minio_path, io.BytesIO(b""), 0
+            )
+            etag = None
+        else:
+            result = compose_rewrite(
+                self.minio_client,
+                self.minio_bucket,
+                self.basic_minio_path,
+                self.remote["etag"],
+                self.remote["size"],
+                self.size,
+                self.dirty,
+                self.read_local,
+                self.config["upload_part_size"],
+                self.config.get("partial_rewrite_staging_bucket"),
+            )
+            etag = result.etag
+        if self.shared_cache is not None:
+            self.shared_cache.invalidate(self.basic_minio_path)
+
+        # Local file now matches new object.
+        self.present.add(self.remote["size"], self.size)
+        self.remote = {"etag": etag, "size": self.size}
+        self.dirty.clear()
+        if etag is None:
+            self.remote = None
+
+    def fget_object_hedged(self):
+        """
+        Copy object from MinIO to temporary file, with duplicate request if slow
+        and object small enough that a duplicate costs little bandwidth.
+        Each attempt downloads to its own file, and the first done is used.
+        """
+        size = None
+        if should_hedge(self.config):
+            size = self.minio_client.stat_object(
+                self.minio_bucket, self.basic_minio_path
+            ).size
+
+        def attempt(i: int) -> str:
+            path = f"{self.temp_path}.attempt{i}"
+            self.minio_client.fget_object(
+                self.minio_bucket,
+                self.basic_minio_path,
+                path,
+                request_headers=(
+                    {"If-Match": self.pinned_etag} if self.pinned_etag else None
+                ),
+            )
+            return path
+
+        def cleanup(i: int, path: str):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+        _, path = hedged_call(self.config, "get", attempt, cleanup, size)
+        os.replace(path, self.temp_path)
+
     def put_object_minio(self):
         """
         Copy temporary file object to MinIO storage.
         """
         self.minio_client.fput_object(
             self.minio_bucket,
-            self.minio_path,
+            self.basic_minio_path,
             self.temp_path,
         )
+        if self.shared_cache is not None:
+            self.shared_cache.invalidate(self.basic_minio_path)
+
+    def start_upload(self):
+        """
+        Start streaming upload, replacing object with data written from start.
+        In memory-only mode, its buffers are reserved from memory budget.
+        """
+        if self.memory_only and not self.upload_reserved:
+            size = upload_memory(self.config["upload_part_size"])
+            if not self.chunk_store().reserve(size):
+                raise OSError(
+                    errno.ENOMEM,
+                    f"No memory budget left to upload {self.minio_path}, "
+                    "too many uploads in progress.",
+                )
+            self.upload_reserved = size
+        self.upload = StreamingUpload(
+            self.minio_client,
+            self.minio_bucket,
+            self.basic_minio_path,
+            self.config["upload_part_size"],
+        )
+
+    def finish_upload(self):
+        """
+        Complete streaming upload, if one in progress.
+        Later operations then use the uploaded object as an existing file.
+        """
+        if self.upload is not None:
+            upload = self.upload
+            self.upload = None
+            try:
+                upload.finish()
+            finally:
+                self.release_upload_memory()
+            if self.memory_only:
+                self.chunk_store().drop(self.basic_minio_path)
+            if self.shared_cache is not None:
+                self.shared_cache.invalidate(self.basic_minio_path)
+
+    def release_upload_memory(self):
+        """
+        Return memory reserved for upload to budget, if any.
+        """
+        if self.upload_reserved:
+            self.chunk_store().unreserve(self.upload_reserved)
+            self.upload_reserved = 0
+
+    def init_decompressed_handle(self):
+        """
+        Initialize handle to decompressed contents of object, if not done yet.
+        """
+        if self.handle is None:
+            self.handle = open_decompressed(
+                self.minio_client,
+                self.minio_bucket,
+                self.minio_path,
+                self.temp_path,
+            )
+
+    def prepare_read(self, size: int, offset: int):
+        """
+        Make sure handle has data of size bytes at offset.
+        """
+        if self.decompress:
+            self.init_decompressed_handle()
+        elif self.remote is not None:
+            self.fill_range(offset, offset + size)
+        else:
+            self.finish_upload()
+            self.init_handle(True)
 
     def read(self, size: int, offset: int) -> bytes:
         """
         Read size bytes at offset.
         """
-        self.init_handle(True)
+        self.prepare_read(size, offset)
         self.handle.seek(offset, os.SEEK_SET)
         return self.handle.read(size)
 
+    def send_range(self, pipe_response: io.BufferedWriter, size: int, offset: int):
+        """
+        Send size bytes at offset to response, straight from the local file if
+        there is one.
+        Raises error only if status not sent yet, see send_file_range.
+        Returns number of bytes sent.
+        """
+        self.prepare_read(size, offset)
+        if not isinstance(self.handle, io.IOBase):
+            data = self.read(size, offset)
+            send_output_int8(pipe_response, 0)
+            send_output_uint64(pipe_response, len(data))
+            pipe_response.write(data)
+            return len(data)
+        return send_file_range(pipe_response, self.handle, offset, size)
+
     def write(self, data: bytes, offset: int) -> bytes:
         """
         Write specified bytes at offset.
         """
+        if self.decompress:
+            raise OSError(
+                errno.EROFS, f"Object {self.minio_path} is read-only when decompressed."
+            )
+
+        # Appends to new file go straight to upload; other writes stage file.
+        if self.upload is not None:
+            if self.upload.write(data, offset):
+                return
+            if self.memory_only:
+                raise OSError(
+                    errno.EOPNOTSUPP,
+                    f"Non-sequential write to {self.minio_path} without local disk.",
+                )
+            print(f"Non-sequential write to {self.minio_path}, stage file instead.")
+            self.finish_upload()
+        if self.memory_only:
+            raise OSError(
+                errno.EOPNOTSUPP,
+                f"Write to existing {self.minio_path} without local disk, "
+                "truncate it to zero first.",
+            )
+
+        if self.init_partial():
+            self.handle.seek(offset, os.SEEK_SET)
+            self.handle.write(data)
+            self.dirty.add(offset, offset + len(data))
+            self.present.add(offset, offset + len(data))
+            self.size = max(self.size, offset + len(data))
+            self.write_out = True
+            return
+
         self.init_handle(True)
+        self.detach_shared()
         self.handle.seek(offset, os.SEEK_SET)
         self.handle.write(data)
         self.write_out = True
@@ -114,7 +566,22 @@ class CacheObject:
         """
         Flush file to disk cache and MinIO, if anything to write.
         """
-        self.init_handle(False)
+        if self.upload is not None:
+            self.finish_upload()
+            return
+        if self.memory_only:
+            # Only uploads write in memory-only mode, nothing else to write.
+            return
+        if self.remote is not None:
+            if self.write_out:
+                self.handle.flush()
+                self.commit_partial()
+                self.write_out = False
+            return
+        if self.handle is None:
+            # Nothing read or written, and object must not be replaced by an
+            # empty file.
+            return
         if self.write_out:
             self.handle.flush()
             self.put_object_minio()
@@ -124,7 +591,12 @@ class CacheObject:
         """
         Create new file.
         TODO: if file already exists, raise error instead.
+        If streaming upload enabled, data is uploaded as written, as long as
+        writes are sequential.
         """
+        if self.config.get("streaming_upload") or self.memory_only:
+            self.start_upload()
+            return
         self.init_handle(False)
         self.put_object_minio()
 
@@ -132,7 +604,31 @@ class CacheObject:
         """
         Truncate file to specified size.
         """
+        self.finish_upload()
+        if self.memory_only:
+            # Without local disk, object can only be rewritten from start.
+            if length > 0:
+                raise OSError(
+                    errno.EOPNOTSUPP,
+                    f"Truncate of {self.minio_path} to nonzero size without local disk.",
+                )
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+            self.start_upload()
+            return
+        if length > 0 and self.init_partial():
+            old_size = self.size
+            self.handle.truncate(length)
+            self.present.truncate(length)
+            self.dirty.truncate(length)
+            self.present.add(old_size, length)
+            self.dirty.add(old_size, length)
+            self.size = length
+            self.commit_partial()
+            return
         self.init_handle(length > 0)  # only need to copy if nonzero new length
+        self.detach_shared()
         os.truncate(self.temp_path, length)
         self.put_object_minio()
 
@@ -145,12 +641,182 @@ class CacheObject:
             self.handle.close()
             self.handle = None
 
-        try:
-            os.unlink(self.temp_path)
-        except FileNotFoundError:
-            pass
+        if self.temp_path is not None:
+            try:
+                os.unlink(self.temp_path)
+            except FileNotFoundError:
+                pass
+
+        self.upload = None
+        self.release_upload_memory()
+        self.remote = None
+        self.write_out = False
+        self.minio_client.remove_object(self.minio_bucket, self.basic_minio_path)
+        if self.shared_cache is not None:
+            self.shared_cache.invalidate(self.basic_minio_path)
+
+    def pending_write(self) -> bool:
+        """
+        Whether file has data not yet written to MinIO.
+        """
+        return self.write_out or self.upload is not None
+
+    def live_metadata(self) -> dict | None:
+        """
+        Get metadata of file with data not yet written to MinIO, with size
+        written so far, or None if MinIO has current version of file.
+        """
+        if self.upload is not None:
+            size = self.upload.next_offset
+        elif not self.write_out:
+            return None
+        elif self.remote is not None:
+            size = self.size
+        else:
+            # Writes may still be buffered, so size is from end of handle.
+            size = self.handle.seek(0, os.SEEK_END)
+        return {
+            "minio_path": self.minio_path,
+            "size": size,
+            "mtime": time.time(),
+            "etag": None,
+            "mode": DEFAULT_FILE_MODE,
+        }
+
+    def close(self):
+        """
+        Close handle to file, without writing out.
+        """
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        self.remote = None
+        self.release_upload_memory()
+
+
+def get_minio_client(config: dict) -> minio.Minio:
+    """
+    Get MinIO client of process, creating it on first use.
+    """
+    if config.get("minio_client") is None:
+        config["minio_client"] = minio.Minio(
+            config["minio_host"],
+            access_key=config["minio_access_key"],
+            secret_key=config["minio_secret_key"],
+        )
+    return config["minio_client"]
+
+
+def new_file_state(config: dict, minio_path: str) -> dict:
+    """
+    Get state of file kept between requests, with copy of config.
+    Creates temporary directory for file, except in memory-only mode.
+    """
+    return {
+        **config,
+        "minio_path": minio_path,
+        "temp_dir": None if config.get("memory_only") else tempfile.mkdtemp(),
+        "write_out": False,
+        "file": None,
+    }
+
+
+def get_file(config: dict) -> CacheObject:
+    """
+    Get cached object of file, creating it on first request.
+    """
+    if config["file"] is None:
+        config["file"] = CacheObject(config["minio_path"], config["temp_dir"], config)
+    return config["file"]
+
 
-        self.minio_client.remove_object(self.minio_bucket)
+def close_file_state(config: dict):
+    """
+    Close cached object of file, if any, without writing out.
+    """
+    if config["file"] is not None:
+        config["file"].close()
+        config["file"] = None
+
+
+def remove_file_state(config: dict):
+    """
+    Close cached object of file and remove its temporary directory, if any.
+    """
+    close_file_state(config)
+    if config["temp_dir"] is not None:
+        shutil.rmtree(config["temp_dir"], ignore_errors=True)
+
+
+def error_code(e: Exception) -> int:
+    """
+    Get negative error number to send for error.
+    """
+    if isinstance(e, OSError) and e.errno:
+        return -e.errno
+    if isinstance(e, minio.error.S3Error) and e.code == "NoSuchKey":
+        return -errno.ENOENT
+    return -errno.EIO
+
+
+def do_getattr(config: dict, pipe_response: io.BufferedWriter):
+    """
+    Send metadata of object, with decompressed size if presented decompressed.
+    Objects whose decompressed size is only known by decompressing them in
+    full are not supported, so listing a directory never downloads them.
+    Files being written are answered from data written so far.
+    """
+    minio_path = config["minio_path"]
+    if config["file"] is not None:
+        metadata = config["file"].live_metadata()
+        if metadata is not None:
+            send_metadata(pipe_response, metadata)
+            return
+    client = get_minio_client(config)
+    try:
+        _, obj = hedged_call(
+            config,
+            "stat",
+            lambda i: client.stat_object(
+                config["minio_bucket"], minio_path.lstrip("/")
+            ),
+        )
+        metadata = metadata_from_minio(obj)
+        if should_decompress(config, minio_path):
+            size = decompressed_size(client, config["minio_bucket"], minio_path)
+            if size is None:
+                raise OSError(
+                    errno.EOPNOTSUPP,
+                    f"Decompressed size of {minio_path} unknown, "
+                    f"set {UNCOMPRESSED_SIZE_KEY} when uploading it.",
+                )
+            metadata["size"] = size
+    except (OSError, minio.error.S3Error) as e:
+        print("Encountered error during getattr:", e)
+        send_output_int8(pipe_response, error_code(e))
+        return
+    send_metadata(pipe_response, metadata)
+
+
+def do_access(config: dict, pipe_response: io.BufferedWriter, queue_out: mp.Queue):
+    """
+    Send whether object exists, storing its metadata if it does.
+    """
+    minio_path = config["minio_path"]
+    try:
+        obj = get_minio_client(config).stat_object(
+            config["minio_bucket"], minio_path.lstrip("/")
+        )
+    except minio.error.S3Error as e:
+        if e.code != "NoSuchKey":
+            print("Encountered error during access:", e)
+            send_output_int8(pipe_response, -errno.EIO)
+            return
+        queue_out.put({"metadata_cur": None})
+        send_output_int8(pipe_response, -errno.ENOENT)
+        return
+    queue_out.put({"metadata_cur": metadata_from_minio(obj)})
+    send_output_int8(pipe_response, 0)
 
 
 def do_read(
@@ -163,27 +829,18 @@ def do_read(
     """
 
     minio_path = config["minio_path"]
-    print(f"Perform read operation on file {minio_path}.")
-    init_local_file(config, True)
-
+    ringlog.log_hot(MSG_READ, minio_path)
     size = get_input_uint64(pipe_request)
     offset = get_input_uint64(pipe_request)
-    print(f"Using size {size} and offset {offset}.")
+    ringlog.log_hot(MSG_READ_ARGS, size, offset)
 
     try:
-        f = config["handle"]
-        f.seek(offset, os.SEEK_SET)
-        data = f.read(size)
-    except OSError as e:
-        print("Encountered error during read:", e)
-        send_output_int8(pipe_response, -1)
+        length = get_file(config).send_range(pipe_response, size, offset)
+    except (OSError, minio.error.S3Error) as e:
+        ringlog.log(ringlog.ERROR, MSG_READ_ERROR, str(e))
+        send_output_int8(pipe_response, error_code(e))
         return
-
-    send_output_int8(pipe_response, 0)  # success status code
-    length = len(data)
-    send_output_uint64(pipe_response, length)
-    pipe_response.write(data)
-    print("Done the read operation.")
+    ringlog.log_hot(MSG_READ_DONE, length)
 
 
 def do_write(
@@ -196,42 +853,27 @@ def do_write(
     """
 
     minio_path = config["minio_path"]
-    print(f"Perform write operation on file {minio_path}.")
-    init_local_file(config, True)  # if create new, create operation done before
-
+    ringlog.log_hot(MSG_WRITE, minio_path)
     size = get_input_uint64(pipe_request)
     offset = get_input_uint64(pipe_request)
     data = pipe_request.read(size)
-    print(f"Using size {size} and offset {offset}.")
+    ringlog.log_hot(MSG_WRITE_ARGS, size, offset)
 
     try:
-        f = config["handle"]
-        f.seek(offset, os.SEEK_SET)
-        f.write(data)
+        get_file(config).write(data, offset)
         ret_code = 0
-    except OSError as e:
+    except (OSError, minio.error.S3Error) as e:
         print("Encountered error during write:", e)
-        ret_code = -1
+        ret_code = error_code(e)
 
     send_output_int8(pipe_response, ret_code)
-    print("Done the write operation.")
-
-
-def do_flush_direct(config: dict) -> dict:
-    """
-    Does flush operation and backup to MinIO.
-    Raises exception on error.
-    """
-    f = config["handle"]
-    if f is None:
-        print("No data to flush to file.")
-    f.flush()
-    copy_to_minio(config["temp_path"], config["minio_path"])
+    ringlog.log_hot(MSG_WRITE_DONE, len(data))
 
 
 def do_flush(
     config: dict,
     pipe_response: io.BufferedWriter,
+    queue_out: mp.Queue,
 ):
     """
     Backup output to configured MinIO storage.
@@ -239,131 +881,225 @@ def do_flush(
 
     minio_path = config["minio_path"]
     print(f"Perform flush operation on file {minio_path}.")
+    f = get_file(config)
+    changed = f.pending_write()
 
     try:
-        do_flush_direct(config)
+        f.flush()
         ret_code = 0
-    except OSError as e:
+    except (OSError, minio.error.S3Error) as e:
         print("Encountered error:", e)
-        ret_code = -1
+        ret_code = error_code(e)
 
-    config["write"] = False
+    if changed:
+        # Cached metadata is out of date after object written.
+        queue_out.put({"metadata_cur": None})
     send_output_int8(pipe_response, ret_code)
     print("Done the flush operation.")
 
 
 def do_create(
-    file_state: dict,
+    config: dict,
     pipe_response: io.BufferedWriter,
+    queue_out: mp.Queue,
 ):
     """
-    Create new file of specified size.
+    Create new empty file.
     """
-    init_local_file(file_state, False)
-    file_state["write"] = True
+    print(f"Create file {config['minio_path']}.")
+    try:
+        get_file(config).create()
+        ret_code = 0
+    except (OSError, minio.error.S3Error) as e:
+        print("Encountered error:", e)
+        ret_code = error_code(e)
+    queue_out.put({"metadata_cur": None})
+    send_output_int8(pipe_response, ret_code)
 
 
 def do_truncate(
-    file_state: dict,
+    config: dict,
     pipe_request: io.BufferedReader,
     pipe_response: io.BufferedWriter,
+    queue_out: mp.Queue,
 ):
     """
     Truncate file to specified size and flush output.
     """
 
-    print("Perform truncate operation on file:", file_state["name"])
+    print("Perform truncate operation on file:", config["minio_path"])
     size = get_input_uint64(pipe_request)
     print("Truncate to size:", size)
 
     try:
-        os.truncate(file_state["handle"], size)
-        file_state["handle"].flush()
-        copy_to_minio(file_state)
+        get_file(config).truncate(size)
         ret_code = 0
-    except OSError as e:
+    except (OSError, minio.error.S3Error) as e:
         print("Encountered error:", e)
-        ret_code = -1
+        ret_code = error_code(e)
 
-    file_state["write"] = False
+    queue_out.put({"metadata_cur": None})
     send_output_int8(pipe_response, ret_code)
     print("Done the truncate operation.")
 
 
-def do_release(file_state: dict, pipe_response: io.BufferedWriter):
+def do_release(config: dict, pipe_response: io.BufferedWriter, queue_out: mp.Queue):
     """
     Close file, writing out to MinIO if necessary.
     """
+    print(f"Release file {config['minio_path']}.")
+    f = get_file(config)
+    changed = f.pending_write()
+    try:
+        f.flush()
+        ret_code = 0
+    except (OSError, minio.error.S3Error) as e:
+        print("Encountered error:", e)
+        ret_code = error_code(e)
+    if changed:
+        queue_out.put({"metadata_cur": None})
+    if not f.pending_write():
+        close_file_state(config)
+    send_output_int8(pipe_response, ret_code)
 
 
 def do_unlink(
-    file_state: dict,
+    config: dict,
     pipe_response: io.BufferedWriter,
+    queue_out: mp.Queue,
 ):
     """
     Delete file in MinIO.
     """
-    print("Delete file in MinIO:", file_state["name"])
+    print("Delete file in MinIO:", config["minio_path"])
     try:
-        delete_minio(file_state)
+        get_file(config).unlink()
         ret_code = 0
-    except OSError as e:
+    except (OSError, minio.error.S3Error) as e:
         print("Encountered error:", e)
-        ret_code = -1
+        ret_code = error_code(e)
+    close_file_state(config)
+    queue_out.put({"metadata_cur": None})
     send_output_int8(pipe_response, ret_code)
     print("Done the delete operation.")
 
 
+def dir_marker_key(config: dict) -> str:
+    """
+    Get key of marker object of directory at path of config, ending in "/".
+    """
+    return config["minio_path"].strip("/") + "/"
+
+
+def do_mkdir(config: dict, pipe_response: io.BufferedWriter):
+    """
+    Create directory, as empty marker object, unless something exists there.
+    """
+    print(f"Create directory {config['minio_path']}.")
+    client = get_minio_client(config)
+    bucket = config["minio_bucket"]
+    key = dir_marker_key(config)
+    try:
+        if next(iter(client.list_objects(bucket, prefix=key)), None) is not None:
+            ret_code = -errno.EEXIST
+        else:
+            client.put_object(bucket, key, io.BytesIO(b""), 0)
+            ret_code = 0
+    except (OSError, minio.error.S3Error) as e:
+        print("Encountered error:", e)
+        ret_code = error_code(e)
+    send_output_int8(pipe_response, ret_code)
+
+
+def do_rmdir(config: dict, pipe_response: io.BufferedWriter):
+    """
+    Remove marker object of directory, if it has nothing else in it.
+    """
+    print(f"Remove directory {config['minio_path']}.")
+    client = get_minio_client(config)
+    bucket = config["minio_bucket"]
+    key = dir_marker_key(config)
+    try:
+        keys = [o.object_name for o in client.list_objects(bucket, prefix=key)]
+        if not keys:
+            ret_code = -errno.ENOENT
+        elif keys != [key]:
+            ret_code = -errno.ENOTEMPTY
+        else:
+            client.remove_object(bucket, key)
+            ret_code = 0
+    except (OSError, minio.error.S3Error) as e:
+        print("Encountered error:", e)
+        ret_code = error_code(e)
+    send_output_int8(pipe_response, ret_code)
+
+
 def handle_io_request(
     operation: str,
     file_pipe_in: str,
     file_pipe_out: str,
     config: dict,
     queue_out: mp.Queue,
-) -> list:
+) -> bool:
     """
-    Handle single I/O request.
-    Returns list of objects to send on output queue.
+    Handle single I/O request, using cached object of file in config.
+    Returns whether file was released, so its state can be dropped.
+    Caller indicates request done on queue, even if it fails.
     """
 
     minio_path = config["minio_path"]
-    print(f"Do operation {operation} on path {minio_path}.")
+    ringlog.log_hot(MSG_REQUEST, operation, minio_path)
+    is_release = False
 
     # Open the files for the queues.
+    trace_id = config.get("trace_id", 0)
+    start_ns = time_ns()
     with (
         open(file_pipe_in, "rb") as pipe_request,
         open(file_pipe_out, "wb") as pipe_response,
     ):
-        # Handle the specified type of request.
-        if operation == "read":
-            do_read(config, pipe_request, pipe_response)
-        elif operation == "write":
-            do_write(config, pipe_request, pipe_response)
-        elif operation == "flush":
-            do_flush(config, pipe_response, queue_out)
-        elif operation == "truncate":
-            do_truncate(config, pipe_request, pipe_response, queue_out)
-        elif operation == "create":
-            do_create(config, pipe_response, queue_out)
-            return False
-        elif operation == "release":
-            do_release(config, pipe_response, queue_out)
-            return True
-        elif operation == "unlink":
-            do_unlink(config, pipe_response, queue_out)
-            return True
-        else:
-            raise NotImplementedError(f"{request_type}: request_type")
+        record_span("fifo_open", trace_id, start_ns, time_ns())
+
+        with span(operation, trace_id):
+            # Handle the specified type of request.
+            if operation == "read":
+                do_read(config, pipe_request, pipe_response)
+            elif operation == "write":
+                do_write(config, pipe_request, pipe_response)
+            elif operation == "getattr":
+                do_getattr(config, pipe_response)
+            elif operation == "access":
+                do_access(config, pipe_response, queue_out)
+            elif operation == "flush":
+                do_flush(config, pipe_response, queue_out)
+            elif operation == "truncate":
+                do_truncate(config, pipe_request, pipe_response, queue_out)
+            elif operation == "create":
+                do_create(config, pipe_response, queue_out)
+            elif operation == "release":
+                do_release(config, pipe_response, queue_out)
+                is_release = True
+            elif operation == "unlink":
+                do_unlink(config, pipe_response, queue_out)
+                is_release = True
+            elif operation == "mkdir":
+                do_mkdir(config, pipe_response)
+                is_release = True
+            elif operation == "rmdir":
+                do_rmdir(config, pipe_response)
+                is_release = True
+            else:
+                raise NotImplementedError(f"operation: {operation}")
+
+    # Writes not yet uploaded keep file state until written out.
+    config["write_out"] = config["file"] is not None and config["file"].pending_write()
 
     # Some cleanup.
     try:
-        print("Remove no longer needed pipe:", file_pipe_in)
         os.unlink(file_pipe_in)
-        print("Remove no longer needed pipe:", file_pipe_out)
         os.unlink(file_pipe_out)
     except OSError as e:
-        print("Error during cleanup pipes:", e)
+        ringlog.log(ringlog.ERROR, MSG_PIPE_CLEANUP_ERROR, str(e))
 
-    # Indicate done.
-    queue_out.put({"is_done": True})
-    print(f"Done the {operation} operation.")
+    ringlog.log_hot(MSG_REQUEST_DONE, operation)
+    return is_release
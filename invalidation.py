@@ -0,0 +1,209 @@
+"""
+Invalidation of cached attributes, listings and data when objects change.
+Changes come from an event source: MinIO bucket notifications, periodic
+listing diffs where notifications are not available, or a fake source fed
+directly (for testing).
+Each event is a dictionary with the path, kind ("created" or "removed") and
+metadata of the object (None if removed).
+Sources reconnect with backoff when they fail; changes missed while
+disconnected are found by comparing a full listing with cached metadata.
+"""
+
+import datetime
+import queue
+import time
+import urllib.parse
+
+from metadata_index import DEFAULT_FILE_MODE, is_hidden_key, metadata_from_minio
+
+# Notification events subscribed to.
+NOTIFICATION_EVENTS = ("s3:ObjectCreated:*", "s3:ObjectRemoved:*")
+
+# Delay before reconnecting failed event source, doubled after each failure.
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+def make_event(path: str, kind: str, metadata: dict | None = None) -> dict:
+    """
+    Create invalidation event.
+    """
+    return {"path": path, "kind": kind, "metadata": metadata}
+
+
+def notification_events(client, bucket: str, prefix: str = ""):
+    """
+    Generate events from MinIO bucket notifications.
+    """
+    with client.listen_bucket_notification(
+        bucket, prefix=prefix, events=NOTIFICATION_EVENTS
+    ) as notifications:
+        for notification in notifications:
+            for record in notification.get("Records", []):
+                obj = record["s3"]["object"]
+                path = "/" + urllib.parse.unquote(obj["key"])
+                if is_hidden_key(path):
+                    continue
+                if record["eventName"].startswith("s3:ObjectRemoved:"):
+                    yield make_event(path, "removed")
+                    continue
+                event_time = datetime.datetime.fromisoformat(
+                    record["eventTime"].replace("Z", "+00:00")
+                )
+                metadata = {
+                    "minio_path": path,
+                    "size": obj.get("size", 0),
+                    "mtime": event_time.timestamp(),
+                    "etag": obj.get("eTag"),
+                    "mode": DEFAULT_FILE_MODE,
+                }
+                yield make_event(path, "created", metadata)
+
+
+def list_metadata(client, bucket: str, prefix: str) -> dict:
+    """
+    Get metadata of all objects under prefix, by path.
+    """
+    current = {}
+    for obj in client.list_objects(bucket, prefix=prefix, recursive=True):
+        if not obj.is_dir and not is_hidden_key(obj.object_name):
+            m = metadata_from_minio(obj)
+            current[m["minio_path"]] = m
+    return current
+
+
+def diff_events(previous: dict, current: dict):
+    """
+    Generate events for differences between two listings, by path.
+    """
+    for path, m in current.items():
+        old = previous.get(path)
+        if old is None or (old["etag"], old["size"]) != (m["etag"], m["size"]):
+            yield make_event(path, "created", m)
+    for path in previous.keys() - current.keys():
+        yield make_event(path, "removed")
+
+
+def listing_diff_events(client, bucket: str, prefix: str, interval: float):
+    """
+    Generate events by listing prefix periodically and comparing with the
+    previous listing.
+    First listing is the baseline, so produces no events.
+    Failed listings are retried with backoff, and compared with the last
+    successful one, so no change is missed.
+    """
+    previous = None
+    delay = RECONNECT_DELAY
+    while True:
+        try:
+            current = list_metadata(client, bucket, prefix)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Listing for invalidation failed, retry in {delay} seconds:", e)
+            time.sleep(delay)
+            delay = min(MAX_RECONNECT_DELAY, delay * 2)
+            continue
+        delay = RECONNECT_DELAY
+
+        if previous is not None:
+            yield from diff_events(previous, current)
+
+        previous = current
+        time.sleep(interval)
+
+
+def reconnecting_events(connect, resync, delay: float = RECONNECT_DELAY):
+    """
+    Generate events from connect(), connecting again with exponential backoff
+    when the source fails or ends.
+    After each reconnect, events from resync() come first, for changes made
+    while disconnected.
+    """
+    max_delay = max(delay, MAX_RECONNECT_DELAY)
+    first_delay = delay
+    reconnect = False
+    while True:
+        try:
+            if reconnect:
+                yield from resync()
+            reconnect = True
+            for event in connect():
+                delay = first_delay
+                yield event
+            print(f"Event source ended, reconnect in {delay} seconds.")
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Event source failed, reconnect in {delay} seconds:", e)
+        time.sleep(delay)
+        delay = min(max_delay, delay * 2)
+
+
+class FakeEventSource:
+    """
+    Event source fed directly, for testing invalidation without MinIO.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def push(self, path: str, kind: str, metadata: dict | None = None):
+        """
+        Add event to be produced.
+        """
+        self.queue.put(make_event(path, kind, metadata))
+
+    def close(self):
+        """
+        End the events, after those already pushed.
+        """
+        self.queue.put(None)
+
+    def fail(self, error: Exception):
+        """
+        Fail the events with error, after those already pushed, as if the
+        connection was lost.
+        """
+        self.queue.put(error)
+
+    def events(self):
+        """
+        Generate the pushed events, until closed or failed.
+        """
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+
+class Invalidator:
+    """
+    Applies events to registered caches.
+    Each handler is a function called with every event.
+    """
+
+    def __init__(self):
+        self.handlers = []
+        self.num_events = 0
+
+    def add_handler(self, handler):
+        """
+        Register function called with each event.
+        """
+        self.handlers.append(handler)
+
+    def apply(self, event: dict):
+        """
+        Apply single event to all caches.
+        """
+        self.num_events += 1
+        for handler in self.handlers:
+            handler(event)
+
+    def run(self, events):
+        """
+        Apply all events from source, until it ends.
+        """
+        for event in events:
+            self.apply(event)
+        print(f"Event source ended after {self.num_events} events.")
@@ -0,0 +1,207 @@
+"""
+Memory-only data cache, for nodes without usable local disk.
+Objects are read in fixed-size chunks, fetched by range and kept in buffers
+from a slab allocator with a fixed number of slabs, so memory use is bounded
+by the budget; least recently used chunks are evicted to reuse their slabs.
+Buffers of uploads in progress are reserved from the same budget.
+"""
+
+import os
+from collections import OrderedDict
+
+# Default size of chunks objects are read in.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class SlabAllocator:
+    """
+    Fixed number of equally sized buffers, reused instead of freed.
+    Slabs reserved for other uses are not allocated.
+    """
+
+    def __init__(self, slab_size: int, max_slabs: int):
+        self.slab_size = slab_size
+        self.max_slabs = max_slabs
+        self.free = []
+        self.num_allocated = 0
+        self.num_reserved = 0
+
+    def alloc(self) -> bytearray | None:
+        """
+        Get free buffer, or None if all are in use.
+        """
+        if self.free:
+            return self.free.pop()
+        if self.num_allocated < self.max_slabs - self.num_reserved:
+            self.num_allocated += 1
+            return bytearray(self.slab_size)
+        return None
+
+    def release(self, buffer: bytearray):
+        """
+        Return buffer for reuse.
+        """
+        self.free.append(buffer)
+
+
+class ChunkStore:
+    """
+    Chunks of objects in slab buffers, by object and chunk number.
+    When no slab is free, least recently used chunk is evicted.
+    """
+
+    def __init__(self, budget: int, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.slabs = SlabAllocator(chunk_size, max(1, budget // chunk_size))
+        self.chunks = OrderedDict()
+
+    def get(self, obj_id: tuple, i: int) -> memoryview | None:
+        """
+        Get contents of chunk, or None if not in memory.
+        View is valid only until next chunk is added.
+        """
+        entry = self.chunks.get((obj_id, i))
+        if entry is None:
+            return None
+        self.chunks.move_to_end((obj_id, i))
+        buffer, length = entry
+        return memoryview(buffer)[:length]
+
+    def put(self, obj_id: tuple, i: int, data: bytes) -> memoryview:
+        """
+        Copy chunk into slab, evicting least recently used chunk if needed.
+        """
+        buffer = self.slabs.alloc()
+        if buffer is None:
+            _, (buffer, _) = self.chunks.popitem(last=False)
+        buffer[: len(data)] = data
+        self.chunks[(obj_id, i)] = (buffer, len(data))
+        return memoryview(buffer)[: len(data)]
+
+    def reserve(self, size: int) -> bool:
+        """
+        Reserve memory of size bytes from budget, evicting chunks to free it.
+        Returns False if not possible: at least one slab is kept for reads.
+        """
+        n = -(-size // self.chunk_size)
+        slabs = self.slabs
+        if slabs.num_reserved + n >= slabs.max_slabs:
+            return False
+        slabs.num_reserved += n
+        while slabs.num_allocated > slabs.max_slabs - slabs.num_reserved:
+            if slabs.free:
+                slabs.free.pop()
+            else:
+                self.chunks.popitem(last=False)
+            slabs.num_allocated -= 1
+        return True
+
+    def unreserve(self, size: int):
+        """
+        Return memory reserved with reserve to budget.
+        """
+        self.slabs.num_reserved -= -(-size // self.chunk_size)
+
+    def drop(self, key: str):
+        """
+        Remove all chunks of object with key, any version, returning slabs
+        for reuse.
+        """
+        for k in [k for k in self.chunks if k[0][0] == key]:
+            buffer, _ = self.chunks.pop(k)
+            self.slabs.release(buffer)
+
+
+# Chunk store of this process, shared by all files it has open.
+chunk_store = None
+chunk_store_pid = None
+
+
+def get_chunk_store(budget: int, chunk_size: int) -> ChunkStore:
+    """
+    Get chunk store of this process, creating it on first use.
+    """
+    global chunk_store, chunk_store_pid  # pylint: disable=global-statement
+    if chunk_store is None or chunk_store_pid != os.getpid():
+        chunk_store = ChunkStore(budget, chunk_size)
+        chunk_store_pid = os.getpid()
+    return chunk_store
+
+
+class MemoryFile:
+    """
+    Read-only file-like object reading object through chunk store.
+    Chunks are fetched requiring object to still have ETag, so chunks of
+    different versions are never mixed.
+    """
+
+    def __init__(self, store: ChunkStore, client, bucket: str, key: str):
+        obj = client.stat_object(bucket, key)
+        self.store = store
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.etag = obj.etag.strip('"') if obj.etag else None
+        self.size = obj.size
+        self.obj_id = (key, self.etag)
+        self.position = 0
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """
+        Set position in object.
+        """
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def tell(self) -> int:
+        """
+        Get position in object.
+        """
+        return self.position
+
+    def get_chunk(self, i: int) -> memoryview:
+        """
+        Get chunk number i, from memory or fetched by range.
+        """
+        data = self.store.get(self.obj_id, i)
+        if data is not None:
+            return data
+
+        chunk_size = self.store.chunk_size
+        response = self.client.get_object(
+            self.bucket,
+            self.key,
+            offset=i * chunk_size,
+            length=min(chunk_size, self.size - i * chunk_size),
+            request_headers={"If-Match": self.etag} if self.etag else None,
+        )
+        try:
+            return self.store.put(self.obj_id, i, response.read())
+        finally:
+            response.close()
+            response.release_conn()
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read up to size bytes from current position, to end if size negative.
+        """
+        chunk_size = self.store.chunk_size
+        end = self.size if size < 0 else min(self.position + size, self.size)
+        parts = []
+        while self.position < end:
+            i = self.position // chunk_size
+            offset = self.position - i * chunk_size
+            length = min(end - self.position, chunk_size - offset)
+            parts.append(bytes(self.get_chunk(i)[offset : offset + length]))
+            self.position += length
+        return b"".join(parts)
+
+    def close(self):
+        """
+        Nothing to release: chunks stay cached for later opens.
+        """
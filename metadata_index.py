@@ -0,0 +1,321 @@
+"""
+Persistent index of object metadata, for fast warm restart.
+Snapshot is written as sorted fixed-size records followed by the paths,
+and memory-mapped when loaded, so no parsing is needed at startup.
+"""
+
+import bisect
+import concurrent.futures
+import itertools
+import mmap
+import os
+import stat
+import struct
+import time
+
+# Start of index file: magic, number of records, offset of paths.
+HEADER = struct.Struct("<8sQQ")
+MAGIC = b"MCIDX001"
+
+# Record per object: path offset and length, mode, size, mtime (ns), ETag.
+RECORD = struct.Struct("<QIIQq16sI4x")
+
+# ETag parts value meaning ETag is not MD5-based and was not stored.
+ETAG_NONE = 0xFFFFFFFF
+
+# Mode used for objects that do not have one in their metadata.
+DEFAULT_FILE_MODE = stat.S_IFREG | 0o644
+
+# Prefix of temporary objects of the mount, such as parts of partial rewrite,
+# hidden from listings.
+HIDDEN_PREFIX = ".mc-rewrite/"
+
+
+def is_hidden_key(key: str) -> bool:
+    """
+    Whether object key (with or without leading "/") is hidden from listings.
+    """
+    return key.lstrip("/").startswith(HIDDEN_PREFIX)
+
+
+def pack_etag(etag: str | None) -> tuple:
+    """
+    Convert S3 ETag to 16 byte digest and number of parts (0 if not multipart).
+    """
+    if not etag:
+        return b"", ETAG_NONE
+    digest, _, parts = etag.strip('"').partition("-")
+    try:
+        return bytes.fromhex(digest), int(parts) if parts else 0
+    except ValueError:
+        return b"", ETAG_NONE
+
+
+def unpack_etag(digest: bytes, parts: int) -> str | None:
+    """
+    Convert digest and number of parts back to S3 ETag.
+    """
+    if parts == ETAG_NONE:
+        return None
+    if parts == 0:
+        return digest.hex()
+    return f"{digest.hex()}-{parts}"
+
+
+def metadata_from_minio(obj) -> dict:
+    """
+    Get metadata dictionary from MinIO object, as returned by list or stat.
+    """
+    mode = DEFAULT_FILE_MODE
+    user_meta = obj.metadata or {}
+    if "x-amz-meta-mode" in user_meta:
+        mode = int(user_meta["x-amz-meta-mode"], 8)
+    mtime = obj.last_modified.timestamp() if obj.last_modified else 0.0
+    return {
+        "minio_path": "/" + obj.object_name,
+        "size": obj.size or 0,
+        "mtime": mtime,
+        "etag": obj.etag.strip('"') if obj.etag else None,
+        "mode": mode,
+    }
+
+
+def write_index(index_path: str, entries: list):
+    """
+    Write snapshot of metadata dictionaries to index file.
+    File is replaced atomically, so open mappings of the old index stay valid.
+    """
+    entries = sorted(entries, key=lambda m: m["minio_path"])
+    paths = [m["minio_path"].encode("UTF-8") for m in entries]
+    strings_offset = HEADER.size + RECORD.size * len(entries)
+
+    temp_path = f"{index_path}.tmp{os.getpid()}"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries), strings_offset))
+        path_offset = strings_offset
+        for m, p in zip(entries, paths):
+            digest, parts = pack_etag(m.get("etag"))
+            f.write(
+                RECORD.pack(
+                    path_offset,
+                    len(p),
+                    m.get("mode", DEFAULT_FILE_MODE),
+                    m["size"],
+                    int(m["mtime"] * 1e9),
+                    digest,
+                    parts,
+                )
+            )
+            path_offset += len(p)
+        for p in paths:
+            f.write(p)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, index_path)
+
+
+class MetadataIndex:
+    """
+    Read-only view of index file, memory-mapped.
+    Lookups binary search the records, so only touched pages are read from disk.
+    """
+
+    def __init__(self, index_path: str | None = None):
+        self.index_path = index_path
+        self.map = None
+        self.count = 0
+
+        if index_path is None or not os.path.exists(index_path):
+            return
+        with open(index_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                print(f"Ignore truncated metadata index {index_path}.")
+                return
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            print(f"Ignore metadata index {index_path} with unknown format.")
+            self.map.close()
+            self.map = None
+            return
+        self.count = count
+        print(f"Loaded metadata index {index_path} with {count} objects.")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get_path(self, i: int) -> str:
+        """
+        Get path of record number i.
+        """
+        offset, length = struct.unpack_from(
+            "<QI", self.map, HEADER.size + RECORD.size * i
+        )
+        return self.map[offset : offset + length].decode("UTF-8")
+
+    def get_record(self, i: int) -> dict:
+        """
+        Get metadata dictionary of record number i.
+        """
+        offset, length, mode, size, mtime, digest, parts = RECORD.unpack_from(
+            self.map, HEADER.size + RECORD.size * i
+        )
+        return {
+            "minio_path": self.map[offset : offset + length].decode("UTF-8"),
+            "size": size,
+            "mtime": mtime / 1e9,
+            "etag": unpack_etag(digest, parts),
+            "mode": mode,
+        }
+
+    def find(self, path: str) -> int:
+        """
+        Get number of first record with path not less than specified path.
+        """
+        return bisect.bisect_left(_IndexPaths(self), path)
+
+    def lookup(self, path: str) -> dict | None:
+        """
+        Get metadata for path, or None if not in index.
+        """
+        if self.map is None:
+            return None
+        i = self.find(path)
+        if i < self.count and self.get_path(i) == path:
+            return self.get_record(i)
+        return None
+
+    def list_prefix(self, prefix: str):
+        """
+        Iterate over metadata of all objects with path starting with prefix.
+        """
+        if self.map is None:
+            return
+        i = self.find(prefix)
+        while i < self.count:
+            m = self.get_record(i)
+            if not m["minio_path"].startswith(prefix):
+                return
+            yield m
+            i += 1
+
+    def list_dir(self, path: str) -> tuple:
+        """
+        Get files, with sizes by name, and subdirectories directly in directory
+        at path, as (names, dir_names, sizes).
+        Subtrees of subdirectories are skipped by binary search, not scanned.
+        """
+        prefix = path.rstrip("/") + "/"
+        names = []
+        dir_names = []
+        sizes = {}
+        if self.map is None:
+            return names, dir_names, sizes
+        i = self.find(prefix)
+        while i < self.count:
+            child = self.get_path(i)
+            if not child.startswith(prefix):
+                break
+            name, sep, _ = child[len(prefix) :].partition("/")
+            if sep:
+                dir_names.append(name)
+                # "0" follows "/", so first path after subtree.
+                i = self.find(prefix + name + "0")
+                continue
+            names.append(name)
+            sizes[name] = self.get_record(i)["size"]
+            i += 1
+        return names, dir_names, sizes
+
+    def close(self):
+        """
+        Release the mapping.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class _IndexPaths:
+    """
+    Sequence view of paths in index, for use with bisect.
+    """
+
+    def __init__(self, index: MetadataIndex):
+        self.index = index
+
+    def __len__(self) -> int:
+        return self.index.count
+
+    def __getitem__(self, i: int) -> str:
+        return self.index.get_path(i)
+
+
+def snapshot_loop(index: MetadataIndex, get_entries, interval: float):
+    """
+    Periodically write metadata returned by get_entries to index file.
+    Function get_entries returns (path, metadata) pairs, with metadata None for
+    objects known to be removed.
+    Objects only in the existing index are kept, so unvisited paths survive restarts.
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            merged = {m["minio_path"]: m for m in index.list_prefix("")}
+            for path, m in get_entries():
+                if m is None:
+                    merged.pop(path, None)
+                else:
+                    merged[path] = m
+            write_index(index.index_path, list(merged.values()))
+            print(f"Wrote metadata index snapshot with {len(merged)} objects.")
+        except OSError as e:
+            print("Error writing metadata index snapshot:", e)
+
+
+def revalidate_index(
+    index: MetadataIndex,
+    stat_object,
+    on_result,
+    num_threads: int,
+    max_rate: float = 0.0,
+):
+    """
+    Check every object in index against the backend, after startup.
+    Objects are checked in batches by num_threads concurrent stat calls, with
+    at most max_rate calls per second if positive, so a large index neither
+    takes long to check nor floods the backend.
+    Calls on_result(path, metadata), with metadata None if object no longer exists.
+    """
+
+    def check(m: dict) -> bool:
+        path = m["minio_path"]
+        try:
+            fresh = stat_object(path)
+        except OSError as e:
+            print(f"Error revalidating {path}:", e)
+            return False
+        on_result(path, fresh)
+        return fresh is None or fresh["etag"] != m["etag"] or fresh["size"] != m["size"]
+
+    start_time = time.time()
+    num_changed = 0
+    batch_size = num_threads * 4
+    records = index.list_prefix("")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            batch_start = time.time()
+            num_changed += sum(executor.map(check, batch))
+            if max_rate > 0:
+                time.sleep(
+                    max(0.0, len(batch) / max_rate - (time.time() - batch_start))
+                )
+
+    elapsed_time = round(time.time() - start_time, 2)
+    print(
+        f"Revalidated {len(index)} indexed objects in {elapsed_time} seconds, "
+        f"{num_changed} changed."
+    )
@@ -0,0 +1,154 @@
+"""
+Compact store of metadata for tracked objects.
+Metadata is kept in typed array columns, indexed by row number, instead of one
+dictionary per object, so millions of objects can be tracked.
+"""
+
+import array
+import sys
+import threading
+
+from metadata_index import DEFAULT_FILE_MODE, pack_etag, unpack_etag
+
+
+def split_path(path: str) -> tuple:
+    """
+    Split path into directory and name, with directory interned.
+    Objects in the same directory then share a single directory string.
+    """
+    directory, _, name = path.rpartition("/")
+    return sys.intern(directory), name
+
+
+class MetadataStore:
+    """
+    Column-oriented table of object metadata, with one row per path.
+    Rows of removed paths are reused.
+    Removed paths are kept as tombstones, so metadata of older sources such as
+    index of previous run is not used for them.
+    Safe to use from many threads: all access is under one lock.
+    """
+
+    __slots__ = (
+        "rows",
+        "free_rows",
+        "removed",
+        "sizes",
+        "mtimes",
+        "modes",
+        "etags",
+        "parts",
+        "lock",
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.free_rows = []
+        self.removed = set()
+        self.sizes = array.array("q")
+        self.mtimes = array.array("d")
+        self.modes = array.array("I")
+        self.etags = bytearray()
+        self.parts = array.array("I")
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.rows)
+
+    def __contains__(self, path: str) -> bool:
+        key = split_path(path)
+        with self.lock:
+            return key in self.rows
+
+    def set(self, path: str, metadata: dict):
+        """
+        Set metadata for path, adding row if necessary.
+        """
+        key = split_path(path)
+        digest, parts = pack_etag(metadata.get("etag"))
+        digest = digest.ljust(16, b"\0")
+        size = metadata["size"]
+        mtime = metadata["mtime"]
+        mode = metadata.get("mode", DEFAULT_FILE_MODE)
+
+        with self.lock:
+            self.removed.discard(key)
+            row = self.rows.get(key)
+            if row is None and self.free_rows:
+                row = self.free_rows.pop()
+                self.rows[key] = row
+
+            if row is None:
+                self.rows[key] = len(self.sizes)
+                self.sizes.append(size)
+                self.mtimes.append(mtime)
+                self.modes.append(mode)
+                self.etags += digest
+                self.parts.append(parts)
+            else:
+                self.sizes[row] = size
+                self.mtimes[row] = mtime
+                self.modes[row] = mode
+                self.etags[16 * row : 16 * row + 16] = digest
+                self.parts[row] = parts
+
+    def get(self, path: str) -> dict | None:
+        """
+        Get metadata dictionary for path, or None if not tracked.
+        """
+        key = split_path(path)
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                return None
+            return self.get_row(path, row)
+
+    def get_row(self, path: str, row: int) -> dict:
+        """
+        Get metadata dictionary from specified row.
+        Must be called with lock held.
+        """
+        return {
+            "minio_path": path,
+            "size": self.sizes[row],
+            "mtime": self.mtimes[row],
+            "etag": unpack_etag(
+                bytes(self.etags[16 * row : 16 * row + 16]), self.parts[row]
+            ),
+            "mode": self.modes[row],
+        }
+
+    def remove(self, path: str):
+        """
+        Drop metadata of path, recording tombstone for it.
+        """
+        key = split_path(path)
+        with self.lock:
+            row = self.rows.pop(key, None)
+            if row is not None:
+                self.free_rows.append(row)
+            self.removed.add(key)
+
+    def is_removed(self, path: str) -> bool:
+        """
+        Whether metadata of path was removed, and not set since.
+        """
+        key = split_path(path)
+        with self.lock:
+            return key in self.removed
+
+    def items(self) -> list:
+        """
+        Get (path, metadata) pairs of all tracked objects, with metadata None
+        for removed paths, as consistent copy taken under lock, so store can
+        change while it is used.
+        """
+        with self.lock:
+            r = []
+            for (directory, name), row in self.rows.items():
+                path = f"{directory}/{name}"
+                r.append((path, self.get_row(path, row)))
+            for directory, name in self.removed:
+                r.append((f"{directory}/{name}", None))
+            return r
@@ -0,0 +1,210 @@
+"""
+Rewrite of parts of large existing objects, without copying whole object.
+Open file keeps ranges present locally and ranges modified; on commit the new
+object is composed on server from unchanged ranges of old object and only the
+parts with modified data, uploaded from local file.
+Modified parts are staged as temporary objects under a prefix hidden from
+listings, in the same bucket or a configured staging bucket. Parts left by
+failed rewrites are removed at startup.
+"""
+
+import datetime
+import io
+import uuid
+
+from minio.commonconfig import ComposeSource
+
+from metadata_index import HIDDEN_PREFIX
+
+# Minimum size of each part of composed object, except the last, allowed by S3.
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Maximum number of parts of composed object allowed by S3.
+MAX_PARTS = 10000
+
+# Prefix of temporary objects with modified parts, removed after compose.
+TEMP_PREFIX = HIDDEN_PREFIX.rstrip("/")
+
+# Default age after which temporary parts are assumed left by failed rewrite.
+DEFAULT_STALE_AGE = 3600.0
+
+
+class RangeSet:
+    """
+    Set of byte ranges [start, end), kept sorted and merged.
+    """
+
+    def __init__(self):
+        self.ranges = []
+
+    def __bool__(self) -> bool:
+        return bool(self.ranges)
+
+    def add(self, start: int, end: int):
+        """
+        Add range, merging with overlapping or adjacent ranges.
+        """
+        if start >= end:
+            return
+        r = []
+        placed = False
+        for s, e in self.ranges:
+            if e < start:
+                r.append((s, e))
+            elif s > end:
+                if not placed:
+                    r.append((start, end))
+                    placed = True
+                r.append((s, e))
+            else:
+                start = min(s, start)
+                end = max(e, end)
+        if not placed:
+            r.append((start, end))
+        self.ranges = r
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """
+        Whether any range overlaps [start, end).
+        """
+        return any(s < end and e > start for s, e in self.ranges)
+
+    def missing(self, start: int, end: int) -> list:
+        """
+        Get ranges within [start, end) not in set.
+        """
+        r = []
+        for s, e in self.ranges:
+            if e <= start:
+                continue
+            if s >= end:
+                break
+            if s > start:
+                r.append((start, s))
+            start = max(start, e)
+        if start < end:
+            r.append((start, end))
+        return r
+
+    def truncate(self, size: int):
+        """
+        Remove everything at or after size.
+        """
+        self.ranges = [(s, min(e, size)) for s, e in self.ranges if s < size]
+
+    def clear(self):
+        """
+        Remove all ranges.
+        """
+        self.ranges = []
+
+
+def choose_part_size(size: int, part_size: int) -> int:
+    """
+    Get part size to use for object of size, within S3 limits.
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    while size > part_size * MAX_PARTS:
+        part_size *= 2
+    return part_size
+
+
+def plan_parts(new_size: int, old_size: int, dirty: RangeSet, part_size: int):
+    """
+    Split new object into (start, end, modified) parts.
+    Parts are aligned to part size; consecutive unmodified parts are merged.
+    Part is modified if it has modified data or is past end of old object.
+    """
+    parts = []
+    for start in range(0, new_size, part_size):
+        end = min(start + part_size, new_size)
+        modified = end > old_size or dirty.overlaps(start, end)
+        if parts and not modified and not parts[-1][2]:
+            parts[-1] = (parts[-1][0], end, False)
+        else:
+            parts.append((start, end, modified))
+    return parts
+
+
+def compose_rewrite(
+    client,
+    bucket: str,
+    key: str,
+    etag: str,
+    old_size: int,
+    new_size: int,
+    dirty: RangeSet,
+    read_local,
+    part_size: int,
+    staging_bucket: str | None = None,
+):
+    """
+    Replace object with new contents, copying unmodified ranges on server.
+    Function read_local(start, end) gets new data of range from local file.
+    Modified parts are staged in staging_bucket, or bucket if None.
+    Copies require old object to still have etag, so concurrent changes are
+    detected instead of mixed in.
+    Returns result of compose.
+    """
+    part_size = choose_part_size(new_size, part_size)
+    parts = plan_parts(new_size, old_size, dirty, part_size)
+    token = uuid.uuid4().hex
+    staging_bucket = staging_bucket or bucket
+    sources = []
+    temp_keys = []
+    num_uploaded = 0
+
+    try:
+        for start, end, modified in parts:
+            if not modified:
+                sources.append(
+                    ComposeSource(
+                        bucket,
+                        key,
+                        offset=start,
+                        length=end - start,
+                        match_etag=etag,
+                    )
+                )
+                continue
+            temp_key = f"{TEMP_PREFIX}/{token}/{len(temp_keys)}"
+            data = read_local(start, end)
+            client.put_object(staging_bucket, temp_key, io.BytesIO(data), len(data))
+            temp_keys.append(temp_key)
+            sources.append(ComposeSource(staging_bucket, temp_key))
+            num_uploaded += len(data)
+
+        result = client.compose_object(bucket, key, sources)
+    finally:
+        for temp_key in temp_keys:
+            try:
+                client.remove_object(staging_bucket, temp_key)
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Error removing temporary part {temp_key}:", e)
+
+    print(
+        f"Rewrote {key} of {new_size} bytes, uploaded {num_uploaded} bytes "
+        f"in {len(temp_keys)} of {len(parts)} parts."
+    )
+    return result
+
+
+def remove_stale_parts(client, bucket: str, max_age: float = DEFAULT_STALE_AGE):
+    """
+    Remove temporary parts older than max_age seconds, left by rewrites that
+    failed before removing them. Younger parts may belong to a rewrite in
+    progress in another mount, so are kept.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    num_removed = 0
+    for obj in client.list_objects(bucket, prefix=HIDDEN_PREFIX, recursive=True):
+        if obj.is_dir or obj.last_modified is None:
+            continue
+        if (now - obj.last_modified).total_seconds() < max_age:
+            continue
+        try:
+            client.remove_object(bucket, obj.object_name)
+            num_removed += 1
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Error removing stale part {obj.object_name}:", e)
+    print(f"Removed {num_removed} stale rewrite parts from bucket {bucket}.")
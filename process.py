@@ -2,8 +2,41 @@
 Functions for running the forked processes.
 """
 
+import errno
 import io
 import multiprocessing as mp
+import os
+import queue
+import socket
+import stat
+import sys
+
+import minio
+from minio.commonconfig import REPLACE, CopySource
+
+from bridge import (
+    get_input_uint32,
+    get_input_uint64,
+    send_int,
+    send_metadata,
+    send_read_data,
+    send_read_error,
+)
+from implementations import (
+    close_file_state,
+    error_code,
+    get_file,
+    get_minio_client,
+    new_file_state,
+    remove_file_state,
+)
+from metadata_index import metadata_from_minio
+import ringlog
+from tracing import record_span, span, time_ns
+
+MSG_OPERATION = ringlog.register("Perform operation {} on {}.")
+MSG_HANDLE_REQUEST = ringlog.register("Handle request {} in process for {}.")
+MSG_INVALIDATE = ringlog.register("Object {} changed, invalidate cached data.")
 
 
 def get_path(rfile: io.BufferedIOBase) -> str:
@@ -13,37 +46,273 @@ def get_path(rfile: io.BufferedIOBase) -> str:
     r = []
     while True:
         ch = rfile.read(1)
-        if ch == 0:
+        if ch in (b"", b"\0"):
             return b"".join(r).decode("UTF-8")
         r.append(ch)
 
 
+def get_request_header(rfile: io.BufferedIOBase) -> tuple:
+    """
+    Get type of request, trace ID and start time, and on which path, from start
+    of request.
+    """
+    action = rfile.read(1).decode("ascii")
+    trace_id = int.from_bytes(rfile.read(8), sys.byteorder, signed=False)
+    start_ns = int.from_bytes(rfile.read(8), sys.byteorder, signed=False)
+    path = get_path(rfile)
+    return action, path, trace_id, start_ns
+
+
+def pending_write(state: dict) -> bool:
+    """
+    Whether file of process has data not yet written to MinIO.
+    """
+    return state["file"] is not None and state["file"].pending_write()
+
+
+def current_metadata(state: dict) -> dict:
+    """
+    Get metadata of path: of file being written if any, else as last seen,
+    else from MinIO.
+    """
+    if state["file"] is not None:
+        metadata = state["file"].live_metadata()
+        if metadata is not None:
+            return metadata
+    if state["metadata"] is None:
+        obj = get_minio_client(state).stat_object(
+            state["minio_bucket"], state["path"].lstrip("/")
+        )
+        state["metadata"] = metadata_from_minio(obj)
+    return state["metadata"]
+
+
+def rename_object(state: dict, dest_path: str):
+    """
+    Move object to destination path, by copy then removal of source, after
+    writing out pending data.
+    """
+    get_file(state).flush()
+    client = get_minio_client(state)
+    bucket = state["minio_bucket"]
+    key = state["path"].lstrip("/")
+    client.copy_object(bucket, dest_path.lstrip("/"), CopySource(bucket, key))
+    client.remove_object(bucket, key)
+    close_file_state(state)
+
+
+def change_mode(state: dict, mode: int):
+    """
+    Store permission bits of file in its user metadata, by copy of object
+    onto itself after writing out pending data.
+    """
+    get_file(state).flush()
+    bucket = state["minio_bucket"]
+    key = state["path"].lstrip("/")
+    get_minio_client(state).copy_object(
+        bucket,
+        key,
+        CopySource(bucket, key),
+        metadata={"x-amz-meta-mode": f"{stat.S_IFREG | stat.S_IMODE(mode):o}"},
+        metadata_directive=REPLACE,
+    )
+
+
+def do_operation(
+    action: str, rfile: io.BufferedIOBase, extra: dict, state: dict
+) -> int | bytes | dict:
+    """
+    Do operation of request, reading its remaining fields.
+    Returns data for read, metadata for getattr, else return value.
+    """
+    if action == "G":
+        return current_metadata(state)
+    if action in ("A", "O"):
+        current_metadata(state)
+        return 0
+    if action == "R":
+        size = get_input_uint64(rfile)
+        offset = get_input_uint64(rfile)
+        return get_file(state).read(size, offset)
+    if action == "W":
+        size = get_input_uint64(rfile)
+        offset = get_input_uint64(rfile)
+        data = rfile.read(size)
+        get_file(state).write(data, offset)
+        return len(data)
+    if action == "F":
+        get_file(state).flush()
+        return 0
+    if action == "X":
+        get_file(state).flush()
+        close_file_state(state)
+        return 0
+
+    # Remaining operations change object, so metadata seen is out of date.
+    state["metadata"] = None
+    if action == "C":
+        # Mode of new file is always the default one.
+        get_input_uint32(rfile)
+        get_file(state).create()
+        return 0
+    if action == "T":
+        get_file(state).truncate(get_input_uint64(rfile))
+        return 0
+    if action == "U":
+        get_file(state).unlink()
+        close_file_state(state)
+        return 0
+    if action == "N":
+        rename_object(state, extra["dest_path"])
+        return 0
+    if action == "M":
+        change_mode(state, get_input_uint32(rfile))
+        return 0
+    if action == "I":
+        get_input_uint32(rfile)
+        get_input_uint32(rfile)
+        return -errno.ENOTSUP
+    return -errno.ENOSYS
+
+
+def handle_request(
+    action: str,
+    path: str,
+    extra: dict,
+    conn: socket.socket,
+    state: dict,
+):
+    """
+    Handle single request, with header and fields in extra already read from
+    connection.
+    Cached data of object changed remotely is dropped first, unless it has
+    writes not yet written out.
+    """
+    ringlog.log_hot(MSG_OPERATION, action, path)
+    if state["stale"] and not pending_write(state):
+        close_file_state(state)
+        state["stale"] = False
+
+    with conn.makefile("rb") as rfile, conn.makefile("wb") as wfile:
+        try:
+            result = do_operation(action, rfile, extra, state)
+        except (OSError, minio.error.S3Error) as e:
+            print(f"Error during operation {action} on {path}:", e)
+            result = error_code(e)
+
+        if action == "R" and isinstance(result, int):
+            send_read_error(wfile, result)
+        elif action == "R":
+            send_read_data(wfile, result)
+        elif isinstance(result, dict):
+            send_metadata(wfile, result)
+        else:
+            send_int(wfile, result)
+
+
+def get_next_request(
+    queue_in: mp.Queue, queue_idle: mp.Queue, timeout: float, state: dict
+) -> dict | None:
+    """
+    Get next request message for process, or None if process should exit.
+    When no message arrives in time, server is notified with the number of
+    messages received, and decides under its lock whether process exits, so a
+    request sent meanwhile is never lost.
+    Messages without a connection notify that the object changed remotely, and
+    are applied to state instead of returned.
+    """
+    while True:
+        try:
+            msg = queue_in.get(timeout=timeout)
+        except queue.Empty:
+            # Process with writes not yet written out must not exit.
+            if not state["idle"] and not pending_write(state):
+                print(f"No requests for {state['path']} in {timeout} seconds.")
+                queue_idle.put((state["path"], os.getpid(), state["num_received"]))
+                state["idle"] = True
+            continue
+        if msg["action"] == "exit":
+            print(f"Process for {state['path']} idle, exit.")
+            return None
+        state["num_received"] += 1
+        state["idle"] = False
+        if msg["conn"] is not None:
+            return msg
+
+        # Object changed remotely, so cached data must not be used.
+        ringlog.log(ringlog.INFO, MSG_INVALIDATE, state["path"])
+        state["metadata"] = msg["extra"]["metadata"]
+        state["stale"] = True
+
+
 def handler_process(
     num_request: int,
-    objects_db,
-    requests_db,
-    rfile: io.BufferedIOBase,
+    path: str,
+    action: str,
+    extra: dict,
+    conn: socket.socket,
+    queue_in: mp.Queue,
+    queue_idle: mp.Queue,
+    metadata: dict | None,
     timeout: float,
+    config: dict,
 ):
     """
-    Send metadata object in format server expects.
+    Process that handles all requests for a single path.
+    Receives the first request directly and later ones as messages on queue_in,
+    each with the connection to respond on.
+    Messages without a connection notify that the object changed remotely.
+    State of file is kept between requests, as in workers of backend.
     """
 
-    # Get type of request and on which path.
-    action = rfile.read(1)
-    path = get_path(rfile)
-    print(f"Perform operation {action} on {path}.")
-
-    # Check if file has already been seen.
-    if path in objects_db:
-        x = objects_db[path]
+    state = {
+        **new_file_state(config, path),
+        "path": path,
+        "metadata": metadata,
+        "stale": False,
+        "num_received": 0,
+        "idle": False,
+    }
+    if config.get("read_only") and metadata is not None:
+        # Reads must get version whose metadata the mount has seen.
+        state["pinned_etag"] = metadata["etag"]
+    try:
+        serve_path(
+            num_request, path, action, extra, conn, queue_in, queue_idle, timeout, state
+        )
+    finally:
+        remove_file_state(state)
 
-        # If active process, send there.
-        if x["process"] is not None and x["process"].is_alive():
-            # TODO: add locking
-            requests_db[num_request] = get_request(action, path, rfile)
 
-        # Done in this case.
-        return
+def serve_path(
+    num_request: int,
+    path: str,
+    action: str,
+    extra: dict,
+    conn: socket.socket,
+    queue_in: mp.Queue,
+    queue_idle: mp.Queue,
+    timeout: float,
+    state: dict,
+):
+    """
+    Handle requests for path, starting with the given one, until process exits.
+    """
+    while True:
+        ringlog.log_hot(MSG_HANDLE_REQUEST, num_request, path)
+        trace_id = extra["trace_id"]
+        record_span("dispatch_to_process", trace_id, extra["dispatch_ns"], time_ns())
+        try:
+            with span("process_request", trace_id, {"action": action}):
+                handle_request(action, path, extra, conn, state)
+        finally:
+            conn.close()
 
-    # Need to start new process to handle request.
+        # Wait for next request, exit when server agrees process is idle.
+        msg = get_next_request(queue_in, queue_idle, timeout, state)
+        if msg is None:
+            return
+        num_request = msg["num_request"]
+        action = msg["action"]
+        extra = msg["extra"]
+        conn = msg["conn"]
@@ -0,0 +1,93 @@
+"""
+In-process registry of objects known to the server.
+Entries are split across shards, each with its own lock, so lookups on
+different paths do not contend and never leave the serving process.
+"""
+
+import threading
+import zlib
+
+
+class ObjectRegistry:
+    """
+    Sharded dictionary from path to entry, safe to use from many threads.
+    Reads take only the lock of the shard holding the path.
+    """
+
+    def __init__(self, num_shards: int = 64):
+        self.num_shards = num_shards
+        self.shards = [{} for _ in range(num_shards)]
+        self.locks = [threading.Lock() for _ in range(num_shards)]
+
+    def shard_index(self, path: str) -> int:
+        """
+        Get index of shard that holds specified path.
+        """
+        return zlib.crc32(path.encode("UTF-8")) % self.num_shards
+
+    def get(self, path: str, default=None):
+        """
+        Get entry for path, or default if not present.
+        """
+        i = self.shard_index(path)
+        with self.locks[i]:
+            return self.shards[i].get(path, default)
+
+    def set(self, path: str, entry):
+        """
+        Set entry for path, replacing any existing one.
+        """
+        i = self.shard_index(path)
+        with self.locks[i]:
+            self.shards[i][path] = entry
+
+    def setdefault(self, path: str, entry):
+        """
+        Set entry for path if not already present.
+        Returns the entry now stored for path.
+        """
+        i = self.shard_index(path)
+        with self.locks[i]:
+            return self.shards[i].setdefault(path, entry)
+
+    def pop(self, path: str, default=None):
+        """
+        Remove and return entry for path, or default if not present.
+        """
+        i = self.shard_index(path)
+        with self.locks[i]:
+            return self.shards[i].pop(path, default)
+
+    def update_entry(self, path: str, func):
+        """
+        Atomically replace entry for path with func(old_entry).
+        The old entry is None if path not present; if func returns None, remove path.
+        Returns the new entry.
+        """
+        i = self.shard_index(path)
+        with self.locks[i]:
+            shard = self.shards[i]
+            entry = func(shard.get(path))
+            if entry is None:
+                shard.pop(path, None)
+            else:
+                shard[path] = entry
+            return entry
+
+    def items(self) -> list:
+        """
+        Snapshot of all (path, entry) pairs, taken one shard at a time.
+        """
+        r = []
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                r.extend(shard.items())
+        return r
+
+    def __contains__(self, path: str) -> bool:
+        i = self.shard_index(path)
+        with self.locks[i]:
+            return path in self.shards[i]
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.shards)
@@ -0,0 +1,167 @@
+"""
+Low-overhead logging to in-memory ring buffer, for use on hot paths.
+Records are packed binary (time, level, message ID, arguments) and only
+formatted when dumped, in full on SIGUSR1, or records added since last dump
+after an error is logged.
+Messages are registered once as format strings, and string arguments are
+kept in a slot per record, overwritten with the record, so memory is bounded
+by the ring size.
+"""
+
+import itertools
+import os
+import signal
+import struct
+import sys
+import time
+
+# Log levels.
+HOT = 0
+DEBUG = 1
+INFO = 2
+ERROR = 3
+LEVEL_NAMES = ["HOT", "DEBUG", "INFO", "ERROR"]
+
+# Whether hot-path level is recorded; if not, log_hot does nothing.
+HOT_ENABLED = os.getenv("log_hot_enabled", "0") == "1"
+
+# Number of records kept.
+RING_SIZE = int(os.getenv("log_ring_size", "65536"))
+
+# Record: time (ns), message ID, level, flags of string arguments, 3 arguments.
+RECORD = struct.Struct("<qHBBqqq4x")
+MAX_ARGS = 3
+
+# Registered format strings, indexed by message ID.
+messages = []
+
+
+def register(fmt: str) -> int:
+    """
+    Register format string of message, using str.format syntax.
+    Returns message ID used for logging.
+    """
+    messages.append(fmt)
+    return len(messages) - 1
+
+
+class RingLog:
+    """
+    Ring buffer of binary log records.
+    Slots are claimed with an atomic counter, so concurrent threads do not
+    need a lock to log.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.buffer = bytearray(RECORD.size * size)
+        self.counter = itertools.count()
+        self.num_written = 0
+        self.num_dumped = 0
+        self.strings = [None] * size
+
+    def clear(self):
+        """
+        Remove all records, used in new child process.
+        """
+        self.counter = itertools.count()
+        self.num_written = 0
+        self.num_dumped = 0
+        self.strings = [None] * self.size
+
+    def log(self, level: int, msg_id: int, *args):
+        """
+        Add record to ring buffer, overwriting oldest if full.
+        Arguments must be integers or strings.
+        """
+        flags = 0
+        values = [0] * MAX_ARGS
+        strings = None
+        for i, a in enumerate(args):
+            if isinstance(a, str):
+                flags |= 1 << i
+                strings = strings or [None] * MAX_ARGS
+                strings[i] = a
+            else:
+                values[i] = int(a)
+
+        n = next(self.counter)
+        slot = n % self.size
+        self.strings[slot] = strings
+        RECORD.pack_into(
+            self.buffer,
+            RECORD.size * slot,
+            time.time_ns(),
+            msg_id,
+            level,
+            flags,
+            *values,
+        )
+        self.num_written = max(self.num_written, n + 1)
+
+    def records(self, start: int = 0):
+        """
+        Iterate over formatted records numbered from start on, oldest first.
+        """
+        end = self.num_written
+        for n in range(max(start, end - self.size), end):
+            slot = n % self.size
+            ts, msg_id, level, flags, *values = RECORD.unpack_from(
+                self.buffer, RECORD.size * slot
+            )
+            strings = self.strings[slot]
+            args = [strings[i] if flags & (1 << i) else v for i, v in enumerate(values)]
+            t = time.strftime("%H:%M:%S", time.localtime(ts / 1e9))
+            msg = messages[msg_id].format(*args)
+            yield f"{t}.{ts % 10**9:09d} {LEVEL_NAMES[level]} {msg}"
+
+    def dump(self, out=None, only_new: bool = False):
+        """
+        Write formatted records to output (standard error by default).
+        If only_new, only records added since last dump are written, so
+        repeated errors do not each write the whole ring.
+        """
+        out = out or sys.stderr
+        pid = os.getpid()
+        start = self.num_dumped if only_new else 0
+        self.num_dumped = self.num_written
+        out.write(f"--- Log ring dump of process {pid} ---\n")
+        for line in self.records(start):
+            out.write(line)
+            out.write("\n")
+        out.write(f"--- End of log ring dump of process {pid} ---\n")
+        out.flush()
+
+
+ring = RingLog(RING_SIZE)
+os.register_at_fork(after_in_child=ring.clear)
+
+
+def log(level: int, msg_id: int, *args):
+    """
+    Log message to ring buffer of process.
+    Logging at ERROR level also dumps records added since last dump.
+    """
+    ring.log(level, msg_id, *args)
+    if level >= ERROR:
+        ring.dump(only_new=True)
+
+
+def _log_hot(msg_id: int, *args):
+    ring.log(HOT, msg_id, *args)
+
+
+def _no_op(msg_id: int, *args):
+    pass
+
+
+# Log at hot-path level, bound once so disabled logging costs only a call.
+log_hot = _log_hot if HOT_ENABLED else _no_op
+
+
+def install_dump_signal():
+    """
+    Dump ring buffer when process receives SIGUSR1.
+    Must be called from main thread.
+    """
+    signal.signal(signal.SIGUSR1, lambda signum, frame: ring.dump())
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Cache service shared by all mounts on a host, reached over Unix socket.
+Objects, blocks of objects and metadata are fetched from MinIO once, even if
+several mounts ask for them at the same time, and kept under one disk budget.
+Cached data is returned as open file descriptors, so mounts read it directly
+and entries can be evicted while still in use.
+Each message is 4-byte length then JSON; file descriptors are passed with the
+first byte of reply.
+Socket is only accessible by owner, and connections are accepted only from
+processes of allowed users, checked by peer credentials.
+"""
+
+import hashlib
+import json
+import os
+import re
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import minio
+
+from metadata_index import metadata_from_minio
+
+MESSAGE_LENGTH = struct.Struct("<I")
+
+# Default size of each cached block, for ranged reads.
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Names of files created in cache directory: entry hash, or partial download.
+CACHE_FILE_NAME = re.compile(r"[0-9a-f]{64}(\.part)?")
+
+# Peer credentials of Unix socket: PID, UID, GID.
+PEER_CREDENTIALS = struct.Struct("3i")
+
+
+def send_message(sock: socket.socket, msg: dict, fds: list = ()):
+    """
+    Send message, with file descriptors if any.
+    """
+    data = json.dumps(msg).encode("UTF-8")
+    socket.send_fds(sock, [MESSAGE_LENGTH.pack(len(data)) + data], list(fds))
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """
+    Receive exactly size bytes, raising error if connection closed first.
+    """
+    parts = []
+    while size > 0:
+        data = sock.recv(size)
+        if not data:
+            raise ConnectionError("Shared cache connection closed.")
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+
+def recv_message(sock: socket.socket) -> tuple:
+    """
+    Receive message, returning (message, file descriptors).
+    Returns (None, []) if connection closed before message.
+    """
+    data, fds, _, _ = socket.recv_fds(sock, MESSAGE_LENGTH.size, 1)
+    if not data:
+        return None, []
+    data += recv_exact(sock, MESSAGE_LENGTH.size - len(data))
+    (length,) = MESSAGE_LENGTH.unpack(data)
+    return json.loads(recv_exact(sock, length)), fds
+
+
+class DiskBudget:
+    """
+    Files in cache directory, evicted least recently used first when their
+    total size is over budget.
+    """
+
+    def __init__(self, cache_dir: str, budget: int):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def path(self, entry_key: str) -> str:
+        """
+        Get path of file in cache directory for entry.
+        """
+        name = hashlib.sha256(entry_key.encode("UTF-8")).hexdigest()
+        return f"{self.cache_dir}/{name}"
+
+    def open(self, entry_key: str) -> int | None:
+        """
+        Open file of cached entry for reading, marking it as recently used.
+        Opened under lock, so file is not evicted meanwhile; once open, it
+        stays readable even if evicted later.
+        Returns file descriptor, or None if not cached.
+        """
+        with self.lock:
+            if entry_key not in self.entries:
+                return None
+            self.entries.move_to_end(entry_key)
+            return os.open(self.path(entry_key), os.O_RDONLY)
+
+    def add(self, entry_key: str, size: int):
+        """
+        Add entry whose file is already written, evicting others if over budget.
+        """
+        with self.lock:
+            self.total += size - self.entries.pop(entry_key, 0)
+            self.entries[entry_key] = size
+            while self.total > self.budget and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total -= old_size
+                self.unlink(old_key)
+
+    def remove_prefix(self, prefix: str):
+        """
+        Remove all entries with keys starting with prefix.
+        """
+        with self.lock:
+            for entry_key in [k for k in self.entries if k.startswith(prefix)]:
+                self.total -= self.entries.pop(entry_key)
+                self.unlink(entry_key)
+
+    def unlink(self, entry_key: str):
+        """
+        Delete file of entry. Readers with it open keep reading the old file.
+        """
+        try:
+            os.unlink(self.path(entry_key))
+        except FileNotFoundError:
+            pass
+
+
+def remove_cache_files(cache_dir: str):
+    """
+    Remove files created by cache in directory, left from previous run.
+    Anything else in directory is kept.
+    """
+    for entry in os.scandir(cache_dir):
+        if CACHE_FILE_NAME.fullmatch(entry.name) and entry.is_file(
+            follow_symlinks=False
+        ):
+            os.unlink(entry.path)
+
+
+class SharedCache:
+    """
+    Cached objects, blocks and metadata, by bucket and key.
+    Concurrent fetches of the same entry are done once, with other callers
+    waiting for the result.
+    """
+
+    def __init__(self, client, disk: DiskBudget, metadata_ttl: float):
+        self.client = client
+        self.disk = disk
+        self.metadata_ttl = metadata_ttl
+        self.metadata = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def single_flight(self, entry_key: str, fetch) -> int:
+        """
+        Call fetch() to fill entry, unless already being filled, in which case
+        wait for that instead. Returns file descriptor of entry, opened before
+        it can be evicted, which caller must close.
+        """
+        while True:
+            fd = self.disk.open(entry_key)
+            if fd is not None:
+                return fd
+
+            with self.lock:
+                pending = self.inflight.get(entry_key)
+                owner = pending is None
+                if owner:
+                    pending = {"done": threading.Event(), "error": None}
+                    self.inflight[entry_key] = pending
+            if owner:
+                break
+
+            pending["done"].wait()
+            if pending["error"] is not None:
+                raise OSError(f"Fetch of {entry_key} failed.") from pending["error"]
+            # Entry may be evicted again before it is opened, then fetch it.
+
+        try:
+            path = self.disk.path(entry_key)
+            size = fetch(f"{path}.part")
+            os.replace(f"{path}.part", path)
+            fd = os.open(path, os.O_RDONLY)
+            self.disk.add(entry_key, size)
+            return fd
+        except Exception as e:
+            pending["error"] = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(entry_key, None)
+            pending["done"].set()
+
+    def stat(self, bucket: str, key: str) -> dict:
+        """
+        Get metadata of object, from cache if recent enough.
+        """
+        with self.lock:
+            cached = self.metadata.get((bucket, key))
+        if cached is not None and time.monotonic() - cached[0] < self.metadata_ttl:
+            return cached[1]
+        metadata = metadata_from_minio(self.client.stat_object(bucket, key))
+        with self.lock:
+            self.metadata[(bucket, key)] = (time.monotonic(), metadata)
+        return metadata
+
+    def get_object(self, bucket: str, key: str) -> tuple:
+        """
+        Get file descriptor of cached copy of whole object, and its metadata.
+        """
+        metadata = self.stat(bucket, key)
+
+        def fetch(path: str) -> int:
+            self.client.fget_object(bucket, key, path)
+            return os.path.getsize(path)
+
+        entry_key = f"{bucket}\0{key}\0{metadata['etag']}\0object"
+        return self.single_flight(entry_key, fetch), metadata
+
+    def get_block(self, bucket: str, key: str, index: int, block_size: int) -> tuple:
+        """
+        Get file descriptor of cached block of object, and metadata of object.
+        """
+        metadata = self.stat(bucket, key)
+
+        def fetch(path: str) -> int:
+            response = self.client.get_object(
+                bucket, key, offset=index * block_size, length=block_size
+            )
+            try:
+                with open(path, "wb") as f:
+                    for chunk in response.stream(1024 * 1024):
+                        f.write(chunk)
+            finally:
+                response.close()
+                response.release_conn()
+            return os.path.getsize(path)
+
+        entry_key = f"{bucket}\0{key}\0{metadata['etag']}\0block\0{block_size}\0{index}"
+        return self.single_flight(entry_key, fetch), metadata
+
+    def invalidate(self, bucket: str, key: str):
+        """
+        Drop metadata and data of object, after it was changed.
+        """
+        with self.lock:
+            self.metadata.pop((bucket, key), None)
+        self.disk.remove_prefix(f"{bucket}\0{key}\0")
+
+
+class SharedCacheHandler(socketserver.BaseRequestHandler):
+    """
+    Handles requests of one mount, until it disconnects.
+    """
+
+    def handle(self):
+        cache = self.server.cache
+        while True:
+            try:
+                msg, _ = recv_message(self.request)
+            except ConnectionError:
+                return
+            if msg is None:
+                return
+
+            op = msg["op"]
+            bucket = msg["bucket"]
+            key = msg["key"]
+            fd = None
+            try:
+                if op == "stat":
+                    reply = {"metadata": cache.stat(bucket, key)}
+                elif op == "object":
+                    fd, metadata = cache.get_object(bucket, key)
+                    reply = {"metadata": metadata}
+                elif op == "block":
+                    fd, metadata = cache.get_block(
+                        bucket, key, msg["index"], msg["block_size"]
+                    )
+                    reply = {"metadata": metadata}
+                elif op == "invalidate":
+                    cache.invalidate(bucket, key)
+                    reply = {}
+                else:
+                    raise NotImplementedError(f"operation: {op}")
+            except (OSError, minio.error.S3Error, NotImplementedError) as e:
+                print(f"Error during {op} of {key}:", e)
+                send_message(self.request, {"error": str(e)})
+                continue
+
+            if fd is None:
+                send_message(self.request, reply)
+                continue
+            try:
+                send_message(self.request, reply, [fd])
+            finally:
+                os.close(fd)
+
+
+def peer_uid(sock: socket.socket) -> int:
+    """
+    Get user ID of process at other end of Unix socket.
+    """
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size
+    )
+    _, uid, _ = PEER_CREDENTIALS.unpack(creds)
+    return uid
+
+
+class SharedCacheServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Server of shared cache, with socket only accessible by its owner (or as set
+    by socket_mode), accepting connections only from allowed users.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, socket_mode: int, allowed_uids: set):
+        self.socket_mode = socket_mode
+        self.allowed_uids = allowed_uids
+        super().__init__(socket_path, SharedCacheHandler)
+
+    def server_bind(self):
+        # No other user can connect between creating socket and setting mode.
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.server_address, self.socket_mode)
+
+    def verify_request(self, request, client_address) -> bool:
+        uid = peer_uid(request)
+        if uid in self.allowed_uids:
+            return True
+        print(f"Reject shared cache connection from user {uid}.")
+        return False
+
+
+class SharedCacheClient:
+    """
+    Connection of mount to shared cache service.
+    Reconnects after fork, as connection cannot be shared between processes.
+    """
+
+    def __init__(
+        self, socket_path: str, bucket: str, block_size: int = DEFAULT_BLOCK_SIZE
+    ):
+        self.socket_path = socket_path
+        self.bucket = bucket
+        self.block_size = block_size
+        self.sock = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def request(self, msg: dict) -> tuple:
+        """
+        Send request and get reply, returning (reply, file descriptors).
+        """
+        with self.lock:
+            if self.sock is None or self.pid != os.getpid():
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.socket_path)
+                self.pid = os.getpid()
+            try:
+                send_message(self.sock, {**msg, "bucket": self.bucket})
+                reply, fds = recv_message(self.sock)
+            except OSError:
+                self.sock.close()
+                self.sock = None
+                raise
+        if reply is None:
+            raise ConnectionError("Shared cache closed connection.")
+        if "error" in reply:
+            for fd in fds:
+                os.close(fd)
+            raise OSError(f"Shared cache error: {reply['error']}")
+        return reply, fds
+
+    def stat(self, key: str) -> dict:
+        """
+        Get metadata of object.
+        """
+        reply, _ = self.request({"op": "stat", "key": key})
+        return reply["metadata"]
+
+    def open_object(self, key: str) -> tuple:
+        """
+        Open cached copy of object for reading, returning (file, metadata).
+        """
+        reply, fds = self.request({"op": "object", "key": key})
+        return os.fdopen(fds[0], "rb"), reply["metadata"]
+
+    def open_block(self, key: str, index: int) -> tuple:
+        """
+        Open cached block of object for reading, returning (file, metadata).
+        """
+        reply, fds = self.request(
+            {"op": "block", "key": key, "index": index, "block_size": self.block_size}
+        )
+        return os.fdopen(fds[0], "rb"), reply["metadata"]
+
+    def invalidate(self, key: str):
+        """
+        Tell cache that object changed.
+        """
+        self.request({"op": "invalidate", "key": key})
+
+
+def get_config_var(var_name: str, default: str | None = None) -> str | None:
+    """
+    Gets specified configuration variable (from environment variables).
+    Uses default if not set.
+    """
+    v = os.getenv(var_name, default)
+    print(f"Configuration variable {var_name} has value: {v}")
+    return v
+
+
+def main():
+    """
+    Function invoked when this program is run from command line.
+    """
+    config = {
+        "shared_cache_socket": get_config_var(
+            "shared_cache_socket", "/tmp/mc_shared_cache.socket"
+        ),
+        "shared_cache_dir": get_config_var("shared_cache_dir", "/tmp/mc_shared_cache"),
+        "shared_cache_budget": int(
+            get_config_var("shared_cache_budget", str(10 * 1024**3))
+        ),
+        "shared_cache_metadata_ttl": float(
+            get_config_var("shared_cache_metadata_ttl", "5")
+        ),
+        "shared_cache_socket_mode": int(
+            get_config_var("shared_cache_socket_mode", "600"), 8
+        ),
+        "shared_cache_allowed_uids": get_config_var("shared_cache_allowed_uids", ""),
+        "minio_host": get_config_var("minio_host"),
+        "minio_access_key": get_config_var("minio_access_key"),
+        "minio_secret_key": get_config_var("minio_secret_key"),
+    }
+    allowed_uids = {os.getuid()} | {
+        int(u) for u in config["shared_cache_allowed_uids"].split(",") if u
+    }
+
+    # Files left from previous run are not tracked in budget, so remove them.
+    os.makedirs(config["shared_cache_dir"], mode=0o700, exist_ok=True)
+    remove_cache_files(config["shared_cache_dir"])
+    socket_path = config["shared_cache_socket"]
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise FileExistsError(f"Not a socket: {socket_path}")
+        os.unlink(socket_path)
+
+    client = minio.Minio(
+        config["minio_host"],
+        access_key=config["minio_access_key"],
+        secret_key=config["minio_secret_key"],
+    )
+    disk = DiskBudget(config["shared_cache_dir"], config["shared_cache_budget"])
+
+    with SharedCacheServer(
+        socket_path,
+        config["shared_cache_socket_mode"],
+        allowed_uids,
+    ) as server:
+        server.cache = SharedCache(
+            client,
+            disk,
+            config["shared_cache_metadata_ttl"],
+        )
+        print(f"Shared cache listening on {config['shared_cache_socket']}.")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
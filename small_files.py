@@ -0,0 +1,243 @@
+"""
+In-memory cache of small objects, filled ahead of reads.
+When files in a directory are opened one after another in listing order, the
+next siblings are fetched in parallel batches, so that opening and reading
+each of them is answered from memory without starting a process.
+"""
+
+import concurrent.futures
+import os
+import threading
+from collections import OrderedDict
+
+# Number of files opened in listing order before prefetch starts.
+MIN_SEQUENTIAL_RUN = 2
+
+# Name sorting after all others, to mark prefetch as not needed yet.
+END_OF_LISTING = "\uffff"
+
+
+class SmallFileCache:
+    """
+    Contents of small objects by path, least recently used evicted first when
+    total size is over budget.
+    Files opened from cache are kept separately until released, so reads of
+    open files are served even after eviction.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.total = 0
+        self.open_files = {}
+        self.lock = threading.Lock()
+
+    def open(self, path: str) -> bool:
+        """
+        Open file from cache, returning False if not cached.
+        """
+        with self.lock:
+            if path in self.open_files:
+                self.open_files[path][1] += 1
+                return True
+            data = self.entries.get(path)
+            if data is None:
+                return False
+            self.entries.move_to_end(path)
+            self.open_files[path] = [data, 1]
+            return True
+
+    def read_open(self, path: str) -> bytes | None:
+        """
+        Get contents of file opened from cache, or None if not open from cache.
+        """
+        with self.lock:
+            r = self.open_files.get(path)
+            return r[0] if r is not None else None
+
+    def release(self, path: str) -> bool:
+        """
+        Close file opened from cache, returning False if not open from cache.
+        """
+        with self.lock:
+            r = self.open_files.get(path)
+            if r is None:
+                return False
+            r[1] -= 1
+            if r[1] == 0:
+                del self.open_files[path]
+            return True
+
+    def close_all(self, path: str):
+        """
+        Stop serving open handles of path from cache, so their later requests
+        go to process of path.
+        """
+        with self.lock:
+            self.open_files.pop(path, None)
+
+    def put(self, path: str, data: bytes):
+        """
+        Add contents of object, evicting others if over budget.
+        """
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.total -= len(old)
+            self.entries[path] = data
+            self.total += len(data)
+            while self.total > self.budget and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total -= len(evicted)
+
+    def clear(self):
+        """
+        Remove all objects not open.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.total = 0
+
+    def drop(self, path: str):
+        """
+        Remove object, after it was changed.
+        """
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.total -= len(old)
+
+    def __contains__(self, path: str) -> bool:
+        with self.lock:
+            return path in self.entries
+
+
+class DirReadState:
+    """
+    Recent opens in one directory, to detect reads in listing order.
+    """
+
+    __slots__ = ("last_name", "run", "prefetched_until")
+
+    def __init__(self):
+        self.last_name = None
+        self.run = 0
+        self.prefetched_until = ""
+
+
+class SmallFilePrefetcher:
+    """
+    Detects files opened in listing order under configured prefixes, and
+    fetches the following siblings into the small file cache.
+    Function list_dir(path) gets sorted names in directory, listing it if needed.
+    """
+
+    def __init__(self, client, config: dict, cache: SmallFileCache, list_dir):
+        self.client = client
+        self.bucket = config["minio_bucket"]
+        self.prefixes = config["small_file_prefixes"]
+        self.max_size = config["small_file_max_size"]
+        self.batch_size = config["small_file_prefetch"]
+        self.cache = cache
+        self.list_dir = list_dir
+        self.dirs = {}
+        self.inflight = set()
+        self.cancelled = set()
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config["small_file_threads"]
+        )
+
+    def enabled(self, path: str) -> bool:
+        """
+        Whether small file mode applies to path.
+        """
+        return any(path.startswith(p) for p in self.prefixes)
+
+    def on_open(self, path: str):
+        """
+        Record open of path, starting prefetch of next siblings if files in
+        directory are being opened in listing order.
+        """
+        if not self.enabled(path):
+            return
+        dir_path, name = os.path.split(path)
+        with self.lock:
+            state = self.dirs.setdefault(dir_path, DirReadState())
+            if state.last_name is not None and name > state.last_name:
+                state.run += 1
+            else:
+                state.run = 0
+                state.prefetched_until = ""
+            state.last_name = name
+            if state.run < MIN_SEQUENTIAL_RUN or state.prefetched_until > name:
+                return
+            # Mark batch as started, so following opens do not start it again.
+            state.prefetched_until = END_OF_LISTING
+        self.executor.submit(self.prefetch_after, dir_path, name)
+
+    def invalidate(self, path: str):
+        """
+        Drop cached contents of path, including any fetch in progress.
+        """
+        with self.lock:
+            if path in self.inflight:
+                self.cancelled.add(path)
+        self.cache.drop(path)
+
+    def invalidate_all(self):
+        """
+        Drop all cached contents, including fetches in progress.
+        """
+        with self.lock:
+            self.cancelled.update(self.inflight)
+        self.cache.clear()
+
+    def prefetch_after(self, dir_path: str, name: str):
+        """
+        Fetch batch of siblings following name in listing order.
+        Run in thread pool.
+        """
+        names = self.list_dir(dir_path) or []
+        batch = [n for n in names if n > name][: self.batch_size]
+        with self.lock:
+            state = self.dirs.get(dir_path)
+            if state is not None:
+                # Start next batch when reads get halfway through this one.
+                half = batch[len(batch) // 2] if batch else END_OF_LISTING
+                state.prefetched_until = half
+
+        for n in batch:
+            path = f"{dir_path.rstrip('/')}/{n}"
+            with self.lock:
+                if path in self.inflight or path in self.cache:
+                    continue
+                self.inflight.add(path)
+            self.executor.submit(self.fetch, path)
+
+    def fetch(self, path: str):
+        """
+        Get object into cache, if it is small enough.
+        Reads at most one byte over limit, to tell if it is too large.
+        """
+        try:
+            response = self.client.get_object(
+                self.bucket, path.lstrip("/"), offset=0, length=self.max_size + 1
+            )
+            try:
+                data = response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        except Exception as e:  # pylint: disable=broad-except
+            # Usually a subdirectory or object removed since listing.
+            print(f"Prefetch of {path} failed:", e)
+            data = None
+
+        with self.lock:
+            self.inflight.discard(path)
+            if path in self.cancelled:
+                self.cancelled.discard(path)
+                return
+            if data is not None and len(data) <= self.max_size:
+                self.cache.put(path, data)
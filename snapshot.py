@@ -0,0 +1,71 @@
+"""
+Read-only snapshot of objects under a prefix, captured when mount starts.
+Listing and metadata (including ETags) are then fixed for the life of the
+mount, so they are never revalidated, and all changes are rejected.
+Without MinIO, snapshot is taken from metadata index of previous run.
+"""
+
+import time
+
+from crawler import crawl_prefix
+from dir_tree import DirTree
+from metadata_index import MetadataIndex
+from metadata_store import MetadataStore
+
+# Request actions that change files or directories: chmod, chown, create,
+# mkdir, rename, rmdir, truncate, unlink, write.
+MUTATING_ACTIONS = frozenset("MICKNDTUW")
+
+
+class Snapshot:
+    """
+    Metadata of all objects under prefix at time of capture.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix.strip("/")
+        self.metadata = MetadataStore()
+        self.capture_time = None
+
+    def capture(self, client, bucket: str, tree: DirTree, num_threads: int):
+        """
+        List all objects under prefix with parallel crawl, storing their
+        metadata, and load them into directory tree as complete subtree.
+        """
+        start_time = time.time()
+        key_prefix = f"{self.prefix}/" if self.prefix else ""
+        results = crawl_prefix(client, bucket, key_prefix, num_threads)
+        entries = []
+        for relative_key, size, metadata in results:
+            entries.append((relative_key, size))
+            if metadata is not None:
+                self.metadata.set(metadata["minio_path"], metadata)
+        tree.load_subtree(f"/{self.prefix}", entries)
+        self.capture_time = time.time()
+        print(
+            f"Captured snapshot of {len(self.metadata)} objects under "
+            f"/{self.prefix} in {round(self.capture_time - start_time, 2)} seconds."
+        )
+
+    def load_index(self, index: MetadataIndex, tree: DirTree) -> bool:
+        """
+        Take snapshot from metadata index instead of listing MinIO.
+        Returns False if no index loaded.
+        """
+        if index.map is None:
+            return False
+        path_prefix = f"/{self.prefix}/" if self.prefix else "/"
+        entries = []
+        for m in index.list_prefix(path_prefix):
+            entries.append((m["minio_path"][len(path_prefix) :], m["size"]))
+            self.metadata.set(m["minio_path"], m)
+        tree.load_subtree(f"/{self.prefix}", entries)
+        self.capture_time = time.time()
+        print(f"Loaded snapshot of {len(self.metadata)} objects from index.")
+        return True
+
+    def lookup(self, path: str) -> dict | None:
+        """
+        Get metadata of file at path, or None if not in snapshot.
+        """
+        return self.metadata.get(path)
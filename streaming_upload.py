@@ -0,0 +1,145 @@
+"""
+Streaming upload of newly created files that are written sequentially.
+Writes are passed to a background multipart upload as they arrive, so data
+does not need to be staged on local disk and close only waits for the last part.
+"""
+
+import threading
+from collections import deque
+
+# Default size of each uploaded part, 5 MiB is the minimum allowed by S3.
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+
+# Default number of bytes of writes buffered in memory before writer waits
+# for upload.
+DEFAULT_MAX_BUFFERED = 4 * 1024 * 1024
+
+
+def upload_memory(part_size: int, max_buffered: int = DEFAULT_MAX_BUFFERED) -> int:
+    """
+    Most memory used by upload: part being filled by MinIO client, and
+    writes buffered before it.
+    """
+    return part_size + max_buffered
+
+
+class ChunkStream:
+    """
+    File-like object read by MinIO client during upload, fed with chunks of
+    data from a queue bounded in bytes.
+    """
+
+    def __init__(self, max_buffered: int):
+        self.chunks = deque()
+        self.max_buffered = max_buffered
+        self.buffered = 0
+        self.cond = threading.Condition()
+        self.buffer = b""
+        self.done = False
+
+    def feed(self, data: bytes | None, thread: threading.Thread):
+        """
+        Add chunk of data, None at end, waiting while queue is full.
+        Chunk is always taken into empty queue, even if larger than limit.
+        Raises error if uploading thread exits before taking it.
+        """
+        size = len(data) if data is not None else 0
+        with self.cond:
+            while self.buffered > 0 and self.buffered + size > self.max_buffered:
+                if not thread.is_alive():
+                    raise OSError("Upload stopped before all data was sent.")
+                self.cond.wait(timeout=1)
+            self.chunks.append(data)
+            self.buffered += size
+            self.cond.notify_all()
+
+    def get_chunk(self) -> bytes | None:
+        """
+        Take next chunk from queue, waiting until there is one.
+        """
+        with self.cond:
+            while not self.chunks:
+                self.cond.wait()
+            chunk = self.chunks.popleft()
+            if chunk is not None:
+                self.buffered -= len(chunk)
+            self.cond.notify_all()
+            return chunk
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read up to size bytes, fewer only at end of stream.
+        """
+        parts = []
+        n = 0
+        while (size < 0 or n < size) and not self.done:
+            if not self.buffer:
+                chunk = self.get_chunk()
+                if chunk is None:
+                    self.done = True
+                    break
+                self.buffer = chunk
+            take = self.buffer if size < 0 else self.buffer[: size - n]
+            self.buffer = self.buffer[len(take) :]
+            parts.append(take)
+            n += len(take)
+        return b"".join(parts)
+
+
+class StreamingUpload:
+    """
+    Multipart upload of object, fed by sequential writes.
+    A write at any offset other than the current end is refused, after which
+    the caller should finish the upload and fall back to staging the file.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        part_size: int = DEFAULT_PART_SIZE,
+        max_buffered: int = DEFAULT_MAX_BUFFERED,
+    ):
+        self.key = key
+        self.next_offset = 0
+        self.stream = ChunkStream(max_buffered)
+        self.error = None
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(client, bucket, key, part_size),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def run(self, client, bucket: str, key: str, part_size: int):
+        """
+        Upload object from stream, run in background thread.
+        MinIO client uploads parts as each fills, and aborts upload on error.
+        """
+        try:
+            client.put_object(bucket, key, self.stream, length=-1, part_size=part_size)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Error during streaming upload of {key}:", e)
+            self.error = e
+
+    def write(self, data: bytes, offset: int) -> bool:
+        """
+        Add data written at offset to upload.
+        Returns False, without using data, if write is not at end of file.
+        """
+        if offset != self.next_offset or self.error is not None:
+            return False
+        self.stream.feed(bytes(data), self.thread)
+        self.next_offset += len(data)
+        return True
+
+    def finish(self):
+        """
+        Complete the upload with data written so far, waiting for last part.
+        """
+        self.stream.feed(None, self.thread)
+        self.thread.join()
+        if self.error is not None:
+            raise OSError(f"Streaming upload of {self.key} failed.") from self.error
+        print(f"Done streaming upload of {self.key}, {self.next_offset} bytes.")
@@ -0,0 +1,183 @@
+"""
+Make modules at top of repository importable from tests, and provide a fake
+MinIO client keeping objects in memory.
+"""
+
+import bisect
+import datetime
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def s3_error(code: str, key: str) -> Exception:
+    """
+    Get error raised by MinIO client for error code, or KeyError if MinIO
+    package not installed.
+    """
+    try:
+        from minio.error import S3Error  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return KeyError(key)
+    return S3Error(code, f"Error {code} for {key}.", key, None, None, None)
+
+
+class FakeObject:
+    """
+    Object as returned by stat or listing of MinIO client.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        data: bytes = b"",
+        metadata: dict | None = None,
+        last_modified: datetime.datetime | None = None,
+        is_dir: bool = False,
+    ):
+        self.object_name = name
+        self.data = data
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+        self.metadata = metadata
+        self.last_modified = last_modified
+        self.is_dir = is_dir
+
+
+class FakeResponse:
+    """
+    Response of get_object, with data of requested range.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+    def stream(self, amount: int):
+        for i in range(0, len(self.data), amount):
+            yield self.data[i : i + amount]
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """
+    MinIO client with objects in memory, by bucket and key.
+    Listings are sorted like S3, one level at a time unless recursive.
+    Calls are recorded, for tests to check what was requested.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+        self.puts = []
+        self.removed = []
+        self.composed = None
+        self.num_list_calls = 0
+        self.num_listed = 0
+        # Functions called at start of each listing, one per listing, to
+        # change objects or fail it.
+        self.before_list = iter(())
+
+    def add(
+        self,
+        key: str,
+        data: bytes = b"",
+        bucket: str = "bucket",
+        age: float = 0,
+        metadata: dict | None = None,
+    ):
+        """
+        Add object with user metadata, last modified age seconds ago.
+        """
+        last_modified = datetime.datetime.now(datetime.timezone.utc)
+        last_modified -= datetime.timedelta(seconds=age)
+        self.objects[(bucket, key)] = FakeObject(key, data, metadata, last_modified)
+
+    def get_data(self, key: str, bucket: str = "bucket") -> bytes:
+        """
+        Get contents of object.
+        """
+        return self.objects[(bucket, key)].data
+
+    def stat_object(self, bucket, key):
+        if (bucket, key) not in self.objects:
+            raise s3_error("NoSuchKey", key)
+        return self.objects[(bucket, key)]
+
+    def get_object(self, bucket, key, offset=0, length=0, request_headers=None):
+        self.gets.append((key, offset, length, request_headers))
+        obj = self.stat_object(bucket, key)
+        if request_headers and request_headers.get("If-Match") not in (
+            None,
+            obj.etag,
+        ):
+            raise s3_error("PreconditionFailed", key)
+        end = offset + length if length else obj.size
+        return FakeResponse(obj.data[offset:end])
+
+    def fget_object(self, bucket, key, path, request_headers=None):
+        response = self.get_object(bucket, key, request_headers=request_headers)
+        with open(path, "wb") as f:
+            f.write(response.read())
+
+    def put_object(self, bucket, key, data, length, part_size=0, metadata=None):
+        self.puts.append((bucket, key))
+        contents = data.read() if length < 0 else data.read(length)
+        self.objects[(bucket, key)] = FakeObject(key, contents, metadata)
+
+    def fput_object(self, bucket, key, path):
+        with open(path, "rb") as f:
+            self.put_object(bucket, key, f, -1)
+
+    def remove_object(self, bucket, key):
+        self.removed.append((bucket, key))
+        self.objects.pop((bucket, key), None)
+
+    def compose_object(self, bucket, key, sources):
+        self.composed = (bucket, key, sources)
+        return "result"
+
+    def copy_object(self, bucket, key, source, metadata=None, metadata_directive=None):
+        obj = self.stat_object(source.bucket_name, source.object_name)
+        if metadata_directive is None:
+            metadata = obj.metadata
+        self.objects[(bucket, key)] = FakeObject(key, obj.data, metadata)
+
+    def list_objects(self, bucket, prefix="", recursive=False, start_after=None):
+        next(self.before_list, lambda: None)()
+        self.num_list_calls += 1
+        keys = sorted(k for b, k in self.objects if b == bucket)
+        seen_dirs = set()
+        for key in keys[bisect.bisect_right(keys, start_after or "") :]:
+            if not key.startswith(prefix):
+                if key > prefix:
+                    return
+                continue
+            self.num_listed += 1
+            rest = key[len(prefix) :]
+            if "/" in rest and not recursive:
+                d = prefix + rest.split("/")[0] + "/"
+                if d not in seen_dirs:
+                    seen_dirs.add(d)
+                    yield FakeObject(d, is_dir=True)
+                continue
+            yield self.objects[(bucket, key)]
+
+
+@pytest.fixture
+def fake_minio() -> FakeMinio:
+    """
+    Empty fake MinIO client.
+    """
+    return FakeMinio()
@@ -0,0 +1,29 @@
+"""
+Tests of metadata lookups and invalidation in backend.
+"""
+
+import pytest
+
+pytest.importorskip("minio")
+
+from backend import invalidate_store, lookup_metadata
+from invalidation import make_event
+from metadata_index import MetadataIndex, write_index
+from metadata_store import MetadataStore
+
+
+def meta(path: str, etag: str) -> dict:
+    return {"minio_path": path, "size": 1, "mtime": 1.0, "etag": etag}
+
+
+def test_invalidation_takes_precedence_over_index(tmp_path):
+    index_path = str(tmp_path / "index")
+    write_index(index_path, [meta("/a", "1" * 32), meta("/b", "2" * 32)])
+    index = MetadataIndex(index_path)
+    store = MetadataStore()
+    assert lookup_metadata("/a", store, index)["etag"] == "1" * 32
+
+    invalidate_store(store, make_event("/a", "removed"))
+    invalidate_store(store, make_event("/b", "created", meta("/b", "3" * 32)))
+    assert lookup_metadata("/a", store, index) is None
+    assert lookup_metadata("/b", store, index)["etag"] == "3" * 32
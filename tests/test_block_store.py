@@ -0,0 +1,72 @@
+"""
+Tests of content-addressed block store and eviction of its blocks.
+"""
+
+import os
+
+from block_store import STALE_TEMP_AGE, BlockFile, BlockStore
+
+
+def age_file(path: str, seconds: float):
+    t = os.stat(path).st_mtime - seconds
+    os.utime(path, (t, t))
+
+
+def age_blocks(store: BlockStore, seconds: float):
+    for name in os.listdir(store.blocks_dir):
+        age_file(store.block_path(name), seconds)
+
+
+def store_data(store: BlockStore, client, data: bytes) -> tuple:
+    client.add("key", data)
+    etag = client.stat_object("bucket", "key").etag
+    return etag, store.store_object(client, "bucket", "key", etag, len(data))
+
+
+def test_identical_blocks_stored_once(tmp_path, fake_minio):
+    store = BlockStore(str(tmp_path), 4, 1024)
+    etag, digests = store_data(store, fake_minio, b"abcdabcdxy")
+    assert len(digests) == 3
+    assert digests[0] == digests[1]
+    assert len(os.listdir(store.blocks_dir)) == 2
+    assert store.get_manifest(etag, 10) == digests
+
+
+def test_read_marks_block_used(tmp_path, fake_minio):
+    store = BlockStore(str(tmp_path), 4, 1024)
+    etag, digests = store_data(store, fake_minio, b"aaaabbbb")
+    age_blocks(store, 1000)
+    f = BlockFile(store, digests, 8, fake_minio, "bucket", "key", etag)
+    f.seek(0)
+    assert f.read(4) == b"aaaa"
+    f.close()
+
+    # Budget fits one block: the block not read is evicted.
+    store.budget = 5
+    store.evict()
+    assert os.listdir(store.blocks_dir) == [digests[0]]
+
+
+def test_evicted_block_fetched_again(tmp_path, fake_minio):
+    store = BlockStore(str(tmp_path), 4, 1024)
+    etag, digests = store_data(store, fake_minio, b"aaaabbbb")
+    os.unlink(store.block_path(digests[1]))
+    f = BlockFile(store, digests, 8, fake_minio, "bucket", "key", etag)
+    assert f.read() == b"aaaabbbb"
+    assert len(fake_minio.gets) == 2
+    f.close()
+
+
+def test_eviction_keeps_blocks_being_written(tmp_path, fake_minio):
+    store = BlockStore(str(tmp_path), 4, 1024)
+    _, digests = store_data(store, fake_minio, b"aaaa")
+    writing = store.block_path(digests[0] + ".1234")
+    stale = store.block_path(digests[0] + ".5678")
+    for path in (writing, stale):
+        with open(path, "wb") as f:
+            f.write(b"aaaa")
+    age_file(stale, 2 * STALE_TEMP_AGE)
+
+    store.budget = 0
+    store.evict()
+    assert os.listdir(store.blocks_dir) == [os.path.basename(writing)]
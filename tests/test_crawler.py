@@ -0,0 +1,34 @@
+"""
+Tests of parallel prefix crawler and splitting of its key ranges.
+"""
+
+from crawler import crawl_prefix, split_bounds
+
+
+def test_split_bounds_follow_key_distribution():
+    assert split_bounds("d/", "d/x", None)[:2] == ["d/y", "d/z"]
+    bounds = split_bounds("d/", "d/a0123", "d/b")
+    assert bounds[0] == "d/a1"
+    assert all("d/a0123" < b < "d/b" for b in bounds)
+    assert split_bounds("d/", "d/a", "d/a") == []
+
+
+def test_crawl_splits_ranges_recursively(fake_minio):
+    # All keys share first character, so splitting only on it would not help.
+    keys = [f"d/a{i:04d}" for i in range(2000)] + ["d/sub/x", "d/zz"]
+    for k in keys:
+        fake_minio.add(k)
+    results = crawl_prefix(fake_minio, "bucket", "d/", 4, split_threshold=50)
+    names = sorted(r[0] for r in results)
+    assert names == sorted(k[len("d/") :] for k in keys)
+    # Every key listed once, apart from one past end of each range.
+    assert fake_minio.num_listed <= len(keys) + fake_minio.num_list_calls
+    # Ranges split only on digits, where keys differ, so few are empty.
+    assert fake_minio.num_list_calls < 300
+
+
+def test_crawl_without_split(fake_minio):
+    for c in "abc":
+        fake_minio.add(f"d/{c}")
+    results = crawl_prefix(fake_minio, "bucket", "d/", 2)
+    assert sorted(r[0] for r in results) == ["a", "b", "c"]
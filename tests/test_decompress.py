@@ -0,0 +1,28 @@
+"""
+Tests of decompressed size of compressed objects.
+"""
+
+import struct
+
+from decompress import SEEK_TABLE_FOOTER, SEEKABLE_MAGIC, decompressed_size
+
+
+def test_size_from_metadata(fake_minio):
+    metadata = {"x-amz-meta-uncompressed-size": "12345"}
+    fake_minio.add("d/f.gz", b"x" * 10, metadata=metadata)
+    assert decompressed_size(fake_minio, "bucket", "/d/f.gz") == 12345
+
+
+def test_gzip_size_not_taken_from_trailer(fake_minio):
+    # Trailer holds size modulo 4 GiB, so it must not be used.
+    fake_minio.add("d/f.gz", b"\x1f\x8b" + b"\0" * 8 + (5).to_bytes(4, "little"))
+    assert decompressed_size(fake_minio, "bucket", "/d/f.gz") is None
+
+
+def test_seekable_zstd_size_from_seek_table(fake_minio):
+    # Total over 4 GiB, which the gzip trailer could not represent.
+    frames = [(100, 3 * 2**30), (50, 2**31)]
+    table = b"".join(struct.pack("<II", c, d) for c, d in frames)
+    footer = SEEK_TABLE_FOOTER.pack(len(frames), 0, SEEKABLE_MAGIC)
+    fake_minio.add("d/f.zst", b"\0" * 150 + table + footer)
+    assert decompressed_size(fake_minio, "bucket", "/d/f.zst") == 5 * 2**30
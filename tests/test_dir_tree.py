@@ -0,0 +1,66 @@
+"""
+Tests of in-memory directory tree built from object keys.
+"""
+
+from dir_tree import DirTree
+
+
+def usage(tree: DirTree, path: str = "/") -> tuple:
+    u = tree.usage(path)
+    return u.bytes, u.count
+
+
+def test_usage_follows_adds_and_removes():
+    tree = DirTree()
+    tree.add_file("/a/x", 10)
+    tree.add_file("/a/b/y", 5)
+    assert usage(tree) == (15, 2)
+    assert usage(tree, "/a/b") == (5, 1)
+    tree.add_file("/a/x", 20)
+    assert usage(tree) == (25, 2)
+    tree.remove("/a/b/y")
+    assert usage(tree) == (20, 1)
+    assert tree.find("/a/b") is None
+
+
+def test_resize_file():
+    tree = DirTree()
+    tree.add_file("/d/f")
+    tree.resize_file("/d/f", 100, grow_only=True)
+    tree.resize_file("/d/f", 50, grow_only=True)
+    assert usage(tree, "/d") == (100, 1)
+    tree.resize_file("/d/f", 30)
+    assert usage(tree, "/d") == (30, 1)
+    tree.resize_file("/d/missing", 10)
+    assert usage(tree) == (30, 1)
+    assert tree.usage("/").hist[(30).bit_length()] == 1
+
+
+def test_rename_to_itself_keeps_usage():
+    tree = DirTree()
+    tree.add_file("/a/x", 10)
+    assert tree.rename("/a/x", "/a/x")
+    assert tree.rename("/a", "/a/")
+    assert usage(tree) == (10, 1)
+    assert usage(tree, "/a") == (10, 1)
+
+
+def test_rename_moves_usage():
+    tree = DirTree()
+    tree.add_file("/a/x", 10)
+    tree.add_file("/b/y", 3)
+    assert tree.rename("/a/x", "/b/y")
+    assert usage(tree) == (10, 1)
+    assert usage(tree, "/b") == (10, 1)
+    assert tree.find("/a") is None
+
+
+def test_rename_into_own_subtree_rejected():
+    tree = DirTree()
+    tree.add_file("/a/b/x", 10)
+    assert not tree.rename("/a", "/a/b/c")
+    assert not tree.rename("/a", "/a/c")
+    assert tree.find("/a/b/c") is None
+    assert usage(tree, "/a") == (10, 1)
+    assert tree.rename("/a", "/ab")
+    assert usage(tree, "/ab") == (10, 1)
@@ -0,0 +1,58 @@
+"""
+Tests of hedged requests, retried after a delay when slow.
+"""
+
+import threading
+import time
+
+import hedge
+
+
+def make_config(**kwargs) -> dict:
+    return {
+        "minio_host": f"hedge-test-{time.monotonic()}",
+        "hedge_enabled": True,
+        "hedge_budget": 1.0,
+        **kwargs,
+    }
+
+
+def warm_up(config: dict, kind: str):
+    for _ in range(hedge.MIN_SAMPLES):
+        hedge.hedged_call(config, kind, lambda i: None)
+
+
+def test_should_hedge_respects_max_size():
+    config = make_config(hedge_max_size=100)
+    assert hedge.should_hedge(config)
+    assert hedge.should_hedge(config, 100)
+    assert not hedge.should_hedge(config, 101)
+    assert not hedge.should_hedge({"hedge_enabled": False}, 1)
+
+
+def test_slow_small_request_is_hedged():
+    config = make_config(hedge_max_size=100)
+    warm_up(config, "get")
+    release = threading.Event()
+
+    def attempt(i: int):
+        if i == 0:
+            release.wait(5)
+        return i
+
+    assert hedge.hedged_call(config, "get", attempt, size=10) == (1, 1)
+    release.set()
+
+
+def test_slow_large_request_is_not_hedged():
+    config = make_config(hedge_max_size=100)
+    warm_up(config, "get")
+    attempts = []
+
+    def attempt(i: int):
+        attempts.append(i)
+        time.sleep(0.05)
+        return i
+
+    assert hedge.hedged_call(config, "get", attempt, size=1000) == (0, 0)
+    assert attempts == [0]
@@ -0,0 +1,81 @@
+"""
+Tests of operations of backend on cached objects.
+"""
+
+import errno
+import io
+import sys
+
+import pytest
+
+pytest.importorskip("minio")
+
+import implementations
+
+
+def make_state(client, path: str, **kwargs) -> dict:
+    config = {
+        "minio_host": "fake",
+        "minio_bucket": "bucket",
+        "minio_client": client,
+        **kwargs,
+    }
+    return implementations.new_file_state(config, path)
+
+
+def getattr_result(state: dict) -> bytes:
+    out = io.BytesIO()
+    implementations.do_getattr(state, out)
+    return out.getvalue()
+
+
+def test_getattr_of_missing_object(fake_minio):
+    state = make_state(fake_minio, "/missing")
+    result = getattr_result(state)
+    assert int.from_bytes(result, sys.byteorder, signed=True) == -errno.ENOENT
+    implementations.remove_file_state(state)
+
+
+def test_getattr_never_downloads_gzip_of_unknown_size(fake_minio):
+    fake_minio.add("d/f.gz", b"\x1f\x8b" + b"\0" * 12)
+    state = make_state(fake_minio, "/d/f.gz", decompress_prefixes=["/d/"])
+    result = getattr_result(state)
+    assert int.from_bytes(result, sys.byteorder, signed=True) == -errno.EOPNOTSUPP
+    assert all(length for _, _, length, _ in fake_minio.gets)
+    assert state["file"] is None
+    implementations.remove_file_state(state)
+
+
+def test_getattr_after_create_with_streaming_upload(fake_minio):
+    state = make_state(
+        fake_minio, "/new", streaming_upload=True, upload_part_size=5 * 2**20
+    )
+    f = implementations.get_file(state)
+    f.create()
+    result = getattr_result(state)
+    assert int.from_bytes(result[:4], sys.byteorder) == 0
+    assert int.from_bytes(result[-8:], sys.byteorder) == 0
+
+    f.write(b"data", 0)
+    result = getattr_result(state)
+    assert int.from_bytes(result[-8:], sys.byteorder) == 4
+    f.flush()
+    assert fake_minio.get_data("new") == b"data"
+    implementations.remove_file_state(state)
+
+
+def test_mkdir_and_rmdir(fake_minio):
+    state = make_state(fake_minio, "/d")
+    out = io.BytesIO()
+    implementations.do_mkdir(state, out)
+    assert fake_minio.get_data("d/") == b""
+    fake_minio.add("d/f")
+    implementations.do_mkdir(state, out)
+    implementations.do_rmdir(state, out)
+    fake_minio.remove_object("bucket", "d/f")
+    implementations.do_rmdir(state, out)
+    implementations.do_rmdir(state, out)
+    codes = [int.from_bytes([b], sys.byteorder, signed=True) for b in out.getvalue()]
+    assert codes == [0, -errno.EEXIST, -errno.ENOTEMPTY, 0, -errno.ENOENT]
+    assert ("bucket", "d/") not in fake_minio.objects
+    implementations.remove_file_state(state)
@@ -0,0 +1,91 @@
+"""
+Tests of invalidation events, from event sources and from diffs of listings.
+"""
+
+import itertools
+
+import invalidation
+from invalidation import FakeEventSource, Invalidator, reconnecting_events
+
+
+def meta(path: str, etag: str, size: int = 1) -> dict:
+    return {"minio_path": path, "size": size, "mtime": 0.0, "etag": etag, "mode": 0}
+
+
+def fail_listing():
+    raise OSError("connection refused")
+
+
+def test_invalidator_applies_fake_events():
+    source = FakeEventSource()
+    seen = []
+    invalidator = Invalidator()
+    invalidator.add_handler(seen.append)
+    source.push("/a", "created", meta("/a", "1"))
+    source.push("/a", "removed")
+    source.close()
+    invalidator.run(source.events())
+    assert [(e["path"], e["kind"]) for e in seen] == [
+        ("/a", "created"),
+        ("/a", "removed"),
+    ]
+    assert invalidator.num_events == 2
+
+
+def test_diff_events():
+    previous = {"/a": meta("/a", "1"), "/b": meta("/b", "2"), "/c": meta("/c", "3")}
+    current = {"/a": meta("/a", "1"), "/b": meta("/b", "9"), "/d": meta("/d", "4")}
+    events = {
+        (e["path"], e["kind"]) for e in invalidation.diff_events(previous, current)
+    }
+    assert events == {("/b", "created"), ("/d", "created"), ("/c", "removed")}
+
+
+def test_reconnect_resyncs_after_failure(monkeypatch):
+    monkeypatch.setattr(invalidation.time, "sleep", lambda s: None)
+    sources = [FakeEventSource(), FakeEventSource()]
+    sources[0].push("/a", "created", meta("/a", "1"))
+    sources[0].fail(OSError("connection reset"))
+    sources[1].push("/b", "created", meta("/b", "2"))
+    connects = iter(sources)
+    num_resync = []
+
+    def resync():
+        num_resync.append(1)
+        yield invalidation.make_event("/c", "removed")
+
+    events = reconnecting_events(lambda: next(connects).events(), resync, 0.0)
+    got = [(e["path"], e["kind"]) for e in itertools.islice(events, 3)]
+    assert got == [("/a", "created"), ("/c", "removed"), ("/b", "created")]
+    assert len(num_resync) == 1
+
+
+def test_reconnect_backs_off(monkeypatch):
+    delays = []
+    monkeypatch.setattr(invalidation.time, "sleep", delays.append)
+    source = FakeEventSource()
+    source.push("/a", "created", meta("/a", "1"))
+
+    def connect():
+        if len(delays) < 3:
+            raise OSError("connection refused")
+        return source.events()
+
+    events = reconnecting_events(connect, lambda: iter(()), 1.0)
+    assert next(events)["path"] == "/a"
+    assert delays == [1.0, 2.0, 4.0]
+
+
+def test_listing_diff_retries_and_keeps_baseline(fake_minio, monkeypatch):
+    monkeypatch.setattr(invalidation.time, "sleep", lambda s: None)
+    fake_minio.add("a", b"1")
+    fake_minio.add("b", b"2")
+
+    def replace_b():
+        fake_minio.remove_object("bucket", "b")
+        fake_minio.add("c", b"3")
+
+    fake_minio.before_list = iter([lambda: None, fail_listing, replace_b])
+    events = invalidation.listing_diff_events(fake_minio, "bucket", "", 1.0)
+    got = {(e["path"], e["kind"]) for e in itertools.islice(events, 2)}
+    assert got == {("/c", "created"), ("/b", "removed")}
@@ -0,0 +1,143 @@
+"""
+Tests of memory chunk store, files read through it and streaming uploads
+bounded in memory.
+"""
+
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+import memory_store
+from memory_store import ChunkStore, MemoryFile
+from streaming_upload import StreamingUpload, upload_memory
+
+
+def test_chunks_bounded_by_budget():
+    store = ChunkStore(8, 4)
+    for i in range(5):
+        store.put(("key", "etag"), i, bytes([i]) * 4)
+    assert store.slabs.num_allocated == 2
+    assert store.get(("key", "etag"), 0) is None
+    assert bytes(store.get(("key", "etag"), 4)) == b"\4" * 4
+
+
+def test_reserve_evicts_chunks_and_keeps_one_slab():
+    store = ChunkStore(16, 4)
+    for i in range(4):
+        store.put(("key", "etag"), i, b"data")
+    assert store.reserve(6)
+    assert store.slabs.num_allocated == 2
+    assert len(store.chunks) == 2
+    assert store.get(("key", "etag"), 3) is not None
+
+    # Last slab is kept for reads.
+    assert not store.reserve(8)
+    store.put(("key", "etag"), 4, b"data")
+    assert store.slabs.num_allocated == 2
+
+    store.unreserve(6)
+    assert store.reserve(8)
+
+
+def test_memory_file_reads_by_chunk(fake_minio):
+    fake_minio.add("key", b"0123456789")
+    store = ChunkStore(1024, 4)
+    f = MemoryFile(store, fake_minio, "bucket", "key")
+    f.seek(3)
+    assert f.read(5) == b"34567"
+    assert [offset for _, offset, _, _ in fake_minio.gets] == [0, 4]
+    etag = hashlib.md5(b"0123456789").hexdigest()
+    assert fake_minio.gets[0][3] == {"If-Match": etag}
+
+    f.seek(0)
+    assert f.read() == b"0123456789"
+    assert len(fake_minio.gets) == 3
+
+
+def test_streaming_upload_bounded_in_bytes(fake_minio):
+    upload = StreamingUpload(fake_minio, "bucket", "key", 5, max_buffered=8)
+    assert upload.stream.max_buffered == 8
+    for i in range(10):
+        assert upload.write(b"abcd", 4 * i)
+        assert upload.stream.buffered <= 8
+    assert not upload.write(b"abcd", 0)
+    upload.finish()
+    assert fake_minio.get_data("key") == b"abcd" * 10
+    assert upload_memory(5, 8) == 13
+
+
+def memory_only_state(client, budget: int) -> dict:
+    implementations = pytest.importorskip("implementations")
+    config = {
+        "minio_host": "fake",
+        "minio_bucket": "bucket",
+        "minio_client": client,
+        "memory_only": True,
+        "memory_cache_budget": budget,
+        "memory_chunk_size": 1024,
+        "upload_part_size": 2048,
+    }
+    state = implementations.new_file_state(config, "/key")
+    assert state["temp_dir"] is None
+    return state
+
+
+def memory_only_object(client, budget: int):
+    implementations = pytest.importorskip("implementations")
+    return implementations.get_file(memory_only_state(client, budget))
+
+
+def test_memory_only_upload_counts_against_budget(fake_minio, monkeypatch):
+    pytest.importorskip("minio")
+    monkeypatch.setattr(memory_store, "chunk_store", None)
+
+    client = fake_minio
+    budget = 2 * upload_memory(2048)
+    first = memory_only_object(client, budget)
+    second = memory_only_object(client, budget)
+    store = memory_store.get_chunk_store(budget, 1024)
+
+    first.create()
+    first.write(b"data", 0)
+    with pytest.raises(OSError):
+        second.create()
+
+    first.flush()
+    assert client.get_data("key") == b"data"
+    assert store.slabs.num_reserved == 0
+    second.create()
+    second.close()
+    assert store.slabs.num_reserved == 0
+
+
+def test_memory_only_never_uses_disk(fake_minio, tmp_path, monkeypatch):
+    pytest.importorskip("minio")
+    monkeypatch.setattr(memory_store, "chunk_store", None)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    fake_minio.add("key", b"contents")
+    f = memory_only_object(fake_minio, 1024 * 1024)
+    f.flush()
+    assert f.read(4, 2) == b"nten"
+    with pytest.raises(OSError):
+        f.write(b"data", 0)
+    assert f.temp_path is None
+    assert not os.listdir(tmp_path)
+
+
+def test_memory_only_getattr_after_create(fake_minio, monkeypatch):
+    implementations = pytest.importorskip("implementations")
+    monkeypatch.setattr(memory_store, "chunk_store", None)
+    state = memory_only_state(fake_minio, 2 * upload_memory(2048))
+    f = implementations.get_file(state)
+    f.create()
+    f.write(b"data", 0)
+    out = io.BytesIO()
+    implementations.do_getattr(state, out)
+    assert int.from_bytes(out.getvalue()[:4], sys.byteorder) == 0
+    assert int.from_bytes(out.getvalue()[-8:], sys.byteorder) == 4
+    f.flush()
+    assert fake_minio.get_data("key") == b"data"
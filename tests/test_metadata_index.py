@@ -0,0 +1,64 @@
+"""
+Tests of persistent metadata index and its revalidation.
+"""
+
+import threading
+
+from metadata_index import MetadataIndex, revalidate_index, write_index
+
+
+def make_entries(n: int) -> list:
+    return [
+        {"minio_path": f"/d/f{i:04d}", "size": i, "mtime": 1.0, "etag": f"{i:032x}"}
+        for i in range(n)
+    ]
+
+
+def test_lookup_and_list_prefix(tmp_path):
+    path = str(tmp_path / "index")
+    write_index(path, make_entries(10))
+    index = MetadataIndex(path)
+    assert len(index) == 10
+    assert index.lookup("/d/f0003")["size"] == 3
+    assert index.lookup("/d/missing") is None
+    assert [m["size"] for m in index.list_prefix("/d/f000")] == list(range(10))
+
+
+def test_list_dir(tmp_path):
+    path = str(tmp_path / "index")
+    entries = make_entries(3) + [
+        {"minio_path": p, "size": 1, "mtime": 1.0, "etag": "ab" * 16}
+        for p in ("/d/sub/a", "/d/sub/deep/b", "/d.txt", "/d/z")
+    ]
+    write_index(path, entries)
+    index = MetadataIndex(path)
+    names, dir_names, sizes = index.list_dir("/d")
+    assert names == ["f0000", "f0001", "f0002", "z"]
+    assert dir_names == ["sub"]
+    assert sizes["f0002"] == 2
+    assert index.list_dir("/") == (["d.txt"], ["d"], {"d.txt": 1})
+
+
+def test_revalidate_parallel_reports_changes(tmp_path):
+    path = str(tmp_path / "index")
+    write_index(path, make_entries(100))
+    index = MetadataIndex(path)
+    seen = {}
+    lock = threading.Lock()
+    threads = set()
+
+    def stat_object(p: str) -> dict | None:
+        threads.add(threading.get_ident())
+        i = int(p[-4:])
+        if i % 10 == 0:
+            return None
+        return {"minio_path": p, "size": i, "mtime": 1.0, "etag": f"{i:032x}"}
+
+    def on_result(p: str, m: dict | None):
+        with lock:
+            seen[p] = m
+
+    revalidate_index(index, stat_object, on_result, num_threads=4)
+    assert len(seen) == 100
+    assert sum(m is None for m in seen.values()) == 10
+    assert len(threads) > 1
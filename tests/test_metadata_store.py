@@ -0,0 +1,60 @@
+"""
+Tests of columnar metadata store.
+"""
+
+import threading
+
+from metadata_store import MetadataStore
+
+
+def metadata(path: str, size: int) -> dict:
+    return {"minio_path": path, "size": size, "mtime": 2.5, "etag": "ab" * 16}
+
+
+def test_set_get_remove_reuses_rows():
+    store = MetadataStore()
+    store.set("/d/a", metadata("/d/a", 1))
+    store.set("/d/b", metadata("/d/b", 2))
+    assert store.get("/d/a")["size"] == 1
+    assert store.get("/d/b")["etag"] == "ab" * 16
+    store.remove("/d/a")
+    assert "/d/a" not in store
+    store.set("/d/c", metadata("/d/c", 3))
+    assert len(store.sizes) == 2
+    assert sorted(p for p, m in store.items() if m is not None) == ["/d/b", "/d/c"]
+
+
+def test_removal_kept_as_tombstone():
+    store = MetadataStore()
+    store.set("/d/a", metadata("/d/a", 1))
+    store.remove("/d/a")
+    store.remove("/d/b")
+    assert store.get("/d/a") is None
+    assert store.is_removed("/d/a")
+    assert sorted(store.items()) == [("/d/a", None), ("/d/b", None)]
+    store.set("/d/a", metadata("/d/a", 2))
+    assert not store.is_removed("/d/a")
+    assert store.get("/d/a")["size"] == 2
+    assert sorted(p for p, m in store.items() if m is None) == ["/d/b"]
+
+
+def test_items_while_changing():
+    store = MetadataStore()
+    stop = threading.Event()
+
+    def mutate():
+        i = 0
+        while not stop.is_set():
+            store.set(f"/d/f{i % 500}", metadata(f"/d/f{i % 500}", i))
+            store.remove(f"/d/f{(i * 7) % 500}")
+            i += 1
+
+    t = threading.Thread(target=mutate)
+    t.start()
+    try:
+        for _ in range(200):
+            for path, m in store.items():
+                assert m is None or m["minio_path"] == path
+    finally:
+        stop.set()
+        t.join()
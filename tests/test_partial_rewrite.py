@@ -0,0 +1,69 @@
+"""
+Tests of rewriting parts of large objects by composing unmodified ranges with
+uploaded modified parts.
+"""
+
+import pytest
+
+pytest.importorskip("minio")
+
+from metadata_index import is_hidden_key
+from partial_rewrite import (
+    MIN_PART_SIZE,
+    RangeSet,
+    compose_rewrite,
+    plan_parts,
+    remove_stale_parts,
+)
+
+
+def test_range_set():
+    r = RangeSet()
+    r.add(10, 20)
+    r.add(30, 40)
+    r.add(20, 30)
+    assert r.ranges == [(10, 40)]
+    assert r.missing(0, 50) == [(0, 10), (40, 50)]
+    r.truncate(15)
+    assert r.ranges == [(10, 15)]
+
+
+def test_plan_parts_merges_unmodified():
+    dirty = RangeSet()
+    dirty.add(25, 26)
+    parts = plan_parts(50, 40, dirty, 10)
+    assert parts == [(0, 20, False), (20, 30, True), (30, 40, False), (40, 50, True)]
+
+
+def test_parts_staged_in_staging_bucket_under_hidden_prefix(fake_minio):
+    client = fake_minio
+    dirty = RangeSet()
+    dirty.add(0, 1)
+    size = 2 * MIN_PART_SIZE
+    compose_rewrite(
+        client,
+        "data",
+        "big.bin",
+        "etag",
+        size,
+        size,
+        dirty,
+        lambda start, end: b"x" * (end - start),
+        MIN_PART_SIZE,
+        "staging",
+    )
+    assert len(client.puts) == 1
+    bucket, key = client.puts[0]
+    assert bucket == "staging"
+    assert is_hidden_key(key)
+    assert client.removed == client.puts
+    _, _, sources = client.composed
+    assert [s.bucket_name for s in sources] == ["staging", "data"]
+
+
+def test_remove_stale_parts_keeps_recent_parts(fake_minio):
+    fake_minio.add(".mc-rewrite/old/0", age=7200)
+    fake_minio.add(".mc-rewrite/new/0", age=10)
+    fake_minio.add("data/file", age=7200)
+    remove_stale_parts(fake_minio, "bucket", 3600)
+    assert fake_minio.removed == [("bucket", ".mc-rewrite/old/0")]
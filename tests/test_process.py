@@ -0,0 +1,85 @@
+"""
+Tests of operations done by process of path on requests from FUSE.
+"""
+
+import errno
+import socket
+import sys
+
+import pytest
+
+pytest.importorskip("minio")
+
+from process import handle_request
+from implementations import new_file_state, remove_file_state
+
+
+@pytest.fixture
+def state(fake_minio):
+    config = {
+        "minio_host": "fake",
+        "minio_bucket": "bucket",
+        "minio_client": fake_minio,
+    }
+    state = {
+        **new_file_state(config, "/f"),
+        "path": "/f",
+        "metadata": None,
+        "stale": False,
+    }
+    yield state
+    remove_file_state(state)
+
+
+def request(state: dict, action: str, fields: bytes = b"", extra=None) -> bytes:
+    """
+    Send request fields after header to process, and get its response.
+    """
+    ours, theirs = socket.socketpair()
+    ours.sendall(fields)
+    handle_request(action, state["path"], extra or {}, theirs, state)
+    theirs.close()
+    response = b""
+    while chunk := ours.recv(4096):
+        response += chunk
+    ours.close()
+    return response
+
+
+def uint64(*values: int) -> bytes:
+    return b"".join(v.to_bytes(8, sys.byteorder) for v in values)
+
+
+def as_int(response: bytes, size: int = 4) -> int:
+    return int.from_bytes(response[:size], sys.byteorder, signed=True)
+
+
+def test_write_getattr_release_read(fake_minio, state):
+    assert as_int(request(state, "C", (0o644).to_bytes(4, sys.byteorder))) == 0
+    assert as_int(request(state, "W", uint64(5, 0) + b"hello")) == 5
+    # Size of file written so far, before it is on MinIO.
+    response = request(state, "G")
+    assert as_int(response) == 0
+    assert as_int(response[-8:], 8) == 5
+
+    assert as_int(request(state, "X")) == 0
+    assert fake_minio.get_data("f") == b"hello"
+    response = request(state, "R", uint64(3, 1))
+    assert as_int(response, 8) == 3
+    assert response[8:] == b"ell"
+
+
+def test_missing_object(state):
+    assert as_int(request(state, "G")) == -errno.ENOENT
+    assert as_int(request(state, "R", uint64(3, 0)), 8) == -errno.ENOENT
+
+
+def test_rename_and_chmod(fake_minio, state):
+    fake_minio.add("f", b"data")
+    assert as_int(request(state, "M", (0o600).to_bytes(4, sys.byteorder))) == 0
+    response = request(state, "G")
+    assert as_int(response[-20:-16]) == 0o100600
+
+    assert as_int(request(state, "N", extra={"dest_path": "/g"})) == 0
+    assert fake_minio.get_data("g") == b"data"
+    assert ("bucket", "f") not in fake_minio.objects
@@ -0,0 +1,118 @@
+"""
+Tests of sharded object registry and exit of idle path processes.
+"""
+
+import queue
+import threading
+
+import pytest
+
+pytest.importorskip("minio")
+
+from process import get_next_request
+from registry import ObjectRegistry
+
+
+def test_get_set_pop():
+    registry = ObjectRegistry(num_shards=4)
+    registry.set("/a", {"metadata": 1})
+    assert registry.get("/a") == {"metadata": 1}
+    assert "/a" in registry
+    assert registry.setdefault("/a", {"metadata": 2}) == {"metadata": 1}
+    assert registry.pop("/a") == {"metadata": 1}
+    assert registry.get("/a") is None
+    assert len(registry) == 0
+
+
+def test_update_entry_removes_on_none():
+    registry = ObjectRegistry(num_shards=4)
+    registry.update_entry("/a", lambda e: {"n": 1})
+    assert registry.update_entry("/a", lambda e: {"n": e["n"] + 1}) == {"n": 2}
+    registry.update_entry("/a", lambda e: None)
+    assert "/a" not in registry
+
+
+def test_update_entry_atomic():
+    registry = ObjectRegistry(num_shards=4)
+
+    def add(entry):
+        return {"n": (entry or {"n": 0})["n"] + 1}
+
+    def run():
+        for _ in range(1000):
+            registry.update_entry("/a", add)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert registry.get("/a") == {"n": 8000}
+
+
+def test_items_across_shards():
+    registry = ObjectRegistry(num_shards=8)
+    for i in range(100):
+        registry.set(f"/f{i}", i)
+    assert sorted(v for _, v in registry.items()) == list(range(100))
+
+
+def idle_state() -> dict:
+    return {
+        "path": "/a",
+        "metadata": None,
+        "stale": False,
+        "num_received": 0,
+        "idle": False,
+        "file": None,
+    }
+
+
+def test_idle_process_exits_only_when_told():
+    queue_in = queue.Queue()
+    queue_idle = queue.Queue()
+    state = idle_state()
+    queue_in.put({"num_request": 1, "action": "R", "extra": {}, "conn": object()})
+    msg = get_next_request(queue_in, queue_idle, 0.01, state)
+    assert msg["num_request"] == 1
+    assert state["num_received"] == 1
+
+    def server():
+        # Request sent before idle notice was handled, so no exit yet.
+        path, _, num_received = queue_idle.get()
+        assert (path, num_received) == ("/a", 1)
+        queue_in.put({"num_request": 2, "action": "R", "extra": {}, "conn": object()})
+
+    t = threading.Thread(target=server)
+    t.start()
+    msg = get_next_request(queue_in, queue_idle, 0.01, state)
+    t.join()
+    assert msg["num_request"] == 2
+
+    def server_exit():
+        _, _, num_received = queue_idle.get()
+        assert num_received == 2
+        queue_in.put({"num_request": -1, "action": "exit", "extra": {}, "conn": None})
+
+    t = threading.Thread(target=server_exit)
+    t.start()
+    assert get_next_request(queue_in, queue_idle, 0.01, state) is None
+    t.join()
+
+
+def test_invalidation_counted_as_received():
+    queue_in = queue.Queue()
+    state = idle_state()
+    queue_in.put(
+        {
+            "num_request": -1,
+            "action": "invalidate",
+            "extra": {"metadata": None},
+            "conn": None,
+        }
+    )
+    queue_in.put({"num_request": 3, "action": "R", "extra": {}, "conn": object()})
+    msg = get_next_request(queue_in, queue.Queue(), 0.01, state)
+    assert msg["num_request"] == 3
+    assert state["stale"]
+    assert state["num_received"] == 2
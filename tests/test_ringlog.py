@@ -0,0 +1,53 @@
+"""
+Tests of binary log ring buffer.
+"""
+
+import io
+
+import ringlog
+
+MSG_TEST = ringlog.register("Value {} on {} of {}.")
+
+
+def test_records_formatted_oldest_first():
+    ring = ringlog.RingLog(4)
+    for i in range(6):
+        ring.log(ringlog.INFO, MSG_TEST, i, f"path{i}", "x")
+    lines = list(ring.records())
+    assert len(lines) == 4
+    assert lines[0].endswith("INFO Value 2 on path2 of x.")
+    assert lines[-1].endswith("INFO Value 5 on path5 of x.")
+
+
+def test_string_memory_bounded_by_ring_size():
+    ring = ringlog.RingLog(8)
+    for i in range(1000):
+        ring.log(ringlog.DEBUG, MSG_TEST, i, f"unique-{i}", "y")
+    assert len(ring.strings) == 8
+    kept = {s[1] for s in ring.strings}
+    assert kept == {f"unique-{i}" for i in range(992, 1000)}
+
+
+def test_clear_and_dump():
+    ring = ringlog.RingLog(4)
+    ring.log(ringlog.ERROR, MSG_TEST, 1, "a", "b")
+    out = io.StringIO()
+    ring.dump(out)
+    assert "ERROR Value 1 on a of b." in out.getvalue()
+    ring.clear()
+    assert not list(ring.records())
+
+
+def test_dump_only_new_records():
+    ring = ringlog.RingLog(8)
+    ring.log(ringlog.INFO, MSG_TEST, 1, "a", "b")
+    out = io.StringIO()
+    ring.dump(out, only_new=True)
+    ring.log(ringlog.ERROR, MSG_TEST, 2, "c", "d")
+    out = io.StringIO()
+    ring.dump(out, only_new=True)
+    assert "Value 2" in out.getvalue()
+    assert "Value 1" not in out.getvalue()
+    out = io.StringIO()
+    ring.dump(out)
+    assert "Value 1" in out.getvalue()
@@ -0,0 +1,48 @@
+"""
+Tests of sending file ranges to response pipe.
+"""
+
+import errno
+import os
+
+import pytest
+
+pytest.importorskip("minio")
+
+import implementations  # pylint: disable=wrong-import-position
+
+
+def read_response(fd: int) -> tuple:
+    data = b""
+    while chunk := os.read(fd, 65536):
+        data += chunk
+    return data[0], int.from_bytes(data[1:9], "little"), data[9:]
+
+
+def test_send_range(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(bytes(range(256)) * 4)
+    r, w = os.pipe()
+    with open(path, "rb") as f, os.fdopen(w, "wb") as pipe_response:
+        assert implementations.send_file_range(pipe_response, f, 10, 100) == 100
+    status, length, data = read_response(r)
+    assert (status, length) == (0, 100)
+    assert data == (bytes(range(256)) * 4)[10:110]
+
+
+def test_error_after_status_ends_response_early(tmp_path, monkeypatch):
+    path = tmp_path / "f"
+    path.write_bytes(b"x" * 1000)
+
+    def failing_sendfile(out_fd, in_fd, offset, count):
+        if offset > 0:
+            raise OSError(errno.EIO, "Read failed.")
+        return os.write(out_fd, b"x" * 10)
+
+    monkeypatch.setattr(implementations.os, "sendfile", failing_sendfile)
+    r, w = os.pipe()
+    with open(path, "rb") as f, os.fdopen(w, "wb") as pipe_response:
+        assert implementations.send_file_range(pipe_response, f, 0, 1000) == 10
+    status, length, data = read_response(r)
+    assert (status, length) == (0, 1000)
+    assert len(data) == 10
@@ -0,0 +1,96 @@
+"""
+Tests of cache shared between processes through Unix socket.
+"""
+
+import hashlib
+import os
+import stat
+import threading
+
+import pytest
+
+pytest.importorskip("minio")
+
+import shared_cache
+from shared_cache import DiskBudget, SharedCache, SharedCacheClient, SharedCacheServer
+
+
+def test_remove_cache_files_keeps_other_files(tmp_path):
+    cache_file = tmp_path / ("a" * 64)
+    part_file = tmp_path / ("b" * 64 + ".part")
+    other_file = tmp_path / "notes.txt"
+    other_dir = tmp_path / ("c" * 64)
+    for f in (cache_file, part_file, other_file):
+        f.write_text("x")
+    other_dir.mkdir()
+    shared_cache.remove_cache_files(str(tmp_path))
+    assert not cache_file.exists()
+    assert not part_file.exists()
+    assert other_file.exists()
+    assert other_dir.is_dir()
+
+
+def test_same_key_in_different_buckets(fake_minio, tmp_path):
+    fake_minio.add("k", b"one", bucket="b1")
+    fake_minio.add("k", b"two", bucket="b2")
+    cache = SharedCache(fake_minio, DiskBudget(str(tmp_path), 1024), 60.0)
+    fd1, _ = cache.get_object("b1", "k")
+    fd2, _ = cache.get_object("b2", "k")
+    with open(fd1, "rb") as f1, open(fd2, "rb") as f2:
+        assert (f1.read(), f2.read()) == (b"one", b"two")
+    assert len(os.listdir(tmp_path)) == 2
+
+    cache.invalidate("b1", "k")
+    assert len(os.listdir(tmp_path)) == 1
+    fd2, _ = cache.get_object("b2", "k")
+    os.close(fd2)
+    assert len(fake_minio.gets) == 2
+
+
+def run_server(client, tmp_path, allowed_uids: set) -> tuple:
+    socket_path = str(tmp_path / "cache.socket")
+    server = SharedCacheServer(socket_path, 0o600, allowed_uids)
+    client.add("k", b"data", bucket="b")
+    server.cache = SharedCache(client, DiskBudget(str(tmp_path), 1024), 60.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, socket_path
+
+
+def test_socket_only_accessible_by_owner(fake_minio, tmp_path):
+    server, socket_path = run_server(fake_minio, tmp_path, {os.getuid()})
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        client = SharedCacheClient(socket_path, "b")
+        f, metadata = client.open_object("k")
+        assert f.read() == b"data"
+        assert metadata["etag"] == hashlib.md5(b"data").hexdigest()
+        f.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_connection_from_other_user_rejected(fake_minio, tmp_path):
+    server, socket_path = run_server(fake_minio, tmp_path, {os.getuid() + 1})
+    try:
+        client = SharedCacheClient(socket_path, "b")
+        with pytest.raises(OSError):
+            client.stat("k")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_evicted_entry_is_fetched_again(fake_minio, tmp_path):
+    fake_minio.add("a", b"12345")
+    fake_minio.add("b", b"67890")
+    disk = DiskBudget(str(tmp_path), 5)
+    cache = SharedCache(fake_minio, disk, 60.0)
+    fd, _ = cache.get_object("bucket", "a")
+    os.close(fd)
+    # Adding other entry evicts first one, which is then fetched again.
+    fd, _ = cache.get_object("bucket", "b")
+    os.close(fd)
+    fd, _ = cache.get_object("bucket", "a")
+    with open(fd, "rb") as f:
+        assert f.read() == b"12345"
@@ -0,0 +1,40 @@
+"""
+Tests of in-memory cache of small files.
+"""
+
+from small_files import SmallFileCache
+
+
+def test_budget_evicts_least_recently_used():
+    cache = SmallFileCache(10)
+    cache.put("/a", b"12345")
+    cache.put("/b", b"12345")
+    assert cache.open("/a")
+    assert cache.release("/a")
+    cache.put("/c", b"12345")
+    assert "/a" in cache
+    assert "/b" not in cache
+    assert cache.total == 10
+
+
+def test_open_file_survives_eviction():
+    cache = SmallFileCache(5)
+    cache.put("/a", b"12345")
+    assert cache.open("/a")
+    cache.put("/b", b"12345")
+    assert "/a" not in cache
+    assert cache.read_open("/a") == b"12345"
+    assert cache.release("/a")
+    assert cache.read_open("/a") is None
+
+
+def test_close_all_sends_open_handles_elsewhere():
+    cache = SmallFileCache(100)
+    cache.put("/a", b"data")
+    assert cache.open("/a")
+    assert cache.open("/a")
+    cache.drop("/a")
+    cache.close_all("/a")
+    assert cache.read_open("/a") is None
+    assert not cache.release("/a")
+    assert not cache.open("/a")
@@ -0,0 +1,30 @@
+"""
+Tests of read-only snapshots of metadata index and directory tree.
+"""
+
+from dir_tree import DirTree
+from metadata_index import MetadataIndex, write_index
+from snapshot import Snapshot
+
+
+def meta(path: str, size: int) -> dict:
+    return {"minio_path": path, "size": size, "mtime": 1.0, "etag": "ab" * 16}
+
+
+def test_snapshot_from_index(tmp_path):
+    index_path = str(tmp_path / "index")
+    write_index(
+        index_path,
+        [meta("/data/a", 1), meta("/data/sub/b", 2), meta("/other/c", 4)],
+    )
+    tree = DirTree()
+    snapshot = Snapshot("data")
+    assert snapshot.load_index(MetadataIndex(index_path), tree)
+    assert snapshot.lookup("/data/sub/b")["etag"] == "ab" * 16
+    assert snapshot.lookup("/other/c") is None
+    assert tree.list_dir("/data") == ["a", "sub"]
+    assert tree.usage("/data").bytes == 3
+
+
+def test_snapshot_without_index():
+    assert not Snapshot("data").load_index(MetadataIndex(None), DirTree())
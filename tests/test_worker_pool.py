@@ -0,0 +1,126 @@
+"""
+Tests of pool of workers handling requests by path.
+"""
+
+import errno
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("minio")
+
+from metadata_store import MetadataStore
+from worker_pool import HashRing, WorkerPool
+
+
+def make_config() -> dict:
+    return {
+        "minio_host": "localhost:9000",
+        "minio_access_key": "access",
+        "minio_secret_key": "secret",
+        "minio_bucket": "bucket",
+        "timeout_closed": 60.0,
+        "pool_max_outstanding": 2,
+    }
+
+
+def wait_until(condition, timeout: float = 10.0):
+    end_time = time.time() + timeout
+    while not condition():
+        assert time.time() < end_time, "timed out"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pool():
+    p = WorkerPool(make_config(), 2)
+    yield p
+    for process in p.processes:
+        process.kill()
+
+
+def test_hash_ring_candidates_are_all_workers():
+    ring = HashRing(4)
+    for key in ("/a", "/b/c", "/d"):
+        candidates = ring.candidates(key)
+        assert sorted(candidates) == [0, 1, 2, 3]
+        assert ring.candidates(key) == candidates
+
+
+def test_assign_avoids_overloaded_owner(pool):
+    owner = pool.ring.candidates("/x")[0]
+    pool.outstanding[owner] = pool.max_outstanding
+    w = pool.assign("/x")
+    assert w != owner
+    assert pool.assign("/x") == w
+
+
+def test_failed_request_is_done_and_worker_survives(pool, tmp_path):
+    request = {
+        "operation": "read",
+        "pipe_in": str(tmp_path / "missing_in"),
+        "pipe_out": str(tmp_path / "missing_out"),
+        "trace_id": 0,
+        "queued_ns": 0,
+    }
+    pool.submit("/x", request)
+    w = pool.assigned["/x"]
+    store = MetadataStore()
+    wait_until(lambda: pool.poll(store) or pool.outstanding[w] == 0)
+    assert pool.processes[w].is_alive()
+    wait_until(lambda: pool.poll(store) or "/x" not in pool.assigned)
+
+
+def test_dead_worker_is_restarted(pool):
+    pool.assign("/x")
+    w = pool.assigned["/x"]
+    old = pool.processes[w]
+    old.kill()
+    old.join()
+    pool.outstanding[w] = 3
+    pool.poll(MetadataStore())
+    assert pool.processes[w] is not old
+    assert pool.processes[w].is_alive()
+    assert "/x" not in pool.assigned
+    assert pool.outstanding[w] == 0
+
+
+def test_release_kept_while_requests_queued(pool):
+    w = pool.assign("/x")
+    pool.path_outstanding["/x"] = 1
+    pool.queue_out.put({"minio_path": "/x", "worker": w, "released": True})
+    # Metadata message sent after, to know when release was handled.
+    marker = {"minio_path": "/m", "size": 0, "mtime": 0.0, "etag": None}
+    pool.queue_out.put({"minio_path": "/m", "worker": w, "metadata_cur": marker})
+    store = MetadataStore()
+    wait_until(lambda: pool.poll(store) or "/m" in store)
+    assert pool.assigned["/x"] == w
+
+
+def test_request_of_dead_worker_gets_error(pool, tmp_path):
+    pipe_in = str(tmp_path / "in")
+    pipe_out = str(tmp_path / "out")
+    os.mkfifo(pipe_in)
+    os.mkfifo(pipe_out)
+    request = {
+        "operation": "getattr",
+        "pipe_in": pipe_in,
+        "pipe_out": pipe_out,
+        "trace_id": 0,
+        "queued_ns": 0,
+    }
+    pool.submit("/x", request)
+    w = pool.assigned["/x"]
+    # Worker waits for pipes of request to be opened.
+    wait_until(lambda: pool.queues_in[w].empty())
+    time.sleep(0.2)
+    pool.processes[w].kill()
+    pool.processes[w].join()
+    pool.poll(MetadataStore())
+    assert "/x" not in pool.assigned
+
+    with open(pipe_in, "wb"), open(pipe_out, "rb") as f:
+        code = int.from_bytes(f.read(1), sys.byteorder, signed=True)
+    assert code == -errno.EIO
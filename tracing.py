@@ -0,0 +1,114 @@
+"""
+Tracing of requests across the FUSE process, server and worker processes.
+Each request has a trace ID assigned in file_sys.c and sent with the request.
+Spans of sampled requests are written in Chrome trace-event JSON format, one
+file per process, which can be opened directly in Perfetto or chrome://tracing.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Directory to write traces to, tracing disabled if not set.
+TRACE_DIR = os.getenv("trace_dir")
+
+# Fraction of requests to trace.
+SAMPLE_RATE = float(os.getenv("trace_sample_rate", "0.01"))
+
+# Multiplier for hashing trace IDs (64-bit golden ratio).
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+class TraceWriter:
+    """
+    Appends trace events to file of current process.
+    Uses JSON array format, where the closing bracket is optional, so events
+    can be appended as they are recorded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.file = None
+
+    def write(self, event: dict):
+        """
+        Write single event, opening new file if in new process.
+        """
+        with self.lock:
+            pid = os.getpid()
+            if self.pid != pid:
+                self.pid = pid
+                self.file = open(f"{TRACE_DIR}/trace-{pid}.json", "w", encoding="utf-8")
+                self.file.write("[\n")
+            self.file.write(json.dumps(event))
+            self.file.write(",\n")
+            self.file.flush()
+
+
+writer = TraceWriter()
+
+
+def time_ns() -> int:
+    """
+    Get current wall-clock time in nanoseconds, as used by file_sys.c.
+    """
+    return time.time_ns()
+
+
+def is_sampled(trace_id: int) -> bool:
+    """
+    Whether request with trace ID is traced.
+    Depends only on the ID, so all processes make the same decision.
+    """
+    if TRACE_DIR is None or trace_id == 0:
+        return False
+    h = (trace_id * HASH_MULTIPLIER) % (1 << 64)
+    return h < SAMPLE_RATE * (1 << 64)
+
+
+def record_span(
+    name: str,
+    trace_id: int,
+    start_ns: int,
+    end_ns: int,
+    args: dict | None = None,
+):
+    """
+    Record span of stage of request, if request is sampled.
+    """
+    if not is_sampled(trace_id):
+        return
+    writer.write(
+        {
+            "name": name,
+            "cat": "request",
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {"trace_id": f"{trace_id:016x}", **(args or {})},
+        }
+    )
+
+
+class span:
+    """
+    Context manager recording span for code it contains.
+    """
+
+    def __init__(self, name: str, trace_id: int, args: dict | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_span(self.name, self.trace_id, self.start_ns, time_ns(), self.args)
+        return False
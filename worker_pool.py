@@ -0,0 +1,376 @@
+"""
+Pool of preforked worker processes for data operations.
+Workers are started once, with imports done and MinIO client created, and
+each path is assigned to a worker by consistent hashing, so all state for a
+file stays in one worker.
+"""
+
+import bisect
+import collections
+import errno
+import hashlib
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+from implementations import (
+    get_minio_client,
+    handle_io_request,
+    new_file_state,
+    remove_file_state,
+    send_output_int8,
+)
+import ringlog
+from tracing import record_span, time_ns
+
+# Number of points on hash ring per worker.
+NUM_VIRTUAL_NODES = 64
+
+# Requests outstanding at which a worker is not given new paths.
+DEFAULT_MAX_OUTSTANDING = 8
+
+# Seconds between checks of worker for idle files, even while busy.
+RELEASE_IDLE_INTERVAL = 1.0
+
+
+def hash_key(key: str) -> int:
+    """
+    Get position of key on hash ring.
+    """
+    return int.from_bytes(hashlib.md5(key.encode("UTF-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring of workers, with several points per worker.
+    """
+
+    def __init__(self, num_workers: int):
+        points = []
+        for w in range(num_workers):
+            for v in range(NUM_VIRTUAL_NODES):
+                points.append((hash_key(f"worker-{w}-{v}"), w))
+        points.sort()
+        self.positions = [p for p, _ in points]
+        self.workers = [w for _, w in points]
+        self.num_workers = num_workers
+
+    def candidates(self, key: str) -> list:
+        """
+        Get all workers in order of preference for key: the owner on the
+        ring first, then following distinct workers.
+        """
+        i = bisect.bisect(self.positions, hash_key(key))
+        r = []
+        for j in range(len(self.workers)):
+            w = self.workers[(i + j) % len(self.workers)]
+            if w not in r:
+                r.append(w)
+                if len(r) == self.num_workers:
+                    break
+        return r
+
+
+class TaggedQueue:
+    """
+    Output queue of worker that adds path and worker number to messages.
+    """
+
+    def __init__(self, queue_out: mp.Queue, worker: int):
+        self.queue_out = queue_out
+        self.worker = worker
+        self.minio_path = None
+
+    def put(self, msg: dict):
+        """
+        Put message on output queue, tagged with current path.
+        """
+        self.queue_out.put(
+            {**msg, "minio_path": self.minio_path, "worker": self.worker}
+        )
+
+
+def pool_worker(worker: int, queue_in: mp.Queue, queue_out: mp.Queue, config: dict):
+    """
+    Function run by each worker process.
+    Keeps state of each file it is assigned, until released or idle too long.
+    """
+    pid = os.getpid()
+    print(f"Worker {worker} started with PID {pid}.")
+    ringlog.install_dump_signal()
+    get_minio_client(config)
+    tagged_out = TaggedQueue(queue_out, worker)
+    files = {}
+    last_release_idle = time.time()
+
+    while True:
+        if time.time() - last_release_idle >= RELEASE_IDLE_INTERVAL:
+            release_idle(files, config["timeout_closed"], tagged_out)
+            last_release_idle = time.time()
+        try:
+            req = queue_in.get(timeout=RELEASE_IDLE_INTERVAL)
+        except queue.Empty:
+            continue
+        record_span("queue_wait", req["trace_id"], req["queued_ns"], time_ns())
+
+        minio_path = req["minio_path"]
+        if req["operation"] == "invalidate":
+            # Object changed remotely, so cached data must not be used, unless
+            # it has writes not yet written out.
+            tagged_out.minio_path = minio_path
+            tagged_out.put({"is_done": True})
+            if minio_path in files and not files[minio_path]["write_out"]:
+                release_file(files, minio_path, tagged_out)
+            continue
+        if minio_path not in files:
+            files[minio_path] = new_file_state(config, minio_path)
+            files[minio_path]["pinned_etag"] = req.get("etag")
+        file_config = files[minio_path]
+        file_config["last_used"] = time.time()
+        file_config["trace_id"] = req["trace_id"]
+
+        tagged_out.minio_path = minio_path
+        is_release = False
+        try:
+            is_release = handle_io_request(
+                req["operation"],
+                req["pipe_in"],
+                req["pipe_out"],
+                file_config,
+                tagged_out,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            # Error ends only this request, worker keeps other files.
+            print(f"Worker {worker} failed {req['operation']} on {minio_path}:", e)
+            remove_pipes(req)
+            is_release = not file_config["write_out"]
+        finally:
+            tagged_out.minio_path = minio_path
+            tagged_out.put({"is_done": True})
+        if is_release and not file_config["write_out"]:
+            release_file(files, minio_path, tagged_out)
+
+
+def remove_pipes(req: dict):
+    """
+    Remove pipes of failed request, if still there.
+    """
+    for p in (req["pipe_in"], req["pipe_out"]):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+
+
+def reply_error(req: dict, code: int):
+    """
+    Answer request with error, for request lost with its worker.
+    Opening pipes waits for the other end, so this is run in a thread.
+    """
+    try:
+        with (
+            open(req["pipe_in"], "rb"),
+            open(req["pipe_out"], "wb") as pipe_response,
+        ):
+            send_output_int8(pipe_response, code)
+    except OSError as e:
+        print(f"Error reply to {req['operation']} on {req['minio_path']} failed:", e)
+    remove_pipes(req)
+
+
+def release_file(files: dict, minio_path: str, tagged_out: TaggedQueue):
+    """
+    Drop state of file in worker, and tell pool it is no longer assigned.
+    """
+    file_config = files.pop(minio_path)
+    remove_file_state(file_config)
+    tagged_out.minio_path = minio_path
+    tagged_out.put({"released": True})
+
+
+def release_idle(files: dict, max_idle: float, tagged_out: TaggedQueue):
+    """
+    Release files not used for too long, unless they have data to write out.
+    """
+    now = time.time()
+    for minio_path, file_config in list(files.items()):
+        if not file_config["write_out"] and now - file_config["last_used"] > max_idle:
+            release_file(files, minio_path, tagged_out)
+
+
+class WorkerPool:
+    """
+    Fixed pool of worker processes, one per core by default.
+    Path stays with its worker while that worker holds state for it or has
+    requests for it; new paths go to the owner on the hash ring, unless it is
+    overloaded.
+    """
+
+    def __init__(self, config: dict, num_workers: int | None = None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        if config.get("memory_only"):
+            # Budget is for whole pool, and each worker has its own chunk store.
+            config = {
+                **config,
+                "memory_cache_budget": config["memory_cache_budget"]
+                // self.num_workers,
+            }
+        self.max_outstanding = config.get(
+            "pool_max_outstanding", DEFAULT_MAX_OUTSTANDING
+        )
+        self.config = config
+        self.ring = HashRing(self.num_workers)
+        self.queue_out = mp.Queue()
+        self.queues_in = [mp.Queue() for _ in range(self.num_workers)]
+        self.processes = [None] * self.num_workers
+        self.outstanding = [0] * self.num_workers
+        # Requests sent to each worker and not done yet, in order of sending,
+        # which is the order worker handles them.
+        self.pending = [collections.deque() for _ in range(self.num_workers)]
+        self.path_outstanding = {}
+        self.assigned = {}
+
+        for w in range(self.num_workers):
+            self.start_worker(w)
+        print(f"Started pool of {self.num_workers} workers.")
+
+    def start_worker(self, w: int):
+        """
+        Start process of worker number w.
+        """
+        p = mp.Process(
+            target=pool_worker,
+            args=(w, self.queues_in[w], self.queue_out, self.config),
+            daemon=True,
+        )
+        p.start()
+        self.processes[w] = p
+
+    def check_workers(self):
+        """
+        Restart workers that died. Paths assigned to dead worker lose their
+        state, requests still queued for it go to the new process, and
+        requests it was handling are answered with an error.
+        """
+        for w, p in enumerate(self.processes):
+            if p.is_alive():
+                continue
+            num_files = sum(a == w for a in self.assigned.values())
+            print(
+                f"Worker {w} with PID {p.pid} exited with code {p.exitcode}, "
+                f"restart it; state of {num_files} files lost."
+            )
+
+            # Queue may be broken if worker died while using it, so move
+            # requests still queued to new queue.
+            old_queue = self.queues_in[w]
+            self.queues_in[w] = mp.Queue()
+            requeued = []
+            while True:
+                try:
+                    req = old_queue.get(timeout=0.1)
+                except queue.Empty:
+                    break
+                self.queues_in[w].put(req)
+                requeued.append(req)
+
+            # Requests sent before those still queued were taken by worker.
+            pending = self.pending[w]
+            for _ in range(len(pending) - len(requeued)):
+                req = pending.popleft()
+                self.request_done(req["minio_path"])
+                if req["operation"] != "invalidate":
+                    threading.Thread(
+                        target=reply_error, args=(req, -errno.EIO), daemon=True
+                    ).start()
+            self.outstanding[w] = len(pending)
+            for path in [path for path, a in self.assigned.items() if a == w]:
+                if path not in self.path_outstanding:
+                    del self.assigned[path]
+            self.start_worker(w)
+
+    def request_done(self, minio_path: str):
+        """
+        Count request for path as done.
+        """
+        n = self.path_outstanding.get(minio_path, 0) - 1
+        if n > 0:
+            self.path_outstanding[minio_path] = n
+        else:
+            self.path_outstanding.pop(minio_path, None)
+
+    def assign(self, minio_path: str) -> int:
+        """
+        Get worker for path, assigning one if not already assigned.
+        """
+        if minio_path in self.assigned:
+            return self.assigned[minio_path]
+
+        candidates = self.ring.candidates(minio_path)
+        w = next(
+            (c for c in candidates if self.outstanding[c] < self.max_outstanding),
+            None,
+        )
+        if w is None:
+            w = min(candidates, key=lambda c: self.outstanding[c])
+        if w != candidates[0]:
+            print(f"Worker {candidates[0]} overloaded, assign {minio_path} to {w}.")
+        self.assigned[minio_path] = w
+        return w
+
+    def submit(self, minio_path: str, request: dict):
+        """
+        Send request for path to its worker.
+        """
+        w = self.assign(minio_path)
+        request = {**request, "minio_path": minio_path}
+        self.outstanding[w] += 1
+        self.pending[w].append(request)
+        self.path_outstanding[minio_path] = self.path_outstanding.get(minio_path, 0) + 1
+        self.queues_in[w].put(request)
+
+    def invalidate(self, minio_path: str):
+        """
+        Tell worker of path, if any, that object changed remotely.
+        """
+        if minio_path in self.assigned:
+            self.submit(
+                minio_path,
+                {"operation": "invalidate", "trace_id": 0, "queued_ns": time_ns()},
+            )
+
+    def poll(self, metadata_store):
+        """
+        Handle outputs available from workers: completed requests, metadata
+        updates and released paths.
+        Then restart any workers that died.
+        """
+        while True:
+            try:
+                r = self.queue_out.get_nowait()
+            except queue.Empty:
+                break
+
+            minio_path = r["minio_path"]
+            if r.get("is_done"):
+                # Not below zero, as count is reset when worker restarted.
+                w = r["worker"]
+                self.outstanding[w] = max(0, self.outstanding[w] - 1)
+                if self.pending[w]:
+                    self.pending[w].popleft()
+                self.request_done(minio_path)
+            if r.get("released") and minio_path not in self.path_outstanding:
+                # Requests still queued for path keep it with its worker.
+                self.assigned.pop(minio_path, None)
+            if "metadata_cur" in r:
+                if r["metadata_cur"] is None:
+                    metadata_store.remove(minio_path)
+                else:
+                    metadata_store.set(minio_path, r["metadata_cur"])
+            if "metadata_new" in r:
+                meta_new = r["metadata_new"]
+                if meta_new["minio_path"] not in metadata_store:
+                    metadata_store.set(meta_new["minio_path"], meta_new)
+        self.check_workers()